@@ -72,7 +72,11 @@ class SystemEventVmStop(event.Event):
     pass
 
 class SystemEventBreakpoint(event.CpuEvent):
-    """Emitted when a breakpoint is hit within the guest."""
+    """Emitted when a breakpoint is hit within the guest.
+
+    The "gpa" param may either be a single GPA or a frozenset of GPAs. In the
+    latter case, breakpoints will be set on all GPAs in the set.
+    """
     params = {
                 "gpa": None,
               }
@@ -96,6 +100,9 @@ class SystemEventBreakpoint(event.CpuEvent):
         if gpa is None:
             return True
 
+        if isinstance(gpa, frozenset):
+            return event.gpa in gpa
+
         if gpa == event.gpa:
             return True
 
@@ -107,7 +114,12 @@ class SingleStepMethod(Enum):
     MTF = 1
 
 class SystemEventSingleStep(event.CpuEvent):
-    """Emitted after a single step was executed."""
+    """Emitted after a single step was executed.
+
+    The "method" request parameter is a hint for the single step service.  A
+    CPU is only single stepped with a single method, thus callbacks are not
+    filtered by method.
+    """
     params = {
                 "cpu_num": None,
                 "method": None
@@ -126,12 +138,8 @@ class SystemEventSingleStep(event.CpuEvent):
         if type(event) != cls:
             return False
         cpu_num = cb_params.get("cpu_num", cls.params["cpu_num"])
-        method = cb_params.get("method", cls.params["method"])
 
         if (cpu_num is not None and
                 cpu_num != event.cpu_num):
             return False
-        if (method is not None and
-                method != event.method):
-            return False
         return True
@@ -22,10 +22,70 @@
 This file contains all python definitions (see tenjint_x86_64.pyx for the Cython
 definitions of the API) that are specific for x86-64.
 """
+import numpy
+
 from . import api
 from .. import event
 from .. import service
 
+# Bits of the LBR_SELECT MSR. A set bit suppresses the recording of the
+# respective branches.
+LBR_SELECT_CPL_EQ_0 = 1 << 0
+"""Do not record branches that end in ring 0."""
+LBR_SELECT_CPL_NEQ_0 = 1 << 1
+"""Do not record branches that end in rings other than ring 0."""
+LBR_SELECT_JCC = 1 << 2
+"""Do not record conditional branches."""
+LBR_SELECT_NEAR_REL_CALL = 1 << 3
+"""Do not record near relative calls."""
+LBR_SELECT_NEAR_IND_CALL = 1 << 4
+"""Do not record near indirect calls."""
+LBR_SELECT_NEAR_RET = 1 << 5
+"""Do not record near returns."""
+LBR_SELECT_NEAR_IND_JMP = 1 << 6
+"""Do not record near indirect jumps."""
+LBR_SELECT_NEAR_REL_JMP = 1 << 7
+"""Do not record near relative jumps."""
+LBR_SELECT_FAR_BRANCH = 1 << 8
+"""Do not record far branches."""
+LBR_SELECT_EN_CALLSTACK = 1 << 9
+"""Enable the call stack mode, in which returns remove the matching calls."""
+
+LBR_SELECT_CALLS = (LBR_SELECT_JCC | LBR_SELECT_NEAR_RET |
+                    LBR_SELECT_NEAR_IND_JMP | LBR_SELECT_NEAR_REL_JMP |
+                    LBR_SELECT_FAR_BRANCH)
+"""Only record calls."""
+LBR_SELECT_RETURNS = (LBR_SELECT_JCC | LBR_SELECT_NEAR_REL_CALL |
+                      LBR_SELECT_NEAR_IND_CALL | LBR_SELECT_NEAR_IND_JMP |
+                      LBR_SELECT_NEAR_REL_JMP | LBR_SELECT_FAR_BRANCH)
+"""Only record returns."""
+LBR_SELECT_USER = LBR_SELECT_CPL_EQ_0
+"""Only record branches that end in user mode."""
+LBR_SELECT_KERNEL = LBR_SELECT_CPL_NEQ_0
+"""Only record branches that end in kernel mode."""
+
+def lbr_select_merge(selects):
+    """Merge the LBR filters of multiple users.
+
+    Since set bits suppress branches, the merged filter records every branch
+    that is recorded by any of the given filters. The call stack mode is only
+    enabled if all filters enable it.
+
+    Parameters
+    ----------
+    selects : iterable of int
+        The values of the LBR_SELECT MSR.
+
+    Returns
+    -------
+    int
+        The merged value.
+    """
+    rv = None
+    for select in selects:
+        rv = select if rv is None else rv & select
+    return 0 if rv is None else rv
+
 class LBRState(object):
     """Represents the state of the LBR."""
     def __init__(self, tos, lbr_from, lbr_to):
@@ -35,6 +95,26 @@ class LBRState(object):
         self.lbr_to = lbr_to
         self.size = min(len(self.lbr_from), len(self.lbr_to))
 
+    def ordered(self):
+        """Get the records from the oldest to the most recent one.
+
+        Entries that were never written are skipped.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The source and the target addresses of the branches as uint64
+            arrays.
+        """
+        if not self.size:
+            empty = numpy.empty(0, dtype=numpy.uint64)
+            return empty, empty
+        idx = (numpy.arange(1, self.size + 1) + self.tos) % self.size
+        lbr_from = numpy.asarray(self.lbr_from, dtype=numpy.uint64)[idx]
+        lbr_to = numpy.asarray(self.lbr_to, dtype=numpy.uint64)[idx]
+        valid = (lbr_from != 0) | (lbr_to != 0)
+        return lbr_from[valid], lbr_to[valid]
+
     def __repr__(self):
         # Try to get the OS
         os = None
@@ -43,23 +123,27 @@ class LBRState(object):
         except (KeyError, ValueError):
             pass
 
+        # Resolve all symbols at once
+        if os is not None:
+            syms = os.get_nearest_symbols_by_addresses(
+                                                list(self.lbr_from[:self.size]) +
+                                                list(self.lbr_to[:self.size]))
+
         result = "LBR State - TOS: {}\n".format(self.tos)
         result += "{}\n".format("-" * 46)
         for i in range(0, self.size):
             cur = (self.tos - i) % self.size
             # Resolve symbols
             if os is not None:
-                fsym = os.get_nearest_symbol_by_address(self.lbr_from[cur])
-                tsym = os.get_nearest_symbol_by_address(self.lbr_to[cur])
-                symbols = "\n      ({} -> {})".format(fsym[0] if fsym else "",
-                                                      tsym[0] if tsym else "")
+                symbols = "\n      ({} -> {})".format(syms[cur],
+                                                      syms[self.size + cur])
             else:
                 symbols = ""
             # Print
             result += "[{:2d}]  {:#18x} -> {:#18x}  {}\n".format(cur,
-                                                             self.lbr_from[cur],
-                                                             self.lbr_to[cur],
-                                                             symbols)
+                                                        int(self.lbr_from[cur]),
+                                                        int(self.lbr_to[cur]),
+                                                        symbols)
         return result
 
 class SystemEventTaskSwitch(event.CpuEvent):
@@ -83,11 +83,11 @@ def tenjint_api_get_ram_size():
 def tenjint_api_get_num_cpus():
     return vmi_api_get_num_cpus()
 
-def tenjint_api_slp_update(gpa, r=False, w=False, x=False):
+def tenjint_api_slp_update(gpa, r=False, w=False, x=False, num_pages=1):
     cdef kvm_vmi_slp_perm c_slp_perm
     cdef int rv
     c_slp_perm.gfn = gpa >> api.PAGE_SHIFT
-    c_slp_perm.num_pages = 1
+    c_slp_perm.num_pages = num_pages
     c_slp_perm.perm = KVM_VMI_SLP_R if r else 0
     c_slp_perm.perm |= KVM_VMI_SLP_W if w else 0
     c_slp_perm.perm |= KVM_VMI_SLP_X if x else 0
@@ -135,6 +135,24 @@ cdef extern from "arm/cpu.h":
         uint64_t vttbr_el2
         TCR tcr_el[4]
         TCR vtcr_el2
+        uint64_t sctlr_el[4]
+        uint64_t mair_el[4]
+        uint64_t vbar_el[4]
+        uint64_t esr_el[4]
+        uint64_t far_el[4]
+        uint64_t tpidr_el[4]
+        uint64_t tpidrro_el[1]
+        uint64_t mdscr_el1
+        uint64_t dbgbvr[16]
+        uint64_t dbgbcr[16]
+        uint64_t dbgwvr[16]
+        uint64_t dbgwcr[16]
+
+    ctypedef struct ARMVectorReg:
+        pass
+
+    struct _vfp_t:
+        ARMVectorReg zregs[32]
 
     struct CPUARMState:
         uint32_t regs[16]
@@ -144,30 +162,110 @@ cdef extern from "arm/cpu.h":
         uint32_t aarch64
         uint64_t elr_el[4]
         uint64_t sp_el[4]
+        uint64_t banked_spsr[8]
         _cp15_t cp15
+        _vfp_t vfp
 
     struct ARMCPU:
         CPUARMState env
 
+    uint32_t pstate_read(CPUARMState *env)
+    void pstate_write(CPUARMState *env, uint32_t val)
+    uint32_t vfp_get_fpsr(CPUARMState *env)
+    void vfp_set_fpsr(CPUARMState *env, uint32_t val)
+    uint32_t vfp_get_fpcr(CPUARMState *env)
+    void vfp_set_fpcr(CPUARMState *env, uint32_t val)
+
 cdef extern from "arm/vmi_api.h":
     CPUARMState* vmi_api_get_cpu_state(uint32_t)
 
 cdef class Aarch64SavedState:
     cdef uint64_t xregs[32]
     cdef uint64_t pc
+    cdef uint32_t pstate
     cdef uint64_t sp_el[4];
+    cdef uint64_t elr_el[4];
+    cdef uint64_t ttbr0_el[4];
+    cdef uint64_t ttbr1_el[4];
+    cdef TCR tcr_el[4];
+    cdef uint64_t banked_spsr[8]
+    cdef ARMVectorReg zregs[32]
+    cdef uint32_t fpsr
+    cdef uint32_t fpcr
+    cdef uint64_t sctlr_el[4]
+    cdef uint64_t mair_el[4]
+    cdef uint64_t vbar_el[4]
+    cdef uint64_t esr_el[4]
+    cdef uint64_t far_el[4]
+    cdef uint64_t tpidr_el[4]
+    cdef uint64_t tpidrro_el[1]
+    cdef uint64_t mdscr_el1
+    cdef uint64_t dbgbvr[16]
+    cdef uint64_t dbgbcr[16]
+    cdef uint64_t dbgwvr[16]
+    cdef uint64_t dbgwcr[16]
 
     def __cinit__(self, state):
         cdef CPUARMState *_state = (<Aarch64CpuState>state).state()
         self.pc = _state.pc
+        self.pstate = pstate_read(_state)
         memcpy(self.xregs, _state.xregs, sizeof(self.xregs))
         memcpy(self.sp_el, _state.sp_el, sizeof(self.sp_el))
+        memcpy(self.elr_el, _state.elr_el, sizeof(self.elr_el))
+        memcpy(self.ttbr0_el, _state.cp15.ttbr0_el, sizeof(self.ttbr0_el))
+        memcpy(self.ttbr1_el, _state.cp15.ttbr1_el, sizeof(self.ttbr1_el))
+        memcpy(self.tcr_el, _state.cp15.tcr_el, sizeof(self.tcr_el))
+        memcpy(self.banked_spsr, _state.banked_spsr, sizeof(self.banked_spsr))
+
+        memcpy(self.zregs, _state.vfp.zregs, sizeof(self.zregs))
+        self.fpsr = vfp_get_fpsr(_state)
+        self.fpcr = vfp_get_fpcr(_state)
+
+        memcpy(self.sctlr_el, _state.cp15.sctlr_el, sizeof(self.sctlr_el))
+        memcpy(self.mair_el, _state.cp15.mair_el, sizeof(self.mair_el))
+        memcpy(self.vbar_el, _state.cp15.vbar_el, sizeof(self.vbar_el))
+        memcpy(self.esr_el, _state.cp15.esr_el, sizeof(self.esr_el))
+        memcpy(self.far_el, _state.cp15.far_el, sizeof(self.far_el))
+        memcpy(self.tpidr_el, _state.cp15.tpidr_el, sizeof(self.tpidr_el))
+        memcpy(self.tpidrro_el, _state.cp15.tpidrro_el,
+               sizeof(self.tpidrro_el))
+
+        self.mdscr_el1 = _state.cp15.mdscr_el1
+        memcpy(self.dbgbvr, _state.cp15.dbgbvr, sizeof(self.dbgbvr))
+        memcpy(self.dbgbcr, _state.cp15.dbgbcr, sizeof(self.dbgbcr))
+        memcpy(self.dbgwvr, _state.cp15.dbgwvr, sizeof(self.dbgwvr))
+        memcpy(self.dbgwcr, _state.cp15.dbgwcr, sizeof(self.dbgwcr))
 
     def restore(self, state):
         cdef CPUARMState *_state = (<Aarch64CpuState>state).state()
         _state.pc = self.pc
+        pstate_write(_state, self.pstate)
         memcpy(_state.xregs, self.xregs, sizeof(_state.xregs))
         memcpy(_state.sp_el, self.sp_el, sizeof(_state.sp_el))
+        memcpy(_state.elr_el, self.elr_el, sizeof(_state.elr_el))
+        memcpy(_state.cp15.ttbr0_el, self.ttbr0_el, sizeof(_state.cp15.ttbr0_el))
+        memcpy(_state.cp15.ttbr1_el, self.ttbr1_el, sizeof(_state.cp15.ttbr1_el))
+        memcpy(_state.cp15.tcr_el, self.tcr_el, sizeof(_state.cp15.tcr_el))
+        memcpy(_state.banked_spsr, self.banked_spsr, sizeof(_state.banked_spsr))
+
+        memcpy(_state.vfp.zregs, self.zregs, sizeof(_state.vfp.zregs))
+        vfp_set_fpsr(_state, self.fpsr)
+        vfp_set_fpcr(_state, self.fpcr)
+
+        memcpy(_state.cp15.sctlr_el, self.sctlr_el, sizeof(_state.cp15.sctlr_el))
+        memcpy(_state.cp15.mair_el, self.mair_el, sizeof(_state.cp15.mair_el))
+        memcpy(_state.cp15.vbar_el, self.vbar_el, sizeof(_state.cp15.vbar_el))
+        memcpy(_state.cp15.esr_el, self.esr_el, sizeof(_state.cp15.esr_el))
+        memcpy(_state.cp15.far_el, self.far_el, sizeof(_state.cp15.far_el))
+        memcpy(_state.cp15.tpidr_el, self.tpidr_el, sizeof(_state.cp15.tpidr_el))
+        memcpy(_state.cp15.tpidrro_el, self.tpidrro_el,
+               sizeof(_state.cp15.tpidrro_el))
+
+        _state.cp15.mdscr_el1 = self.mdscr_el1
+        memcpy(_state.cp15.dbgbvr, self.dbgbvr, sizeof(_state.cp15.dbgbvr))
+        memcpy(_state.cp15.dbgbcr, self.dbgbcr, sizeof(_state.cp15.dbgbcr))
+        memcpy(_state.cp15.dbgwvr, self.dbgwvr, sizeof(_state.cp15.dbgwvr))
+        memcpy(_state.cp15.dbgwcr, self.dbgwcr, sizeof(_state.cp15.dbgwcr))
 
 cdef class Aarch64CpuState:
     cdef CPUARMState *_qemu_arm_cpu_state
@@ -187,9 +285,15 @@ cdef class Aarch64CpuState:
     def save_state(self):
         """Save the current state of the vCPU.
 
-        This function will return the current state of the vCPU.
-        Not all parts of the state will be saved, but only the general purpose
-        registers, the eip, and the efer. A saved state can be restored using
+        This function will return the current state of the vCPU. The saved
+        state contains the general purpose registers, the pc, the pstate, the
+        stack pointers, the exception link and saved program status registers,
+        the SIMD/FP registers including the FPSR and the FPCR, and the debug
+        registers. Of the system registers, the translation, memory attribute,
+        and system control registers, the vector base, syndrome, and fault
+        address registers, and the thread ID registers are saved. All other
+        system registers, e.g., the timers and the interrupt controller, are
+        not part of the saved state. A saved state can be restored using
         `restore_state`.
 
         Returns
@@ -725,3 +829,19 @@ def tenjint_api_update_feature_debug(cpu_num, enable, single_step=False,
         raise api.QemuFeatureError("Debug feature update returned {}".format(rv))
 
     return rv
+
+def tenjint_api_update_feature_debug_bps(enable, gpas):
+    cdef kvm_vmi_feature c_feature
+
+    c_feature.feature = KVM_VMI_FEATURE_DEBUG
+    c_feature.debug.enable = enable
+    c_feature.debug.single_step = False
+    c_feature.debug.watchpoint = False
+
+    for gpa in gpas:
+        c_feature.debug.addr = gpa
+        rv = tenjintapi.vmi_api_feature_update_all(&c_feature)
+
+        if rv < 0:
+            raise api.QemuFeatureError("Debug feature update for 0x{:x} "
+                                       "returned {}".format(gpa, rv))
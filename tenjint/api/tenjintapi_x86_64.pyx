@@ -176,12 +176,20 @@ cdef extern from "i386/cpu.h":
     const int R_LDTR
     const int R_TR
 
+    const int NB_OPMASK_REGS
+
     struct SegmentCache:
         uint32_t selector
         target_ulong base
         uint32_t limit
         uint32_t flags
 
+    ctypedef union FPReg:
+        pass
+
+    ctypedef union ZMMReg:
+        pass
+
     struct CPUX86State:
         target_ulong regs[CPU_NB_REGS]
         target_ulong eip
@@ -196,6 +204,31 @@ cdef extern from "i386/cpu.h":
         target_ulong cr[5]
 
         uint64_t efer
+        target_ulong kernelgsbase
+
+        unsigned int fpstt
+        uint16_t fpus
+        uint16_t fpuc
+        uint8_t fptags[8]
+        FPReg fpregs[8]
+        uint32_t mxcsr
+        ZMMReg xmm_regs[32]
+        uint64_t opmask_regs[NB_OPMASK_REGS]
+        uint64_t xstate_bv
+        uint64_t xcr0
+        uint32_t pkru
+
+        target_ulong dr[8]
+
+        uint32_t sysenter_cs
+        target_ulong sysenter_esp
+        target_ulong sysenter_eip
+        uint64_t star
+        target_ulong cstar
+        target_ulong lstar
+        target_ulong fmask
+        uint64_t tsc_aux
+        uint64_t pat
 
     struct X86CPU:
         CPUX86State env
@@ -257,19 +290,110 @@ cdef class X86SegmentState:
 cdef class X86SavedState:
     cdef target_ulong regs[CPU_NB_REGS]
     cdef target_ulong eip
+    cdef target_ulong eflags
+    cdef target_ulong cr[5]
     cdef uint64_t efer
+    cdef target_ulong kernelgsbase
+    cdef SegmentCache segs[6]
+    cdef SegmentCache ldt
+    cdef SegmentCache tr
+    cdef SegmentCache gdt
+    cdef SegmentCache idt
+    cdef unsigned int fpstt
+    cdef uint16_t fpus
+    cdef uint16_t fpuc
+    cdef uint8_t fptags[8]
+    cdef FPReg fpregs[8]
+    cdef uint32_t mxcsr
+    cdef ZMMReg xmm_regs[32]
+    cdef uint64_t opmask_regs[NB_OPMASK_REGS]
+    cdef uint64_t xstate_bv
+    cdef uint64_t xcr0
+    cdef uint32_t pkru
+    cdef target_ulong dr[8]
+    cdef uint32_t sysenter_cs
+    cdef target_ulong sysenter_esp
+    cdef target_ulong sysenter_eip
+    cdef uint64_t star
+    cdef target_ulong cstar
+    cdef target_ulong lstar
+    cdef target_ulong fmask
+    cdef uint64_t tsc_aux
+    cdef uint64_t pat
 
     def __cinit__(self, state):
         cdef CPUX86State *_state = (<X86CpuState>state).state()
         self.eip = _state.eip
+        self.eflags = _state.eflags
         self.efer = _state.efer
+        self.kernelgsbase = _state.kernelgsbase
         memcpy(self.regs, _state.regs, sizeof(self.regs))
+        memcpy(self.cr, _state.cr, sizeof(self.cr))
+        memcpy(self.segs, _state.segs, sizeof(self.segs))
+        self.ldt = _state.ldt
+        self.tr = _state.tr
+        self.gdt = _state.gdt
+        self.idt = _state.idt
+
+        self.fpstt = _state.fpstt
+        self.fpus = _state.fpus
+        self.fpuc = _state.fpuc
+        memcpy(self.fptags, _state.fptags, sizeof(self.fptags))
+        memcpy(self.fpregs, _state.fpregs, sizeof(self.fpregs))
+        self.mxcsr = _state.mxcsr
+        memcpy(self.xmm_regs, _state.xmm_regs, sizeof(self.xmm_regs))
+        memcpy(self.opmask_regs, _state.opmask_regs, sizeof(self.opmask_regs))
+        self.xstate_bv = _state.xstate_bv
+        self.xcr0 = _state.xcr0
+        self.pkru = _state.pkru
+        memcpy(self.dr, _state.dr, sizeof(self.dr))
+
+        self.sysenter_cs = _state.sysenter_cs
+        self.sysenter_esp = _state.sysenter_esp
+        self.sysenter_eip = _state.sysenter_eip
+        self.star = _state.star
+        self.cstar = _state.cstar
+        self.lstar = _state.lstar
+        self.fmask = _state.fmask
+        self.tsc_aux = _state.tsc_aux
+        self.pat = _state.pat
 
     def restore(self, state):
         cdef CPUX86State *_state = (<X86CpuState>state).state()
         _state.eip = self.eip
+        _state.eflags = self.eflags
         _state.efer = self.efer
+        _state.kernelgsbase = self.kernelgsbase
         memcpy(_state.regs, self.regs, sizeof(_state.regs))
+        memcpy(_state.cr, self.cr, sizeof(_state.cr))
+        memcpy(_state.segs, self.segs, sizeof(_state.segs))
+        _state.ldt = self.ldt
+        _state.tr = self.tr
+        _state.gdt = self.gdt
+        _state.idt = self.idt
+
+        _state.fpstt = self.fpstt
+        _state.fpus = self.fpus
+        _state.fpuc = self.fpuc
+        memcpy(_state.fptags, self.fptags, sizeof(_state.fptags))
+        memcpy(_state.fpregs, self.fpregs, sizeof(_state.fpregs))
+        _state.mxcsr = self.mxcsr
+        memcpy(_state.xmm_regs, self.xmm_regs, sizeof(_state.xmm_regs))
+        memcpy(_state.opmask_regs, self.opmask_regs, sizeof(_state.opmask_regs))
+        _state.xstate_bv = self.xstate_bv
+        _state.xcr0 = self.xcr0
+        _state.pkru = self.pkru
+        memcpy(_state.dr, self.dr, sizeof(_state.dr))
+
+        _state.sysenter_cs = self.sysenter_cs
+        _state.sysenter_esp = self.sysenter_esp
+        _state.sysenter_eip = self.sysenter_eip
+        _state.star = self.star
+        _state.cstar = self.cstar
+        _state.lstar = self.lstar
+        _state.fmask = self.fmask
+        _state.tsc_aux = self.tsc_aux
+        _state.pat = self.pat
 
 cdef class X86CpuState:
     cdef CPUX86State *_qemu_x86_cpu_state
@@ -337,9 +461,14 @@ cdef class X86CpuState:
     def save_state(self):
         """Save the current state of the vCPU.
 
-        This function will return the current state of the vCPU.
-        Not all parts of the state will be saved, but only the general purpose
-        registers, the eip, and the efer. A saved state can be restored using
+        This function will return the current state of the vCPU. The saved
+        state contains the general purpose registers, the eip, the eflags, the
+        control registers, all segment and descriptor table registers, the
+        x87, SSE, AVX, and AVX-512 registers (including the XCR0 and the
+        PKRU), and the debug registers. Of the MSRs, the EFER, the kernel GS
+        base, the SYSENTER and SYSCALL MSRs, the TSC_AUX, and the PAT are
+        saved. All other MSRs, e.g., the TSC and the APIC state, are not part
+        of the saved state. A saved state can be restored using
         `restore_state`.
 
         Returns
@@ -583,6 +712,15 @@ cdef class X86CpuState:
         self._dirty = 1
         self._qemu_x86_cpu_state.efer = numpy.uint64(value)
 
+    @property
+    def kernel_gs_base(self):
+        return self._qemu_x86_cpu_state.kernelgsbase
+
+    @kernel_gs_base.setter
+    def kernel_gs_base(self, value):
+        self._dirty = 1
+        self._qemu_x86_cpu_state.kernelgsbase = numpy.uint64(value)
+
     @property
     def is_paging_set(self):
         """Is the paging bit set."""
@@ -775,11 +913,12 @@ def tenjint_api_lbr_get(cpu_num):
     if rv < 0:
         raise api.QemuFeatureError("LBR get request returned {}".format(rv))
 
-    lbr_from = list()
-    lbr_to = list()
-    for i in range(lbr_state.entries):
-        lbr_from.append(lbr_state.lbr_from[i])
-        lbr_to.append(lbr_state.lbr_to[i])
+    # Copy the records into numpy arrays without creating Python integers
+    size = min(lbr_state.entries, MAX_LBR_ENTRIES) * sizeof(__u64)
+    lbr_from = numpy.frombuffer((<char *>lbr_state.lbr_from)[:size],
+                                dtype=numpy.uint64)
+    lbr_to = numpy.frombuffer((<char *>lbr_state.lbr_to)[:size],
+                              dtype=numpy.uint64)
 
     return api_x86_64.LBRState(lbr_state.tos, lbr_from, lbr_to)
 
@@ -810,6 +949,22 @@ def tenjint_api_update_feature_debug(cpu_num, enable, single_step=False,
 
     return rv
 
+def tenjint_api_update_feature_debug_bps(enable, gpas):
+    cdef kvm_vmi_feature c_feature
+
+    c_feature.feature = KVM_VMI_FEATURE_DEBUG
+    c_feature.debug.enable = enable
+    c_feature.debug.single_step = False
+    c_feature.debug.watchpoint = False
+
+    for gpa in gpas:
+        c_feature.debug.addr = gpa
+        rv = tenjintapi.vmi_api_feature_update_all(&c_feature)
+
+        if rv < 0:
+            raise api.QemuFeatureError("Debug feature update for 0x{:x} "
+                                       "returned {}".format(gpa, rv))
+
 def tenjint_api_update_feature_mtf(cpu_num, enable):
     cdef kvm_vmi_feature c_feature
 
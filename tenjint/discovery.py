@@ -0,0 +1,294 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Sebastian Vogl <sebastian@bedrocksystems.com>
+#          Jonas Pfoh <jonas@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Fast discovery of the guest kernel.
+
+This module provides a parallel scan of the guest physical memory for the
+kernel banner. Physical memory is split into chunks that are scanned with
+numpy, either by a process pool that maps a file backing the guest RAM or by a
+thread pool that scans chunks read through the API. From the location of the
+banner the DTB and the virtual KASLR slide of the kernel are derived.
+
+At the moment only 64-bit Linux guests on x86-64 are supported. For all other
+guests :py:func:`find_kernel` returns None and the caller should fall back to
+Rekall's discovery.
+"""
+
+import concurrent.futures
+import os
+
+import numpy
+
+from . import api
+from .logger import logger
+
+START_KERNEL_MAP = 0xffffffff80000000
+"""The virtual base address of the x86-64 Linux kernel image."""
+
+KERNEL_IMAGE_SIZE = 1 << 30
+"""The size of the virtual region the x86-64 Linux kernel image is placed in."""
+
+KERNEL_ALIGN = 2 << 20
+"""The alignment of the x86-64 Linux kernel image, physically and virtually."""
+
+BANNER = b"Linux version "
+"""The prefix of the Linux kernel banner."""
+
+def find_pattern(data, pattern):
+    """Find all occurrences of a pattern.
+
+    The first eight bytes of the pattern are compared as a single 64-bit word
+    at each of the eight possible alignments. The few remaining candidates are
+    then compared with the full pattern.
+
+    Parameters
+    ----------
+    data : bytes or numpy.ndarray
+        The data to scan.
+    pattern : bytes
+        The pattern to search for, at least eight bytes long.
+
+    Returns
+    -------
+    numpy.ndarray
+        The sorted offsets of all occurrences.
+    """
+    arr = numpy.frombuffer(data, dtype=numpy.uint8)
+    limit = len(arr) - len(pattern) + 1
+    if limit <= 0:
+        return numpy.empty(0, dtype=numpy.int64)
+
+    word = numpy.frombuffer(pattern[:8], dtype=numpy.uint64)[0]
+    candidates = list()
+    for alignment in range(8):
+        count = (limit - alignment + 7) // 8
+        end = alignment + count * 8
+        if end > len(arr):
+            count -= 1
+            end -= 8
+        if count <= 0:
+            continue
+        words = arr[alignment:end].view(numpy.uint64)
+        candidates.append(numpy.flatnonzero(words == word) * 8 + alignment)
+    candidates = numpy.sort(numpy.concatenate(candidates))
+
+    rest = numpy.frombuffer(pattern, dtype=numpy.uint8)
+    for i in range(8, len(pattern)):
+        if not len(candidates):
+            break
+        candidates = candidates[arr[candidates + i] == rest[i]]
+    return candidates[candidates < limit]
+
+def _scan_file(path, offset, size, pattern, start):
+    data = numpy.memmap(path, dtype=numpy.uint8, mode="r", offset=offset,
+                        shape=(size,))
+    try:
+        return (find_pattern(data, pattern) + start).tolist()
+    finally:
+        del data
+
+def _scan_buffer(data, start, pattern):
+    return (find_pattern(data, pattern) + start).tolist()
+
+def _chunks(ram_ranges, chunk_size, overlap):
+    """Split the RAM into chunks.
+
+    Yields
+    ------
+    tuple (int, int, int)
+        The physical address, the size, and the offset within the RAM, i.e.,
+        within a file that backs the RAM, of every chunk.
+    """
+    offset = 0
+    for range_start, range_size in ram_ranges:
+        for start in range(range_start, range_start + range_size, chunk_size):
+            delta = start - range_start
+            yield (start, min(chunk_size + overlap, range_size - delta),
+                   offset + delta)
+        offset += range_size
+
+def _read(start, size):
+    """Read physical memory, pages that cannot be read are read as zeros."""
+    try:
+        return api.tenjint_api_read_phys_mem(start, size)
+    except RuntimeError:
+        pass
+
+    rv = list()
+    end = start + size
+    while start < end:
+        page_end = (start & ~(api.PAGE_SIZE - 1)) + api.PAGE_SIZE
+        length = min(end, page_end) - start
+        try:
+            rv.append(api.tenjint_api_read_phys_mem(start, length))
+        except RuntimeError:
+            rv.append(b"\x00" * length)
+        start += length
+    return b"".join(rv)
+
+def _candidate(profile, gpa):
+    """Derive the KASLR slide and DTB from the location of the banner.
+
+    The kernel is moved independently in physical and virtual memory. The DTB
+    is derived from the physical slide, the virtual slide is found by
+    translating the banner at every possible virtual location of the kernel.
+    """
+    banner = profile.get_constant("linux_banner")
+    pgd = (profile.get_constant("init_top_pgt") or
+           profile.get_constant("init_level4_pgt"))
+    if not banner or not pgd:
+        return None
+
+    phys_slide = gpa - (banner - START_KERNEL_MAP)
+    if phys_slide % KERNEL_ALIGN:
+        return None
+    dtb = pgd - START_KERNEL_MAP + phys_slide
+
+    for slide in range(0, START_KERNEL_MAP + KERNEL_IMAGE_SIZE - banner,
+                       KERNEL_ALIGN):
+        try:
+            if api.tenjint_api_vtop(banner + slide, dtb) == gpa:
+                return (dtb, slide)
+        except api.TranslationError:
+            pass
+    return None
+
+def scan(pattern, check, ram_ranges=None, ram_file=None, workers=None,
+         chunk_size=64 << 20):
+    """Scan the guest physical memory for a pattern.
+
+    Chunks of the guest RAM are scanned in parallel. The check function is
+    called with the physical address of every occurrence of the pattern
+    until it returns a value other than None.
+
+    Parameters
+    ----------
+    pattern : bytes
+        The pattern to search for, at least eight bytes long.
+    check : function
+        A function that validates an occurrence. It is called with the
+        physical address of the occurrence.
+    ram_ranges : list of tuple (int, int), optional
+        The guest physical address ranges of the RAM as (start, size) (see
+        :py:attr:`tenjint.plugins.machine.VirtualMachineBase.ram_ranges`).
+        Defaults to a single range from zero to the size of the RAM.
+    ram_file : str, optional
+        A file that backs the guest RAM, e.g., the mem-path of QEMU. If it is
+        given, chunks are scanned by a process pool that maps the file. The
+        RAM ranges must be stored back to back in the file. Otherwise, chunks
+        are read through the API and scanned by a thread pool. Pages that
+        cannot be read are skipped.
+    workers : int, optional
+        The number of workers. Defaults to the number of CPUs.
+    chunk_size : int, optional
+        The size of a chunk in bytes.
+
+    Returns
+    -------
+    object
+        The first value other than None that was returned by the check
+        function or None.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if ram_ranges is None:
+        ram_ranges = [(0, api.tenjint_api_get_ram_size())]
+    if ram_file is not None:
+        file_size = os.path.getsize(ram_file)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def submit(start, size, offset):
+        if ram_file is not None:
+            size = min(size, file_size - offset)
+            if size <= 0:
+                return None
+            return executor.submit(_scan_file, ram_file, offset, size, pattern,
+                                   start)
+        return executor.submit(_scan_buffer, _read(start, size), start,
+                               pattern)
+
+    rv = None
+    pending = set()
+    chunks = _chunks(ram_ranges, chunk_size, len(pattern) - 1)
+    try:
+        while rv is None:
+            # Keep a bounded number of chunks in flight
+            for start, size, offset in chunks:
+                future = submit(start, size, offset)
+                if future is not None:
+                    pending.add(future)
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+
+            done, pending = concurrent.futures.wait(pending,
+                            return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                for gpa in future.result():
+                    rv = check(gpa)
+                    if rv is not None:
+                        break
+                if rv is not None:
+                    break
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    return rv
+
+def find_kernel(profile, ram_ranges=None, ram_file=None, workers=None,
+                chunk_size=64 << 20):
+    """Find the kernel in the guest physical memory.
+
+    Parameters
+    ----------
+    profile : object
+        The Rekall profile or the :py:class:`tenjint.profile.CompactProfile`
+        of the guest.
+    ram_ranges : list of tuple (int, int), optional
+        The guest physical address ranges of the RAM. See :py:func:`scan`.
+    ram_file : str, optional
+        A file that backs the guest RAM. See :py:func:`scan`.
+    workers : int, optional
+        The number of workers. Defaults to the number of CPUs.
+    chunk_size : int, optional
+        The size of a chunk in bytes.
+
+    Returns
+    -------
+    tuple (int, int) or None
+        The DTB and the KASLR slide of the kernel or None if the kernel could
+        not be found.
+    """
+    if api.arch != api.Arch.X86_64 or api.os != api.OsType.OS_LINUX:
+        return None
+
+    def check(gpa):
+        rv = _candidate(profile, gpa)
+        if rv is not None:
+            logger.debug("Found kernel banner at 0x{:x}".format(gpa))
+        return rv
+
+    return scan(BANNER, check, ram_ranges=ram_ranges, ram_file=ram_file,
+                workers=workers, chunk_size=chunk_size)
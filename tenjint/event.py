@@ -391,12 +391,16 @@ class EventManager(logger.LoggerMixin):
 
     def _dispatch_event(self, event):
         self._logger.debug("Dispatching event: {}".format(event))
-        for callback in self._event_callbacks["*"]:
-            callback.deliver(event)
+        # Callbacks may request or cancel callbacks while they are invoked,
+        # thus we iterate over a copy and skip canceled callbacks.
+        for callback in list(self._event_callbacks["*"]):
+            if callback.active:
+                callback.deliver(event)
         event_key = type(event).__name__
         if event_key in self._event_callbacks:
-            for callback in self._event_callbacks[event_key]:
-                callback.deliver(event)
+            for callback in list(self._event_callbacks[event_key]):
+                if callback.active:
+                    callback.deliver(event)
 
     def _get_system_events(self):
         self._call_continue_hooks()
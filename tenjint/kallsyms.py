@@ -0,0 +1,337 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Symbols of Linux guests without a profile.
+
+The Linux kernel contains a compressed table of all its symbols, which is
+used to implement /proc/kallsyms. This module locates this table in the guest
+physical memory and decodes it into a :py:class:`tenjint.symbols.SymbolIndex`,
+such that symbols can be resolved without a Rekall profile.
+
+The tables are located by scanning for the digit tokens of the token table
+(see :py:func:`tenjint.discovery.scan`). Starting from the token table, the
+token index, the markers, the compressed names, and the addresses are found
+and validated against each other. The layout of the tables that is expected
+is the one of kernels before 6.2::
+
+    addresses or offsets | relative base | num_syms | names | markers |
+    token table | token index
+
+Both absolute addresses and relative offsets (with and without absolute
+per-CPU symbols) are supported.
+"""
+
+import struct
+
+import numpy
+
+from . import api
+from . import discovery
+from . import symbols
+from .logger import logger
+
+DIGITS = b"0\x001\x002\x003\x004\x005\x006\x007\x008\x009\x00"
+"""The tokens of the digits, which are part of every token table."""
+
+PAGE_TABLE_SYMBOLS = ("init_top_pgt", "init_level4_pgt", "swapper_pg_dir")
+"""The symbols of the kernel page tables."""
+
+def _align(value, alignment):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+def _token_table(buf, digits):
+    """Get the start of the token table and the offsets of all tokens.
+
+    Every character that is used in a symbol name keeps its own token, so
+    the token of "0" is the token with index 48.
+    """
+    pos = digits - 1
+    start = digits
+    for _ in range(ord("0")):
+        start = buf.rfind(b"\x00", 0, pos) + 1
+        if start <= 0 or start >= pos:
+            return None
+        pos = start - 1
+
+    offsets = list()
+    pos = start
+    for _ in range(256):
+        end = buf.find(b"\x00", pos)
+        if end <= pos:
+            return None
+        offsets.append(pos - start)
+        pos = end + 1
+    return start, pos, offsets
+
+def _token_index(buf, end, offsets):
+    """Find and validate the token index after the token table."""
+    for alignment in (8, 4, 2):
+        pos = _align(end, alignment)
+        if pos + 512 > len(buf):
+            return None
+        index = numpy.frombuffer(buf, dtype="<u2", count=256, offset=pos)
+        if index.tolist() == offsets:
+            return pos
+    return None
+
+def _markers(buf, table_start):
+    """Find the markers that precede the token table.
+
+    Markers are either 32-bit or 64-bit values. Yields the start and the
+    values of every plausible marker table.
+    """
+    for size, fmt in ((4, "<I"), (8, "<Q")):
+        pos = table_start - size
+        # Skip the alignment padding
+        while (pos > table_start - 8 and pos >= 0 and
+               struct.unpack_from(fmt, buf, pos)[0] == 0):
+            pos -= size
+
+        markers = list()
+        while pos >= 0:
+            value = struct.unpack_from(fmt, buf, pos)[0]
+            if markers and value >= markers[-1]:
+                break
+            markers.append(value)
+            if value == 0:
+                break
+            pos -= size
+        markers.reverse()
+
+        # Every name takes at least two bytes
+        if (len(markers) < 2 or markers[0] != 0 or
+                any(b - a < 512 for a, b in zip(markers, markers[1:]))):
+            continue
+        yield pos, markers
+
+def _skip_names(buf, pos, count):
+    """Skip count compressed names and return the position after them."""
+    for _ in range(count):
+        if pos >= len(buf):
+            return None
+        length = buf[pos]
+        if length & 0x80:
+            # Names with more than 127 tokens use a two byte length
+            length = (length & 0x7f) | (buf[pos + 1] << 7)
+            pos += 1
+        pos += length + 1
+    return pos
+
+def _names(buf, markers_start, markers):
+    """Find the number of symbols and the start of the names.
+
+    The number of symbols precedes the names and must match the number of
+    markers. The last block of names must end right before the markers.
+    """
+    low = 256 * (len(markers) - 1) + 1
+    high = 256 * len(markers)
+    words = numpy.frombuffer(buf, dtype="<u4", count=markers_start // 4)
+    candidates = numpy.flatnonzero((words >= low) & (words <= high)) * 4
+    for pos in candidates[::-1].tolist():
+        num_syms = int(words[pos // 4])
+        for start in sorted({_align(pos + 4, 8), pos + 8}):
+            end = _skip_names(buf, start + markers[-1],
+                              num_syms - 256 * (len(markers) - 1))
+            if end is not None and end <= markers_start < end + 8:
+                return pos, start, num_syms
+    return None
+
+def _addresses(buf, num_syms_pos, num_syms, absolute_percpu):
+    """Read the addresses of all symbols.
+
+    Returns the addresses as uint64 array or None.
+    """
+    if num_syms_pos >= 8:
+        base = struct.unpack_from("<Q", buf, num_syms_pos - 8)[0]
+        start = num_syms_pos - 8 - _align(num_syms * 4, 8)
+        if base >> 48 == 0xffff and start >= 0:
+            offsets = numpy.frombuffer(buf, dtype="<i4", count=num_syms,
+                                       offset=start).astype(numpy.int64)
+            unsigned = offsets.astype(numpy.uint64)
+            if absolute_percpu:
+                # Negative offsets are relative to the base, i.e.,
+                # base - 1 - offset in 64-bit arithmetic
+                rv = numpy.where(offsets >= 0, unsigned,
+                                 numpy.uint64(base - 1) - unsigned)
+            else:
+                rv = numpy.uint64(base) + (unsigned & numpy.uint64(0xffffffff))
+            if numpy.all(rv[1:] >= rv[:-1]):
+                return rv
+
+    start = num_syms_pos - num_syms * 8
+    if start < 0:
+        return None
+    rv = numpy.frombuffer(buf, dtype="<u8", count=num_syms, offset=start)
+    if not numpy.all(rv[1:] >= rv[:-1]):
+        return None
+    return rv.copy()
+
+def _decode_names(buf, start, num_syms, tokens):
+    names = list()
+    pos = start
+    for _ in range(num_syms):
+        length = buf[pos]
+        if length & 0x80:
+            length = (length & 0x7f) | (buf[pos + 1] << 7)
+            pos += 1
+        pos += 1
+        name = "".join([tokens[t] for t in buf[pos:pos + length]])
+        pos += length
+        # The first character is the type of the symbol
+        names.append(name[1:])
+    return names
+
+def decode(buf, digits, absolute_percpu=False):
+    """Decode the kallsyms tables.
+
+    Parameters
+    ----------
+    buf : bytes
+        Memory that contains the kallsyms tables.
+    digits : int
+        The offset of the digit tokens (:py:data:`DIGITS`) within buf.
+    absolute_percpu : bool, optional
+        Whether non-negative offsets are absolute addresses, which is the case
+        for x86-64 kernels.
+
+    Returns
+    -------
+    tuple or None
+        The names and the addresses of all symbols and the offset of the
+        token table within buf or None if the tables cannot be decoded.
+    """
+    table = _token_table(buf, digits)
+    if table is None:
+        return None
+    table_start, table_end, offsets = table
+    if _token_index(buf, table_end, offsets) is None:
+        return None
+    tokens = [buf[table_start + o:buf.index(b"\x00", table_start + o)].decode(
+                                                        "latin-1")
+              for o in offsets]
+
+    for markers_start, markers in _markers(buf, table_start):
+        names = _names(buf, markers_start, markers)
+        if names is None:
+            continue
+        num_syms_pos, names_start, num_syms = names
+
+        addresses = _addresses(buf, num_syms_pos, num_syms, absolute_percpu)
+        if addresses is None:
+            continue
+
+        return (_decode_names(buf, names_start, num_syms, tokens), addresses,
+                table_start)
+    return None
+
+def _candidate(gpa, window):
+    start = max(0, (gpa - window) & ~(api.PAGE_SIZE - 1))
+    try:
+        # The token table and the token index follow the digits
+        buf = api.tenjint_api_read_phys_mem(start, gpa - start + (16 << 10))
+    except RuntimeError:
+        return None
+
+    rv = decode(buf, gpa - start,
+                absolute_percpu=(api.arch == api.Arch.X86_64))
+    if rv is None:
+        return None
+    names, addresses, table_start = rv
+    by_name = dict(zip(names, addresses.tolist()))
+    text_va = by_name.get("_text", None)
+    if text_va is None:
+        return None
+    dtb = _kernel_dtb(by_name, text_va, start + table_start)
+    if dtb is None:
+        return None
+    logger.debug("Found kallsyms at 0x{:x}".format(gpa))
+    return names, addresses, dtb
+
+def _cpu_dtbs(addr):
+    rv = list()
+    for cpu_num in range(api.tenjint_api_get_num_cpus()):
+        cpu = api.tenjint_api_get_cpu_state(cpu_num)
+        rv.append(int(cpu.page_table_base(addr)) & 0x000ffffffffff000)
+    return rv
+
+def _kernel_dtb(by_name, text_va, table_gpa):
+    """Derive the kernel page tables from _text.
+
+    Symbols other than the ones in the text sections, e.g., the kallsyms
+    tables or the page tables, are only part of the table if the kernel was
+    built with CONFIG_KALLSYMS_ALL. Hence, the physical address of _text is
+    searched instead: The kernel image is physically contiguous and aligned
+    like its virtual address, and the token table lies within the image
+    after _text. A candidate is valid if a DTB maps both _text and the token
+    table to it. The DTB is taken from the page table symbols if they are
+    available and from the vCPUs otherwise. On x86-64, the latter may be the
+    page tables of a user process.
+    """
+    pgds = [by_name[name] for name in PAGE_TABLE_SYMBOLS if name in by_name]
+    cpu_dtbs = None
+    text_gpa = table_gpa - (table_gpa - text_va) % discovery.KERNEL_ALIGN
+    while text_gpa >= 0 and table_gpa - text_gpa < discovery.KERNEL_IMAGE_SIZE:
+        delta = text_va - text_gpa
+        table_va = (table_gpa + delta) & 0xffffffffffffffff
+        dtbs = [(pgd - delta) & 0xffffffffffffffff for pgd in pgds]
+        if not dtbs:
+            if cpu_dtbs is None:
+                cpu_dtbs = _cpu_dtbs(text_va)
+            dtbs = cpu_dtbs
+        for dtb in dtbs:
+            try:
+                if (api.tenjint_api_vtop(text_va, dtb) == text_gpa and
+                        api.tenjint_api_vtop(table_va, dtb) == table_gpa):
+                    return dtb
+            except api.TranslationError:
+                continue
+        text_gpa -= discovery.KERNEL_ALIGN
+    return None
+
+def find_kallsyms(ram_ranges=None, ram_file=None, workers=None,
+                  window=16 << 20):
+    """Find and decode the kallsyms tables in the guest physical memory.
+
+    Parameters
+    ----------
+    ram_ranges : list of tuple (int, int), optional
+        The guest physical address ranges of the RAM. See
+        :py:func:`tenjint.discovery.scan`.
+    ram_file : str, optional
+        A file that backs the guest RAM. See :py:func:`tenjint.discovery.scan`.
+    workers : int, optional
+        The number of workers for the scan.
+    window : int, optional
+        The number of bytes before the token table that may contain the
+        other tables.
+
+    Returns
+    -------
+    tuple (tenjint.symbols.SymbolIndex, int) or None
+        The index of all kernel symbols, prefixed with "linux!", and the DTB
+        of the kernel or None if the tables cannot be found.
+    """
+    rv = discovery.scan(DIGITS, lambda gpa: _candidate(gpa, window),
+                        ram_ranges=ram_ranges, ram_file=ram_file,
+                        workers=workers)
+    if rv is None:
+        return None
+    names, addresses, dtb = rv
+    return (symbols.SymbolIndex(["linux!" + name for name in names],
+                                addresses), dtb)
@@ -19,105 +19,254 @@
 
 """This module implements breakpoints."""
 
+import time
+
 from . import plugins
 from .. import api
+from .. import config
 from .. import event
 
 class Breakpoint(object):
     """This class represents a breakpoint.
 
-    An object of this class represents a single requested BP.  It handles the
-    automatic removal and insertion of the underlying QEMU breakpoint if the
-    page is written/read?
+    An object of this class represents a single BP on a given GPA.  When the
+    underlying QEMU breakpoint is inserted or removed is decided by the
+    :py:class:`BreakpointPage` the breakpoint belongs to.
     """
-    def __init__(self, gpa, event_manager, slp_service, logger):
+    def __init__(self, gpa):
         super().__init__()
         self.gpa = gpa
+        self.is_set = False
+        self.refcount = 0
+
+class BreakpointPage(object):
+    """This class represents all breakpoints on a single page.
+
+    An object of this class groups all BPs that reside on the same page.  It
+    handles the automatic removal and insertion of the underlying QEMU
+    breakpoints if the page is read or written.  While the page is executable
+    all of its BPs are set and reads and writes are trapped.  If the page is
+    read or written, all BPs are removed and the page is made RW until it is
+    executed again.  Thus, all BPs on a page share a single pair of SLP
+    callbacks and permission updates.
+
+    Every change from the executable to the RW state is counted as a flip.  If
+    a thrash limit is given and the number of flips within a window exceeds
+    this limit, the page is exposed: its BPs stay set while the page is read
+    and only writes remove them.  Note that reads of an exposed page will
+    return the breakpoint instructions instead of the original code.  Once
+    the flip rate of a window drops to the limit again, the BPs of the page
+    are hidden again.
+    """
+    def __init__(self, gfn, event_manager, slp_service, logger,
+                 thrash_limit=None, thrash_window=1.0):
+        super().__init__()
+        self.gfn = gfn
+        self.gpa = gfn << api.PAGE_SHIFT
+        self.breakpoints = dict()
+        self.armed = False
+        self.exposed = False
+        self.flips = 0
+        self.rate = 0.0
+        self._thrash_limit = thrash_limit
+        self._thrash_window = thrash_window
+        self._window_start = time.monotonic()
+        self._window_flips = 0
         self._event_manager = event_manager
         self._slp_service = slp_service
         self._logger = logger
-        self.is_set = False
 
-        gfn = gpa >> api.PAGE_SHIFT
         self._slp_rw_cb = event.EventCallback(self._slp_rw_cb_func,
                                               "SystemEventSLP",
                                               {"gfn": gfn, "num_pages": 1,
                                                "trap_r": True, "trap_w": True,
                                                "trap_x": False})
+        self._slp_w_cb = event.EventCallback(self._slp_rw_cb_func,
+                                             "SystemEventSLP",
+                                             {"gfn": gfn, "num_pages": 1,
+                                              "trap_r": False, "trap_w": True,
+                                              "trap_x": False})
         self._slp_x_cb = event.EventCallback(self._slp_x_cb_func,
                                              "SystemEventSLP",
                                              {"gfn": gfn, "num_pages": 1,
                                               "trap_r": False, "trap_w": False,
                                               "trap_x": True})
 
-    def _set_bp(self):
-        api.tenjint_api_update_feature_debug(cpu_num=None,
-                                            enable=True, gpa=self.gpa)
-        self._logger.debug("Breakpoint: bp set on 0x{:x}".format(self.gpa))
-        self.is_set = True
+    @property
+    def _armed_cb(self):
+        if self.exposed:
+            return self._slp_w_cb
+        return self._slp_rw_cb
+
+    def _update_bps(self, bps, enable):
+        api.tenjint_api_update_feature_debug_bps(enable,
+                                                 [bp.gpa for bp in bps])
+        for bp in bps:
+            bp.is_set = enable
+        self._logger.debug("Breakpoint: {} {} bp(s) on page 0x{:x}".format(
+                                    "set" if enable else "removed", len(bps),
+                                    self.gpa))
+
+    def _arm(self):
+        self._slp_service.update_permissions(self.gpa, r=self.exposed, w=False,
+                                             x=True)
+        self._update_bps(self.breakpoints.values(), True)
+        self.armed = True
+
+    def _disarm(self):
+        self._update_bps(self.breakpoints.values(), False)
+        self._slp_service.update_permissions(self.gpa, r=True, w=True, x=False)
+        self.armed = False
+
+    def _count_flip(self):
+        self.flips += 1
+        self._window_flips += 1
+        self.check_thrash()
+
+        if (self._thrash_limit is not None and not self.exposed and
+                self._window_flips > self._thrash_limit):
+            self._logger.warning("Breakpoint: page 0x{:x} is thrashing, "
+                                 "exposing its bps to reads".format(self.gpa))
+            self.exposed = True
+
+    def _hide(self):
+        self._logger.info("Breakpoint: page 0x{:x} is no longer thrashing, "
+                          "hiding its bps".format(self.gpa))
+        if self.armed:
+            self._event_manager.cancel_event(self._armed_cb)
+            self.exposed = False
+            self._event_manager.request_event(self._armed_cb)
+            self._slp_service.update_permissions(self.gpa, r=False, w=False,
+                                                 x=True)
+        else:
+            self.exposed = False
 
-    def set_bp(self):
-        """Set the breakpoint
+    def check_thrash(self):
+        """Re-evaluate the flip rate of the page.
 
-        This function is called to set the breakpoint.  This should be called
-        once.  Any subsequent insertions and removals of the underlying QEMU
-        breakpoint are handled internally.
+        If the current window has ended, the flip rate of the window is
+        recorded and a new window is started.  An exposed page whose flip rate
+        dropped to the thrash limit or below hides its BPs again.
         """
-        try:
-            self._slp_service.update_permissions(self.gpa, r=False, w=False, x=True)
-        except api.UpdateSLPError:
-            self._logger.warning("Breakpoint: slp update perm failed")
-            # this is safe as the kernel will default any new pages to
-            # X-only since we are requesting rw violations
-        self._event_manager.request_event(self._slp_rw_cb)
-        self._set_bp()
-
-    def _unset_bp(self):
-        api.tenjint_api_update_feature_debug(cpu_num=None,
-                                            enable=False, gpa=self.gpa)
-        self._logger.debug("Breakpoint: bp removed on 0x{:x}".format(self.gpa))
-        self.is_set = False
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self._thrash_window:
+            return
+
+        self.rate = self._window_flips / elapsed
+        self._window_start = now
+        self._window_flips = 0
+        if (self.exposed and
+                self.rate * self._thrash_window <= self._thrash_limit):
+            self._hide()
 
-    def unset_bp(self):
-        """Unset the breakpoint
+    def add(self, *bps):
+        """Add breakpoints to the page.
 
-        This function is called to unset the breakpoint.  This should be called
-        once.
+        The first breakpoints that are added activate the SLP protection of
+        the page.  Any subsequent insertions and removals of the underlying
+        QEMU breakpoints are handled internally.
         """
-        if self.is_set:
-            self._unset_bp()
-            self._event_manager.cancel_event(self._slp_rw_cb)
-        else:
-            self._event_manager.cancel_event(self._slp_x_cb)
+        if not self.breakpoints:
+            try:
+                self._slp_service.update_permissions(self.gpa, r=self.exposed,
+                                                     w=False, x=True)
+            except api.UpdateSLPError:
+                self._logger.warning("Breakpoint: slp update perm failed")
+                # this is safe as the kernel will default any new pages to
+                # X-only since we are requesting rw violations
+            self._event_manager.request_event(self._armed_cb)
+            self.armed = True
+
+        for bp in bps:
+            self.breakpoints[bp.gpa] = bp
+        if self.armed:
+            self._update_bps(bps, True)
+
+    def remove(self, *bps):
+        """Remove breakpoints from the page.
+
+        Removing the last breakpoint deactivates the SLP protection of the
+        page.
+        """
+        for bp in bps:
+            self.breakpoints.pop(bp.gpa)
+        self._update_bps([bp for bp in bps if bp.is_set], False)
+
+        if not self.breakpoints:
+            if self.armed:
+                self._event_manager.cancel_event(self._armed_cb)
+            else:
+                self._event_manager.cancel_event(self._slp_x_cb)
+            self.armed = False
+
+    def clear(self):
+        """Remove all breakpoints from the page."""
+        self.remove(*self.breakpoints.values())
 
     def _slp_rw_cb_func(self, event):
-        self._logger.debug("Breakpoint: rw callback ob 0x{:x}".format(event.gva))
-        self._unset_bp()
-        self._slp_service.update_permissions(self.gpa, r=True, w=True, x=False)
-        self._event_manager.cancel_event(self._slp_rw_cb)
+        self._logger.debug("Breakpoint: rw callback on page 0x{:x}".format(
+                                                                    self.gpa))
+        self._disarm()
+        self._event_manager.cancel_event(self._armed_cb)
         self._event_manager.request_event(self._slp_x_cb)
+        self._count_flip()
 
     def _slp_x_cb_func(self, event):
-        self._logger.debug("Breakpoint: x callback ob 0x{:x}".format(event.gva))
+        self._logger.debug("Breakpoint: x callback on page 0x{:x}".format(
+                                                                    self.gpa))
         self._event_manager.cancel_event(self._slp_x_cb)
-        self._event_manager.request_event(self._slp_rw_cb)
-        self._slp_service.update_permissions(self.gpa, r=False, w=False, x=True)
-        self._set_bp()
+        self._event_manager.request_event(self._armed_cb)
+        self._arm()
 
-class BreakpointPlugin(plugins.EventPlugin):
+class BreakpointPlugin(plugins.EventPlugin, config.ConfigMixin):
     """Breakpoint Service
 
     This plugin implements the Breakpoint service and is responsible for setting
     and removing breakpoints.  The breakpoints are set on a specificfied GPA and
-    are hidden by this service.
+    are hidden by this service.  Breakpoints are indexed by their GPA, multiple
+    requests for the same GPA share a single breakpoint.
+
+    Pages that contain code as well as frequently read data cause the BPs to be
+    removed and inserted over and over again.  With the "adaptive" thrash
+    policy, such pages are detected and their BPs are no longer hidden from
+    reads (see :py:class:`BreakpointPage`).
     """
     _abstract = False
     produces = [api.SystemEventBreakpoint]
+    _config_options = [
+        {
+            "name": "thrash_policy", "default": "hide",
+            "help": "How to handle pages whose bps are constantly removed and "
+                    "inserted. 'hide' always hides bps, 'adaptive' exposes "
+                    "the bps of thrashing pages to reads."
+        },
+        {
+            "name": "thrash_rate", "default": 1000,
+            "help": "The number of flips per second above which a page is "
+                    "considered to be thrashing."
+        },
+        {
+            "name": "thrash_window", "default": 1.0,
+            "help": "The time window in seconds in which flips are counted."
+        },
+    ]
 
     def __init__(self):
         super().__init__()
         self._request_id_cntr = 0
         self._requests = dict()
+        self._breakpoints = dict()
+        self._pages = dict()
+
+        if self._config_values["thrash_policy"] == "adaptive":
+            self._thrash_limit = (self._config_values["thrash_rate"] *
+                                  self._config_values["thrash_window"])
+        elif self._config_values["thrash_policy"] == "hide":
+            self._thrash_limit = None
+        else:
+            raise ValueError("Unknown thrash policy '{}'".format(
+                                        self._config_values["thrash_policy"]))
 
         self._ss_service = self._service_manager.get("SingleStepPlugin")
         self._slp_service = self._service_manager.get("SLPPlugin")
@@ -133,10 +282,15 @@ class BreakpointPlugin(plugins.EventPlugin):
         self._cb_ss = event.EventCallback(self._cb_func_ss, "SystemEventSingleStep")
         self._event_manager.request_event(self._cb_ss, send_request=False)
 
+        if self._thrash_limit is not None:
+            self._event_manager.add_continue_hook(self._cont_hook)
+
     def uninit(self):
         super().uninit()
-        for _, bp in self._requests.items():
-            bp.unset_bp()
+        for _, page in self._pages.items():
+            page.clear()
+        self._pages = dict()
+        self._breakpoints = dict()
         self._requests = dict()
 
         self._event_manager.cancel_event(self._cb_bp)
@@ -145,6 +299,53 @@ class BreakpointPlugin(plugins.EventPlugin):
         self._event_manager.cancel_event(self._cb_ss)
         self._cb_ss = None
 
+        if self._thrash_limit is not None:
+            self._event_manager.remove_continue_hook(self._cont_hook)
+
+    def _cont_hook(self):
+        # Exposed pages only flip on writes, so their rate has to be checked
+        # even if they are not flipping at all.
+        for page in self._pages.values():
+            if page.exposed:
+                page.check_thrash()
+
+    def _add_breakpoints(self, gpas):
+        new_bps = dict()
+        for gpa in gpas:
+            bp = self._breakpoints.get(gpa, None)
+            if bp is None:
+                bp = Breakpoint(gpa)
+                self._breakpoints[gpa] = bp
+                new_bps.setdefault(gpa >> api.PAGE_SHIFT, list()).append(bp)
+            bp.refcount += 1
+
+        for gfn, bps in new_bps.items():
+            page = self._pages.get(gfn, None)
+            if page is None:
+                page = BreakpointPage(gfn, self._event_manager,
+                                      self._slp_service, self._logger,
+                                      self._thrash_limit,
+                                      self._config_values["thrash_window"])
+                self._pages[gfn] = page
+            page.add(*bps)
+
+    def _remove_breakpoints(self, gpas):
+        old_bps = dict()
+        for gpa in gpas:
+            bp = self._breakpoints[gpa]
+            bp.refcount -= 1
+            if bp.refcount > 0:
+                continue
+
+            self._breakpoints.pop(gpa)
+            old_bps.setdefault(gpa >> api.PAGE_SHIFT, list()).append(bp)
+
+        for gfn, bps in old_bps.items():
+            page = self._pages[gfn]
+            page.remove(*bps)
+            if not page.breakpoints:
+                self._pages.pop(gfn)
+
     def request_event(self, event_cls, **kwargs):
         """Request Breakpoint event
 
@@ -156,9 +357,11 @@ class BreakpointPlugin(plugins.EventPlugin):
 
         request_id = self._request_id_cntr
         self._request_id_cntr += 1
-        bp = Breakpoint(gpa, self._event_manager, self._slp_service, self._logger)
-        self._requests[request_id] = bp
-        bp.set_bp()
+        if isinstance(gpa, frozenset):
+            self._add_breakpoints(gpa)
+        elif gpa is not None:
+            self._add_breakpoints((gpa,))
+        self._requests[request_id] = gpa
         return request_id
 
     def cancel_event(self, request_id):
@@ -167,8 +370,88 @@ class BreakpointPlugin(plugins.EventPlugin):
         This function is called by the event manager when a
         (:py:class:`api.SystemEventBreakpoint`) is canceled.
         """
-        bp = self._requests.pop(request_id)
-        bp.unset_bp()
+        gpa = self._requests.pop(request_id)
+        if isinstance(gpa, frozenset):
+            self._remove_breakpoints(gpa)
+        elif gpa is not None:
+            self._remove_breakpoints((gpa,))
+
+    def request_many(self, callback_func, gpas=None, symbols=None):
+        """Request breakpoints on many addresses at once.
+
+        This function allows to set a large number of breakpoints with a
+        single request.  Symbols are resolved in a single pass and each
+        virtual page is only translated once.  The breakpoints are then
+        installed page by page, such that every page only requires a single
+        SLP update.
+
+        Parameters
+        ----------
+        callback_func : function
+            The function to invoke whenever one of the breakpoints is hit.
+        gpas : iterable of int, optional
+            The GPAs to set breakpoints on.
+        symbols : iterable of str, optional
+            Kernel symbols to set breakpoints on.
+
+        Returns
+        -------
+        tenjint.event.EventCallback
+            A handle that can be passed to :py:func:`cancel_many` to remove
+            all breakpoints of the request.
+
+        Raises
+        ------
+        tenjint.plugins.operatingsystem.SymbolResolutionError
+            If a symbol cannot be resolved.
+        tenjint.api.api.TranslationError
+            If the address of a symbol cannot be translated.
+        """
+        gpas = set() if gpas is None else set(gpas)
+
+        if symbols:
+            offset_mask = api.PAGE_SIZE - 1
+            pages = dict()
+            for gva in self._os.get_symbol_addresses(symbols):
+                vpage = gva & ~offset_mask
+                ppage = pages.get(vpage, None)
+                if ppage is None:
+                    ppage = self._os.vtop(vpage, kernel_address_space=True)
+                    if ppage is None:
+                        raise api.TranslationError("Error translating "
+                                                   "0x{:x}".format(gva))
+                    pages[vpage] = ppage
+                gpas.add(ppage | (gva & offset_mask))
+
+        cb = event.EventCallback(callback_func,
+                                 event_name="SystemEventBreakpoint",
+                                 event_params={"gpa": frozenset(gpas)})
+        self._event_manager.request_event(cb)
+        return cb
+
+    def cancel_many(self, handle):
+        """Cancel a request made with :py:func:`request_many`.
+
+        Parameters
+        ----------
+        handle : tenjint.event.EventCallback
+            The handle returned by :py:func:`request_many`.
+        """
+        self._event_manager.cancel_event(handle)
+
+    def thrash_stats(self):
+        """Get the thrash statistics of all pages that contain breakpoints.
+
+        Returns
+        -------
+        list
+            A list of tuples (gpa, number of bps, flips, flips per second,
+            exposed) for every page, sorted by the number of flips.
+        """
+        stats = [(page.gpa, len(page.breakpoints), page.flips, page.rate,
+                  page.exposed) for page in self._pages.values()]
+        stats.sort(key=lambda x: x[2], reverse=True)
+        return stats
 
     def _cb_func_bp(self, event):
         # Activate single stepping to step over the BP
@@ -180,12 +463,13 @@ class BreakpointPlugin(plugins.EventPlugin):
     def _cb_func_ss(self, event):
         if self._ss[event.cpu_num].active:
             self._event_manager.cancel_event(self._ss[event.cpu_num])
-        else:
+        elif self._breakpoints:
+            # Another service single stepped, which disables BPs. Emit the
+            # event in case we stepped over one of our BPs.
             last_gva = self._ss_service.last_ss_gva(event.cpu_num)
             last_gpa = self._vm.vtop(last_gva, cpu_num=event.cpu_num)
-            for _, bp in self._requests.items():
-                if bp.gpa == last_gpa:
-                    evt = api.SystemEventBreakpoint(event.cpu_num,
-                                                    last_gva,
-                                                    last_gpa)
-                    self._event_manager.put_event(evt)
+            if last_gpa in self._breakpoints:
+                evt = api.SystemEventBreakpoint(event.cpu_num,
+                                                last_gva,
+                                                last_gpa)
+                self._event_manager.put_event(evt)
@@ -28,8 +28,18 @@ and operating system.
 from . import plugins
 from .. import api
 
+import collections
+import operator
 import struct
 
+CallContext = collections.namedtuple("CallContext", ["args", "return_address",
+                                                     "stack_pointer"])
+"""The state of a function call at the entry of the function.
+
+Contains the requested arguments as tuple, the return address, and the stack
+pointer.
+"""
+
 class FunctionArguments(plugins.Plugin):
     """Base class for all function argument classes.
 
@@ -61,6 +71,67 @@ class FunctionArguments(plugins.Plugin):
         """
         raise NotImplementedError()
 
+    def get_args(self, cpu_num, n):
+        """Get the first n arguments from the given vCPU.
+
+        In contrast to :py:func:`get_arg` the vCPU mode is only checked once,
+        the register arguments are taken from a single register snapshot, and
+        the stack arguments are read with a single memory read.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU to use.
+        n : int
+            The number of arguments to get.
+
+        Returns
+        -------
+        tuple
+            The requested arguments.
+
+        Raises
+        ------
+        ValueError
+            If their is not vCPU with this number.
+        """
+        return self.get_call_context(cpu_num, n).args
+
+    def get_call_context(self, cpu_num, n=0):
+        """Get the arguments, the return address, and the stack pointer.
+
+        This function is meant to be called at the entry of a function. It
+        retrieves all values with as few API calls as possible.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU to use.
+        n : int, optional
+            The number of arguments to get.
+
+        Returns
+        -------
+        CallContext
+            The state of the function call.
+
+        Raises
+        ------
+        ValueError
+            If their is not vCPU with this number.
+        """
+        raise NotImplementedError()
+
+    def _read_stack(self, cpu_num, addr, size):
+        """Read stack memory that may cross a page boundary."""
+        data = b""
+        while size > 0:
+            chunk = min(size, api.PAGE_SIZE - (addr & (api.PAGE_SIZE - 1)))
+            data += self._vm.mem_read(addr, chunk, cpu_num=cpu_num)
+            addr += chunk
+            size -= chunk
+        return data
+
     def get_stack_pointer(self, cpu_num):
         """Get the stack pointer on the given vCPU.
 
@@ -286,6 +357,18 @@ class FunctionArgumentsLinuxX86(FunctionArguments):
     arch = api.Arch.X86_64
     os = api.OsType.OS_LINUX
 
+    _arg_regs_x64 = operator.attrgetter("rdi", "rsi", "rdx", "rcx", "r8",
+                                        "r9")
+
+    @staticmethod
+    def _pointer_width(cpu):
+        if cpu.is_ia32e and cpu.is_code_64:
+            return 8
+        elif cpu.is_paging_set and cpu.is_code_32:
+            return 4
+
+        raise RuntimeError("Unsupported vCPU mode")
+
     def _get_arg_x64(self, cpu_num, nr):
         cpu = self._vm.cpu(cpu_num)
 
@@ -302,15 +385,15 @@ class FunctionArgumentsLinuxX86(FunctionArguments):
         elif (nr == 5):
             return cpu.r9
         else:
-            data = self._vm.mem_read(cpu.rsp - ((nr - 5) * pointer_width),
-                                     cpu.pointer_width, cpu_num=cpu_num)
+            # The stack arguments follow the return address
+            data = self._vm.mem_read(cpu.rsp + ((nr - 5) * 8), 8,
+                                     cpu_num=cpu_num)
             return struct.unpack("<Q", data)[0]
 
     def _get_arg_x86(self, cpu_num, nr):
         cpu = self._vm.cpu(cpu_num)
 
-        data = self._vm.mem_read(cpu.rsp - ((nr + 1) * pointer_width),
-                                 cpu.pointer_width, cpu_num=cpu_num)
+        data = self._vm.mem_read(cpu.rsp + ((nr + 1) * 4), 4, cpu_num=cpu_num)
         return struct.unpack("<I", data)[0]
 
     def get_arg(self, cpu_num, nr):
@@ -323,6 +406,32 @@ class FunctionArgumentsLinuxX86(FunctionArguments):
 
         raise RuntimeError("Unsupported vCPU mode")
 
+    def get_args(self, cpu_num, n):
+        cpu = self._vm.cpu(cpu_num)
+
+        if n <= 6 and self._pointer_width(cpu) == 8:
+            return self._arg_regs_x64(cpu)[:n]
+        return self.get_call_context(cpu_num, n).args
+
+    def get_call_context(self, cpu_num, n=0):
+        cpu = self._vm.cpu(cpu_num)
+        width = self._pointer_width(cpu)
+        sp = cpu.rsp
+
+        if width == 8:
+            regs = self._arg_regs_x64(cpu)[:n]
+            num_stack = max(n - 6, 0)
+            fmt = "<{}Q".format(num_stack + 1)
+        else:
+            regs = ()
+            num_stack = n
+            fmt = "<{}I".format(num_stack + 1)
+
+        # The return address and the stack arguments are read at once
+        values = struct.unpack(fmt, self._read_stack(cpu_num, sp,
+                                                     (num_stack + 1) * width))
+        return CallContext(regs + values[1:], values[0], sp)
+
     def get_stack_pointer(self, cpu_num):
         return self._vm.cpu(cpu_num).rsp
 
@@ -429,6 +538,19 @@ class FunctionArgumentsLinuxAarch64(FunctionArguments):
         else:
             raise RuntimeError("Unsupported arg number")
 
+    _arg_regs = operator.attrgetter("r0", "r1", "r2", "r3", "r4", "r5", "r6",
+                                    "r7")
+
+    def get_args(self, cpu_num, n):
+        if n > 8:
+            raise RuntimeError("Unsupported arg number")
+        return self._arg_regs(self._vm.cpu(cpu_num))[:n]
+
+    def get_call_context(self, cpu_num, n=0):
+        return CallContext(self.get_args(cpu_num, n),
+                           self._vm.cpu(cpu_num).r30,
+                           self.get_stack_pointer(cpu_num))
+
     def get_stack_pointer(self, cpu_num):
         cpu = self._vm.cpu(cpu_num)
 
@@ -98,8 +98,7 @@ class FunctionCallInjectionBase(plugins.EventPlugin):
         self._syscall_cb = None
 
     def _armed_cb(self, e):
-        proc = self._os.current_process(cpu_num=e.cpu_num)
-        ctid = proc.tid if hasattr(proc, "tid") else proc.pid
+        ctid = self._os.current_task_info(e.cpu_num).tid
         for i, (symbol, gva, args, tid, gpa, cb, kernel) in enumerate(
                                                         self._armed_injections):
             if kernel:
@@ -121,8 +120,7 @@ class FunctionCallInjectionBase(plugins.EventPlugin):
 
         # Get data
         cpu = self._vm.cpu(e.cpu_num)
-        proc = self._os.current_process(cpu_num=e.cpu_num)
-        tid = proc.tid if hasattr(proc, "tid") else proc.pid
+        tid = self._os.current_task_info(e.cpu_num).tid
         sp = self._fargs.get_stack_pointer(e.cpu_num)
         ret = self._fargs.get_return_value(e.cpu_num)
         injection = None
@@ -151,7 +149,7 @@ class FunctionCallInjectionBase(plugins.EventPlugin):
 
         # Emit event
         evt = FunctionCallInjectionEvent(injection[4], injection[5],
-                                         injection[6], proc.pid)
+                                         injection[6], tid)
         self._event_manager.put_event(evt)
 
     def _inject(self, cpu_num, symbol, gva, *args):
@@ -165,8 +163,7 @@ class FunctionCallInjectionBase(plugins.EventPlugin):
         state = cpu.save_state()
 
         # Get data
-        proc = self._os.current_process(cpu_num=cpu_num)
-        tid = proc.tid if hasattr(proc, "tid") else proc.pid
+        tid = self._os.current_task_info(cpu_num).tid
         sp = self._fargs.get_stack_pointer(cpu_num)
         ip = cpu.instruction_pointer
         ip_gpa = self._vm.vtop(ip, cpu_num=cpu_num)
@@ -253,8 +250,7 @@ class FunctionCallInjectionLinuxX86(FunctionCallInjectionBase):
             self._event_manager.request_event(self._syscall_cb)
 
     def _syscall_bp(self, e):
-        proc = self._os.current_process(cpu_num=e.cpu_num)
-        ctid = proc.tid if hasattr(proc, "tid") else proc.pid
+        ctid = self._os.current_task_info(e.cpu_num).tid
 
         new_waiting = []
         for (symbol, gva, args, tid, kernel) in self._waiting_injections:
@@ -315,8 +311,7 @@ class FunctionCallInjectionLinuxAarch64(FunctionCallInjectionBase):
             self._event_manager.request_event(self._syscall_cb)
 
     def _syscall_bp(self, e):
-        proc = self._os.current_process(cpu_num=e.cpu_num)
-        ctid = proc.tid if hasattr(proc, "tid") else proc.pid
+        ctid = self._os.current_task_info(e.cpu_num).tid
 
         new_waiting = []
         for (symbol, gva, args, tid, kernel) in self._waiting_injections:
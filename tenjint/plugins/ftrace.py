@@ -0,0 +1,306 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Provides tracing of kernel function entries and exits.
+
+This module provides a plugin that sets breakpoints on the entries of kernel
+functions. When an entry is hit, a breakpoint is set on the return address of
+the call. Each completed call is recorded in a ring buffer together with its
+duration, the configured arguments, and the return value.
+"""
+
+import collections
+import json
+import time
+
+from . import plugins
+from .. import api
+from .. import config
+from .. import event
+from .. import ringbuffer
+
+MAX_ARGS = 6
+"""The maximum number of arguments that are recorded per call."""
+
+class _ReturnSite(object):
+    """A shared breakpoint on a return address."""
+    def __init__(self, cb):
+        super().__init__()
+        self.cb = cb
+        self.refcount = 0
+
+class FunctionTracer(plugins.Plugin, config.ConfigMixin):
+    """Function entry and exit tracer.
+
+    Entries are instrumented with a single request to the breakpoint service.
+    On every entry, the arguments, the return address, and the stack pointer
+    are read at once (see
+    :py:func:`tenjint.plugins.fargs.FunctionArguments.get_call_context`). The
+    call is identified by the thread ID and the stack pointer after the
+    return, which is what the return breakpoint observes. Return breakpoints
+    are shared by all calls that return to the same site and are reference
+    counted. Once a return site is no longer used, its breakpoint is kept for
+    a while, since hot functions are usually called from the same few sites.
+
+    Arguments are only captured for the functions that are configured in the
+    "arguments" option. Timestamps are taken on the host, so durations
+    include the time the VM was stopped.
+
+    If an output file is configured, the buffer is flushed to this file
+    whenever it is full and when the plugin is unloaded. The names of the
+    traced functions are written to the same path with the suffix
+    ".functions.json".
+    """
+    _abstract = False
+    os = api.OsType.OS_LINUX
+    _config_options = [
+        {
+            "name": "functions", "default": [],
+            "help": "Kernel functions that are traced when the plugin is "
+                    "loaded, e.g., ['linux!vfs_read']."
+        },
+        {
+            "name": "arguments", "default": {},
+            "help": "The number of arguments to capture per function, e.g., "
+                    "{'linux!vfs_read': 3}. At most 6 arguments are "
+                    "captured."
+        },
+        {
+            "name": "buffer_size", "default": 1 << 20,
+            "help": "The number of calls the trace buffer can hold."
+        },
+        {
+            "name": "output", "default": None,
+            "help": "Path of the file the trace is written to. If not set, "
+                    "the trace is only kept in memory."
+        },
+        {
+            "name": "max_pending", "default": 1 << 16,
+            "help": "The maximum number of calls that have not returned yet. "
+                    "The oldest calls are dropped beyond this limit."
+        },
+        {
+            "name": "idle_return_sites", "default": 1024,
+            "help": "The number of unused return breakpoints that are kept."
+        },
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self._bp_service = self._service_manager.get("BreakpointPlugin")
+        self._fargs = self._service_manager.get("FunctionArguments")
+
+        flush_func = None
+        if self._config_values["output"]:
+            flush_func = self._write
+        self._buffer = ringbuffer.RingBuffer([("cpu_num", "u2"),
+                                              ("func", "u4"),
+                                              ("tid", "i8"),
+                                              ("entry", "u8"),
+                                              ("duration", "u8"),
+                                              ("args", "u8", (MAX_ARGS,)),
+                                              ("retval", "u8")],
+                                             self._config_values["buffer_size"],
+                                             flush_func=flush_func)
+
+        # The return address is popped on x86-64 when the call returns
+        if api.arch == api.Arch.X86_64:
+            self._ret_sp_delta = self._os.pointer_width
+        else:
+            self._ret_sp_delta = 0
+
+        self._names = list()
+        self._indexes = dict()
+        # gva -> (index of the function, number of arguments)
+        self._functions = dict()
+        self._handles = list()
+        # (tid, sp after the return) -> (func, entry time, args, return site)
+        self._pending = collections.OrderedDict()
+        # return address -> _ReturnSite
+        self._return_sites = dict()
+        self._idle_sites = collections.OrderedDict()
+        self.dropped_calls = 0
+
+        if self._config_values["functions"]:
+            self.start(self._config_values["functions"])
+
+    def uninit(self):
+        super().uninit()
+        self.stop()
+        self.flush()
+
+    @property
+    def function_names(self):
+        """The names of the traced functions, indexed by the "func" field."""
+        return list(self._names)
+
+    @property
+    def tracing(self):
+        """Whether the tracer is currently active."""
+        return bool(self._handles)
+
+    def start(self, symbols):
+        """Start tracing kernel functions.
+
+        Parameters
+        ----------
+        symbols : iterable of str
+            The symbols of the functions, e.g., "linux!vfs_read".
+
+        Raises
+        ------
+        tenjint.plugins.operatingsystem.SymbolResolutionError
+            If a symbol cannot be resolved.
+        """
+        symbols = list(symbols)
+        addresses = self._os.get_symbol_addresses(symbols)
+        arguments = self._config_values["arguments"]
+        new = list()
+        for symbol, gva in zip(symbols, addresses):
+            if gva in self._functions:
+                continue
+            idx = self._indexes.get(symbol, None)
+            if idx is None:
+                idx = len(self._names)
+                self._indexes[symbol] = idx
+                self._names.append(symbol)
+            self._functions[gva] = (idx, min(arguments.get(symbol, 0),
+                                             MAX_ARGS))
+            new.append(symbol)
+        if not new:
+            return
+
+        self._handles.append(self._bp_service.request_many(self._entry_cb,
+                                                           symbols=new))
+
+    def stop(self):
+        """Stop tracing all functions.
+
+        Calls that have not returned yet are discarded. The indexes of the
+        functions stay valid if tracing is started again.
+        """
+        for handle in self._handles:
+            self._bp_service.cancel_many(handle)
+        self._handles = list()
+        self._functions.clear()
+
+        for site in self._return_sites.values():
+            self._event_manager.cancel_event(site.cb)
+        self._return_sites.clear()
+        self._idle_sites.clear()
+        self._pending.clear()
+
+    def _acquire_return_site(self, ret, cpu_num):
+        site = self._return_sites.get(ret, None)
+        if site is None:
+            # Translated for every new site, the code at the return address
+            # may have been reloaded since the last site was dropped
+            gpa = self._vm.vtop(ret, cpu_num=cpu_num)
+            site = _ReturnSite(event.EventCallback(self._return_cb,
+                                            event_name="SystemEventBreakpoint",
+                                            event_params={"gpa": gpa}))
+            self._event_manager.request_event(site.cb)
+            self._return_sites[ret] = site
+        elif site.refcount == 0:
+            self._idle_sites.pop(ret, None)
+        site.refcount += 1
+
+    def _release_return_site(self, ret):
+        site = self._return_sites[ret]
+        site.refcount -= 1
+        if site.refcount > 0:
+            return
+
+        # Keep the breakpoint, the site is likely to be used again soon
+        self._idle_sites[ret] = site
+        while len(self._idle_sites) > self._config_values["idle_return_sites"]:
+            old_ret, old_site = self._idle_sites.popitem(last=False)
+            self._return_sites.pop(old_ret)
+            self._event_manager.cancel_event(old_site.cb)
+
+    def _entry_cb(self, event):
+        func = self._functions.get(event.gva, None)
+        if func is None:
+            return
+        idx, nargs = func
+        cpu_num = event.cpu_num
+
+        args, ret, sp = self._fargs.get_call_context(cpu_num, nargs)
+        key = (self._os.current_task_info(cpu_num).tid,
+               sp + self._ret_sp_delta)
+
+        try:
+            self._acquire_return_site(ret, cpu_num)
+        except api.TranslationError:
+            self.dropped_calls += 1
+            return
+
+        old = self._pending.pop(key, None)
+        if old is not None:
+            # The previous call on this stack never returned
+            self._release_return_site(old[3])
+            self.dropped_calls += 1
+        self._pending[key] = (idx, time.monotonic_ns(), args, ret)
+
+        while len(self._pending) > self._config_values["max_pending"]:
+            _, old = self._pending.popitem(last=False)
+            self._release_return_site(old[3])
+            self.dropped_calls += 1
+
+    def _return_cb(self, event):
+        cpu_num = event.cpu_num
+        key = (self._os.current_task_info(cpu_num).tid,
+               self._fargs.get_stack_pointer(cpu_num))
+        call = self._pending.pop(key, None)
+        if call is None:
+            # Another thread or a call that is not traced
+            return
+        idx, entry, args, ret = call
+        now = time.monotonic_ns()
+
+        self._buffer.append((cpu_num, idx, key[0], entry, now - entry,
+                             args + (0,) * (MAX_ARGS - len(args)),
+                             self._fargs.get_return_value(cpu_num)))
+        self._release_return_site(ret)
+
+    def records(self):
+        """Get the calls that are currently in the trace buffer.
+
+        Returns
+        -------
+        numpy.ndarray
+            The records with the fields "cpu_num", "func", "tid", "entry",
+            "duration", "args", and "retval". Times are in nanoseconds and
+            "func" is an index into :py:attr:`function_names`.
+        """
+        return self._buffer.get()
+
+    def flush(self):
+        """Write the trace buffer to the output file, if one is configured."""
+        if self._config_values["output"] and len(self._buffer):
+            self._write(self._buffer)
+
+    def _write(self, buf):
+        with open(self._config_values["output"] + ".functions.json", "w") as f:
+            json.dump(self._names, f)
+        with open(self._config_values["output"], "ab") as f:
+            buf.write(f)
+        if buf.dropped:
+            self._logger.warning("FunctionTracer: {} records "
+                                 "dropped".format(buf.dropped))
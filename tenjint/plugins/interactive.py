@@ -229,6 +229,19 @@ class InteractiveShell(plugins.Plugin, config.ConfigMixin):
         for name, params in self._event_manager.get_registered_events():
             self._renderer.table_row(name, str(params))
 
+    @property
+    def breakpoint_thrash(self):
+        bp_service = self._service_manager.get("BreakpointPlugin")
+        self._renderer.format("Breakpoint Page Thrashing\n")
+        self._renderer.table_header([dict(name="Page", width=18),
+                                     dict(name="BPs", width=5),
+                                     dict(name="Flips", width=10),
+                                     dict(name="Flips/s", width=10),
+                                     dict(name="Exposed", width=7)])
+        for gpa, num_bps, flips, rate, exposed in bp_service.thrash_stats():
+            self._renderer.table_row("0x{:016x}".format(gpa), num_bps, flips,
+                                     "{:.1f}".format(rate), exposed)
+
     def request_shutdown(self):
         api.tenjint_api_request_shutdown()
 
@@ -0,0 +1,192 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Provides instruction tracing.
+
+This module provides a plugin that records every instruction that is executed
+on a vCPU by single stepping it. Records are stored in a preallocated ring
+buffer (see :py:mod:`tenjint.ringbuffer`) and can be flushed to a file.
+"""
+
+from . import plugins
+from .. import config
+from .. import ringbuffer
+
+class InstructionTracer(plugins.Plugin, config.ConfigMixin):
+    """Instruction tracer.
+
+    The instruction tracer single steps vCPUs using the step hooks of the
+    single step service (MTF on x86-64, the debug feature on aarch64). For
+    every executed instruction the vCPU number, the instruction pointer, the
+    page table base, and optionally a configurable set of registers are
+    recorded. The trace can be scoped to an address range and to the address
+    space of a process.
+
+    Step hooks are called after the instruction was executed. The page table
+    base and the registers are therefore captured after every step as the
+    state before the next instruction, such that a record contains the values
+    the instruction was executed with. If the instruction pointer does not
+    match the captured state, e.g., because the state was modified between
+    the steps, the values after the instruction are recorded instead.
+
+    If an output file is configured, the buffer is flushed to this file
+    whenever it is full and when the plugin is unloaded. Otherwise, the oldest
+    records are overwritten.
+    """
+    _abstract = False
+    _config_options = [
+        {
+            "name": "buffer_size", "default": 1 << 20,
+            "help": "The number of records the trace buffer can hold."
+        },
+        {
+            "name": "output", "default": None,
+            "help": "Path of the file the trace is written to. If not set, "
+                    "the trace is only kept in memory."
+        },
+        {
+            "name": "registers", "default": [],
+            "help": "Names of additional registers to record, e.g., ['rax']."
+        },
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self._ss_service = self._service_manager.get("SingleStepPlugin")
+
+        self._registers = tuple(self._config_values["registers"])
+        dtype = ([("cpu_num", "u2"), ("ip", "u8"), ("dtb", "u8")] +
+                 [(reg, "u8") for reg in self._registers])
+        flush_func = None
+        if self._config_values["output"]:
+            flush_func = self._write
+        self._buffer = ringbuffer.RingBuffer(dtype,
+                                             self._config_values["buffer_size"],
+                                             flush_func=flush_func)
+        self._hooks = dict()
+        # cpu_num -> (ip, dtb, registers) before the next step
+        self._pre_states = dict()
+        self._start = None
+        self._end = None
+        self._dtb = None
+
+    def uninit(self):
+        super().uninit()
+        self.stop()
+        self.flush()
+
+    @property
+    def tracing(self):
+        """Whether the tracer is currently active."""
+        return bool(self._hooks)
+
+    def start(self, cpu_num=None, start=None, end=None, dtb=None):
+        """Start tracing.
+
+        Parameters
+        ----------
+        cpu_num : int, optional
+            The vCPU to trace. If not given, all vCPUs are traced.
+        start : int, optional
+            The start of the address range to trace.
+        end : int, optional
+            The end of the address range to trace (exclusive).
+        dtb : int, optional
+            The page table base of the process to trace.
+        """
+        self._start = 0 if start is None else start
+        self._end = (1 << 64) if end is None else end
+        self._dtb = dtb
+
+        if cpu_num is None:
+            cpus = range(self._vm.cpu_count)
+        else:
+            cpus = (cpu_num,)
+
+        for i in cpus:
+            if i not in self._hooks:
+                self._pre_states[i] = self._capture(self._vm.cpu(i))
+                self._hooks[i] = self._ss_service.add_step_hook(i,
+                                                                self._step_hook)
+
+    def stop(self, cpu_num=None):
+        """Stop tracing.
+
+        Parameters
+        ----------
+        cpu_num : int, optional
+            The vCPU to stop tracing on. If not given, tracing is stopped on
+            all vCPUs.
+        """
+        if cpu_num is None:
+            cpus = list(self._hooks.keys())
+        else:
+            cpus = (cpu_num,)
+
+        for i in cpus:
+            handle = self._hooks.pop(i, None)
+            self._pre_states.pop(i, None)
+            if handle is not None:
+                self._ss_service.remove_step_hook(handle)
+
+    def records(self):
+        """Get the records that are currently in the trace buffer.
+
+        Returns
+        -------
+        numpy.ndarray
+            The records with the fields "cpu_num", "ip", "dtb", and one field
+            for each configured register.
+        """
+        return self._buffer.get()
+
+    def flush(self):
+        """Write the trace buffer to the output file, if one is configured."""
+        if self._config_values["output"] and len(self._buffer):
+            self._write(self._buffer)
+
+    def _write(self, buf):
+        with open(self._config_values["output"], "ab") as f:
+            buf.write(f)
+        if buf.dropped:
+            self._logger.warning("InstructionTracer: {} records "
+                                 "dropped".format(buf.dropped))
+
+    def _capture(self, cpu):
+        ip = cpu.instruction_pointer
+        return (ip, cpu.page_table_base(ip),
+                tuple(getattr(cpu, reg) for reg in self._registers))
+
+    def _step_hook(self, cpu_num):
+        ip = self._ss_service.last_ss_gva(cpu_num)
+        cpu = self._vm.cpu(cpu_num)
+        pre_state = self._pre_states.get(cpu_num, None)
+        self._pre_states[cpu_num] = self._capture(cpu)
+        if ip < self._start or ip >= self._end:
+            return
+
+        if pre_state is not None and pre_state[0] == ip:
+            _, dtb, registers = pre_state
+        else:
+            dtb = cpu.page_table_base(ip)
+            registers = tuple(getattr(cpu, reg) for reg in self._registers)
+        if self._dtb is not None and dtb != self._dtb:
+            return
+
+        self._buffer.append((cpu_num, ip, dtb) + registers)
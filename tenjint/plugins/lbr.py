@@ -0,0 +1,283 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Provides continuous collection of the Last Branch Record Stack (LBR).
+
+This module provides a plugin that reads the LBR of the traced vCPUs at every
+stop and appends the branches that were recorded since the previous stop to a
+ring buffer. From the recorded calls and returns it maintains a partial call
+stack per vCPU. This provides a cheap control-flow history without single
+stepping.
+"""
+
+import numpy
+
+from . import plugins
+from .. import api
+from .. import config
+from .. import ringbuffer
+from ..api import api_x86_64
+
+class LBRCollector(plugins.Plugin, config.ConfigMixin):
+    """LBR collector.
+
+    At every stop, the LBR of each traced vCPU is read and compared to the LBR
+    of the previous stop. Only the branches that follow the longest overlap
+    of both are appended to the buffer. Thus, a branch that is repeated
+    exactly across the overlap may be missed.
+
+    Partial call stacks are reconstructed from the recorded branches. A
+    branch whose target lies at most 15 bytes, i.e., the maximum length of an
+    instruction, after the source of a call on the stack is a return from
+    this call. All other branches are treated as calls. This requires a filter
+    that only records calls and returns, which is the default. In call stack
+    mode (:py:data:`tenjint.api.api_x86_64.LBR_SELECT_EN_CALLSTACK`), the LBR
+    itself is the call stack.
+
+    If an output file is configured, the buffer is flushed to this file
+    whenever it is full and when the plugin is unloaded. Otherwise, the oldest
+    records are overwritten.
+    """
+    _abstract = False
+    arch = api.Arch.X86_64
+    _config_options = [
+        {
+            "name": "buffer_size", "default": 1 << 20,
+            "help": "The number of branches the buffer can hold."
+        },
+        {
+            "name": "lbr_select",
+            "default": (api_x86_64.LBR_SELECT_CALLS &
+                        api_x86_64.LBR_SELECT_RETURNS),
+            "help": "The default LBR filter, i.e., the value of the "
+                    "LBR_SELECT MSR. Defaults to calls and returns."
+        },
+        {
+            "name": "max_depth", "default": 256,
+            "help": "The maximum depth of the reconstructed call stacks."
+        },
+        {
+            "name": "output", "default": None,
+            "help": "Path of the file the branches are written to. If not "
+                    "set, the branches are only kept in memory."
+        },
+    ]
+
+    _return_search_depth = 16
+    """The number of calls on the stack that a return is matched against."""
+
+    def __init__(self):
+        super().__init__()
+        flush_func = None
+        if self._config_values["output"]:
+            flush_func = self._write
+        self._buffer = ringbuffer.RingBuffer([("cpu_num", "u2"),
+                                              ("stop", "u8"),
+                                              ("from", "u8"), ("to", "u8")],
+                                             self._config_values["buffer_size"],
+                                             flush_func=flush_func)
+        # cpu_num -> LBR filter
+        self._cpus = dict()
+        # cpu_num -> (from, to) of the previous stop
+        self._last = dict()
+        # cpu_num -> list of (call site, target)
+        self._stacks = dict()
+        self._collected = set()
+        self._stop = 0
+
+        self._event_manager.add_continue_hook(self._cont_hook)
+
+    def uninit(self):
+        super().uninit()
+        self._event_manager.remove_continue_hook(self._cont_hook)
+        self.stop()
+        self.flush()
+
+    def _cont_hook(self):
+        # The cache of the VM may already be cleared. Reading the LBR through
+        # the VM would fill it with the LBR of this stop for the next stop.
+        for cpu_num in self._cpus:
+            if cpu_num not in self._collected:
+                self._collect(cpu_num, api.tenjint_api_lbr_get(cpu_num))
+        self._collected.clear()
+        self._stop += 1
+
+    @property
+    def collecting(self):
+        """Whether the collector is currently active."""
+        return bool(self._cpus)
+
+    def start(self, cpu_num=None, lbr_select=None):
+        """Start collecting.
+
+        Parameters
+        ----------
+        cpu_num : int, optional
+            The vCPU to collect the LBR of. If not given, all vCPUs are used.
+        lbr_select : int, optional
+            The LBR filter. Defaults to the configured filter.
+        """
+        if lbr_select is None:
+            lbr_select = self._config_values["lbr_select"]
+
+        if cpu_num is None:
+            cpus = range(self._vm.cpu_count)
+        else:
+            cpus = (cpu_num,)
+
+        for i in cpus:
+            if i not in self._cpus:
+                self._vm.lbr_enable(i, lbr_select)
+                self._cpus[i] = lbr_select
+
+    def stop(self, cpu_num=None):
+        """Stop collecting.
+
+        Parameters
+        ----------
+        cpu_num : int, optional
+            The vCPU to stop collecting on. If not given, collection is stopped
+            on all vCPUs.
+        """
+        if cpu_num is None:
+            cpus = list(self._cpus.keys())
+        else:
+            cpus = (cpu_num,)
+
+        for i in cpus:
+            lbr_select = self._cpus.pop(i, None)
+            if lbr_select is not None:
+                self._vm.lbr_disable(i, lbr_select)
+                self._last.pop(i, None)
+
+    @staticmethod
+    def _overlap(last_from, last_to, lbr_from, lbr_to):
+        """Get the number of branches that were already seen."""
+        for k in range(min(len(last_from), len(lbr_from)), 0, -1):
+            if (numpy.array_equal(last_from[-k:], lbr_from[:k]) and
+                    numpy.array_equal(last_to[-k:], lbr_to[:k])):
+                return k
+        return 0
+
+    def _update_stack(self, cpu_num, lbr_from, lbr_to):
+        stack = self._stacks.setdefault(cpu_num, list())
+        for site, target in zip(lbr_from, lbr_to):
+            for depth in range(len(stack) - 1,
+                    max(len(stack) - self._return_search_depth, 0) - 1, -1):
+                if 0 < target - stack[depth][0] <= 15:
+                    del stack[depth:]
+                    break
+            else:
+                stack.append((site, target))
+
+        overflow = len(stack) - self._config_values["max_depth"]
+        if overflow > 0:
+            del stack[:overflow]
+
+    def collect(self, cpu_num):
+        """Collect the branches of a vCPU.
+
+        Branches are collected automatically before the VM is resumed. This
+        function only needs to be called to access the branches of the
+        current stop. Branches are collected at most once per stop.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU.
+        """
+        if cpu_num not in self._cpus or cpu_num in self._collected:
+            return
+        self._collect(cpu_num, self._vm.lbr(cpu_num))
+
+    def _collect(self, cpu_num, lbr):
+        self._collected.add(cpu_num)
+
+        lbr_from, lbr_to = lbr.ordered()
+        last_from, last_to = self._last.get(cpu_num, (lbr_from[:0],
+                                                      lbr_to[:0]))
+        self._last[cpu_num] = (lbr_from, lbr_to)
+
+        callstack = (self._vm.lbr_select(cpu_num) &
+                     api_x86_64.LBR_SELECT_EN_CALLSTACK)
+        if callstack:
+            self._stacks[cpu_num] = list(zip(lbr_from.tolist(),
+                                             lbr_to.tolist()))
+
+        seen = self._overlap(last_from, last_to, lbr_from, lbr_to)
+        lbr_from = lbr_from[seen:]
+        lbr_to = lbr_to[seen:]
+        if not len(lbr_from):
+            return
+
+        records = numpy.empty(len(lbr_from), dtype=self._buffer.dtype)
+        records["cpu_num"] = cpu_num
+        records["stop"] = self._stop
+        records["from"] = lbr_from
+        records["to"] = lbr_to
+        self._buffer.extend(records)
+
+        if not callstack:
+            self._update_stack(cpu_num, lbr_from.tolist(), lbr_to.tolist())
+
+    def call_stack(self, cpu_num):
+        """Get the reconstructed call stack of a vCPU.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The call sites and the call targets as uint64 arrays, innermost
+            call first.
+        """
+        self.collect(cpu_num)
+        stack = self._stacks.get(cpu_num, list())
+        sites = numpy.array([site for site, _ in reversed(stack)],
+                            dtype=numpy.uint64)
+        targets = numpy.array([target for _, target in reversed(stack)],
+                              dtype=numpy.uint64)
+        return sites, targets
+
+    def records(self):
+        """Get the branches that are currently in the buffer.
+
+        Returns
+        -------
+        numpy.ndarray
+            The records with the fields "cpu_num", "stop", "from", and "to".
+            Branches that were collected at the same stop have the same value
+            in the "stop" field.
+        """
+        return self._buffer.get()
+
+    def flush(self):
+        """Write the buffer to the output file, if one is configured."""
+        if self._config_values["output"] and len(self._buffer):
+            self._write(self._buffer)
+
+    def _write(self, buf):
+        with open(self._config_values["output"], "ab") as f:
+            buf.write(f)
+        if buf.dropped:
+            self._logger.warning("LBRCollector: {} records "
+                                 "dropped".format(buf.dropped))
@@ -27,6 +27,23 @@ import struct
 class VirtualMachineBase(plugins.Plugin):
     """Base class for all virtual machines (VMs)."""
 
+    def __init__(self):
+        super().__init__()
+        self._write_hooks = list()
+
+    def add_write_hook(self, hook):
+        """Add a hook that is called on physical memory writes.
+
+        The hook is called with the physical address and the size of every
+        write that is performed with :py:func:`phys_mem_write`. Note that
+        writes of the guest itself are not reported.
+        """
+        self._write_hooks.append(hook)
+
+    def remove_write_hook(self, hook):
+        """Remove a hook that was added with :py:func:`add_write_hook`."""
+        self._write_hooks.remove(hook)
+
     @property
     def phys_mem_size(self):
         """Get the size of the physical memory of the VM.
@@ -38,6 +55,18 @@ class VirtualMachineBase(plugins.Plugin):
         """
         return api.tenjint_api_get_ram_size()
 
+    @property
+    def ram_ranges(self):
+        """Get the guest physical address ranges of the RAM of the VM.
+
+        Returns
+        -------
+        list
+            A list of tuples (start, size), one for every contiguous range of
+            RAM.
+        """
+        return [(0, self.phys_mem_size)]
+
     def phys_mem_read(self, addr, size):
         """Read from the VM's physical memory.
 
@@ -79,6 +108,8 @@ class VirtualMachineBase(plugins.Plugin):
         RuntimeError
             If the requested physical memory cannot be written.
         """
+        for hook in self._write_hooks:
+            hook(addr, len(buf))
         return api.tenjint_api_write_phys_mem(addr, buf)
 
     def vtop(self, addr, dtb=None, cpu_num=None):
@@ -266,7 +297,8 @@ class VirtualMachineX86_64(VirtualMachineBase):
 
     def __init__(self):
         super().__init__()
-        self._lbr_enabled = [0 for _ in range(self.cpu_count)]
+        # The LBR filters requested by the users of each vCPU
+        self._lbr_selects = [list() for _ in range(self.cpu_count)]
         self._cpus = dict()
         self._lbrs = dict()
 
@@ -276,33 +308,71 @@ class VirtualMachineX86_64(VirtualMachineBase):
         self._cpus.clear()
         self._lbrs.clear()
 
-    def lbr_enable(self, cpu_num=None):
+    @property
+    def ram_ranges(self):
+        """Get the guest physical address ranges of the RAM of the VM.
+
+        The layout of the QEMU "pc" machine is assumed.  If the RAM does not
+        fit below 3.5 GiB, the RAM below 4 GiB ends at 3 GiB and the remainder
+        is placed at 4 GiB.
+
+        Returns
+        -------
+        list
+            A list of tuples (start, size), one for every contiguous range of
+            RAM.
+        """
+        size = self.phys_mem_size
+        if size < 0xe0000000:
+            return [(0, size)]
+        return [(0, 0xc0000000), (1 << 32, size - 0xc0000000)]
+
+    def _lbr_update(self, cpus, update):
+        """Update the LBR filters of vCPUs and reconfigure changed vCPUs."""
+        changes = dict()
+        for i in cpus:
+            old = (bool(self._lbr_selects[i]),
+                   api.lbr_select_merge(self._lbr_selects[i]))
+            update(self._lbr_selects[i])
+            new = (bool(self._lbr_selects[i]),
+                   api.lbr_select_merge(self._lbr_selects[i]))
+            if new != old:
+                changes[i] = new
+
+        if (len(changes) == self.cpu_count and
+                len(set(changes.values())) == 1):
+            enable, lbr_select = next(iter(changes.values()))
+            api.tenjint_api_update_feature_lbr(None, enable, lbr_select)
+        else:
+            for i, (enable, lbr_select) in changes.items():
+                api.tenjint_api_update_feature_lbr(i, enable, lbr_select)
+
+    def lbr_enable(self, cpu_num=None, lbr_select=0):
         """Enable the Last Branch Record Stack (LBR).
 
+        The LBR is shared by all users of a vCPU. If multiple users enable
+        the LBR with different filters, every branch that is recorded by any
+        of the filters is recorded (see
+        :py:func:`tenjint.api.api_x86_64.lbr_select_merge`).
+
         Parameters
         ----------
         cpu_num : int, optional
             The vCPU number to enable the LBR on. If no cpu number is provided,
             the LBR will be enabled on all vCPUs.
+        lbr_select : int, optional
+            The value of the LBR_SELECT MSR, which filters the recorded
+            branches (see the LBR_SELECT constants in
+            :py:mod:`tenjint.api.api_x86_64`). By default all branches are
+            recorded.
         """
-        enable = False
-
         if cpu_num is None:
-            for i in range(len(self._lbr_enabled)):
-                self._lbr_enabled[i] += 1
-
-                if self._lbr_enabled[i] == 1:
-                    enable = True
+            cpus = range(self.cpu_count)
         else:
-            self._lbr_enabled[cpu_num] += 1
-
-            if self._lbr_enabled[cpu_num] == 1:
-                enable = True
+            cpus = (cpu_num,)
+        self._lbr_update(cpus, lambda selects: selects.append(lbr_select))
 
-        if enable:
-            api.tenjint_api_update_feature_lbr(cpu_num, True, 0)
-
-    def lbr_disable(self, cpu_num=None):
+    def lbr_disable(self, cpu_num=None, lbr_select=0):
         """Disable the Last Branch Record Stack (LBR).
 
         Parameters
@@ -310,23 +380,36 @@ class VirtualMachineX86_64(VirtualMachineBase):
         cpu_num : int, optional
             The vCPU number to disable the LBR on. If no cpu number is provided,
             the LBR will be disabled on all vCPUs.
+        lbr_select : int, optional
+            The filter that was passed to :py:func:`lbr_enable`.
         """
-        disable = False
-
         if cpu_num is None:
-            for i in range(len(self._lbr_enabled)):
-                self._lbr_enabled[i] -= 1
-
-                if self._lbr_enabled[i] == 0:
-                    disable = True
+            cpus = range(self.cpu_count)
         else:
-            self._lbr_enabled[cpu_num] -= 1
+            cpus = (cpu_num,)
 
-            if self._lbr_enabled[cpu_num] == 0:
-                disable = True
+        def remove(selects):
+            if lbr_select in selects:
+                selects.remove(lbr_select)
+
+        self._lbr_update(cpus, remove)
+
+    def lbr_select(self, cpu_num):
+        """Get the LBR filter that is in effect on a vCPU.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU.
 
-        if disable:
-            api.tenjint_api_update_feature_lbr(cpu_num, False, 0)
+        Returns
+        -------
+        int or None
+            The value of the LBR_SELECT MSR or None if the LBR is disabled.
+        """
+        if not self._lbr_selects[cpu_num]:
+            return None
+        return api.lbr_select_merge(self._lbr_selects[cpu_num])
 
     def lbr(self, cpu_num):
         """Retrieve the Last Branch Record Stack (LBR).
@@ -346,7 +429,7 @@ class VirtualMachineX86_64(VirtualMachineBase):
         RuntimeError
             If the LBR has not been enabled to the requested vCPU.
         """
-        if not self._lbr_enabled[cpu_num]:
+        if not self._lbr_selects[cpu_num]:
             raise RuntimeError("LBR was never enabled for this CPU")
         try:
             rv = self._lbrs[cpu_num]
@@ -371,3 +454,18 @@ class VirtualMachineAARCH64(VirtualMachineBase):
 
     def _cont_hook(self):
         self._cpus.clear()
+
+    @property
+    def ram_ranges(self):
+        """Get the guest physical address ranges of the RAM of the VM.
+
+        The layout of the QEMU "virt" machine is assumed, which places the RAM
+        at 1 GiB.
+
+        Returns
+        -------
+        list
+            A list of tuples (start, size), one for every contiguous range of
+            RAM.
+        """
+        return [(0x40000000, self.phys_mem_size)]
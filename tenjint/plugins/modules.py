@@ -0,0 +1,360 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Provides the attribution of addresses to modules and mapped files.
+
+This module provides a service that maps guest virtual addresses to the kernel
+module or the memory mapping of a process that contains them. The regions of
+each address space are kept in a sorted interval array, such that large
+arrays of addresses, e.g., from breakpoint, LBR, or SLP events, can be
+attributed at once.
+"""
+
+import numpy
+
+from . import plugins
+from .operatingsystem import ProfileUnavailableError
+from .operatingsystem import SymbolResolutionError
+from .. import api
+
+class IntervalIndex(object):
+    """A sorted array of non-overlapping address intervals."""
+    def __init__(self, names, starts, ends):
+        """Create a new interval index.
+
+        Parameters
+        ----------
+        names : list of str
+            The names of the intervals.
+        starts : list of int
+            The first address of each interval.
+        ends : list of int
+            The first address after each interval.
+        """
+        super().__init__()
+        starts = numpy.asarray(starts, dtype=numpy.uint64)
+        order = numpy.argsort(starts, kind="stable")
+        self.starts = starts[order]
+        self.ends = numpy.asarray(ends, dtype=numpy.uint64)[order]
+        self.names = numpy.asarray(names, dtype=str)[order]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, addresses):
+        """Find the intervals that contain the given addresses.
+
+        Parameters
+        ----------
+        addresses : numpy.ndarray
+            The addresses as uint64 array.
+
+        Returns
+        -------
+        numpy.ndarray
+            The index of the interval of each address or -1 if an address is
+            not contained in any interval.
+        """
+        idx = numpy.searchsorted(self.starts, addresses, side="right") - 1
+        found = idx >= 0
+        found[found] = addresses[found] < self.ends[idx[found]]
+        idx[~found] = -1
+        return idx
+
+class ModuleIndexBase(plugins.Plugin):
+    """Module index service.
+
+    The service maintains an interval index of the kernel modules and one
+    index of the memory mappings per process. Indexes are built on first use.
+    Whether an index is still up to date is checked at most once per stop
+    with a cheap signature of the underlying kernel data structures. Only if
+    the signature changed, the index is refreshed.
+    """
+    name = "ModuleIndex"
+
+    def __init__(self):
+        super().__init__()
+        self._kernel_index = None
+        self._kernel_sig = None
+        self._kernel_checked = False
+        # key -> (signature, index, checked)
+        self._process_indexes = dict()
+        self._event_manager.add_continue_hook(self._cont_hook)
+
+    def uninit(self):
+        super().uninit()
+        self._event_manager.remove_continue_hook(self._cont_hook)
+        self._process_indexes.clear()
+
+    def _cont_hook(self):
+        self._kernel_checked = False
+        for key, (sig, index, _) in self._process_indexes.items():
+            self._process_indexes[key] = (sig, index, False)
+
+    def _kernel_signature(self):
+        raise NotImplementedError()
+
+    def _build_kernel_index(self, sig):
+        raise NotImplementedError()
+
+    def _process_key(self, proc):
+        raise NotImplementedError()
+
+    def _process_signature(self, proc):
+        raise NotImplementedError()
+
+    def _build_process_index(self, proc):
+        raise NotImplementedError()
+
+    @property
+    def kernel_index(self):
+        """The interval index of the kernel and its modules."""
+        if not self._kernel_checked:
+            self._kernel_checked = True
+            sig = self._kernel_signature()
+            if self._kernel_index is None or sig != self._kernel_sig:
+                self._logger.debug("Refreshing kernel module index")
+                self._kernel_index = self._build_kernel_index(sig)
+                self._kernel_sig = sig
+        return self._kernel_index
+
+    def process_index(self, pid=None, dtb=None):
+        """Get the interval index of the memory mappings of a process.
+
+        Parameters
+        ----------
+        pid : int, optional
+            The PID of the process. Either the PID or the DTB must be given.
+        dtb : int, optional
+            The DTB of the process. Either the PID or the DTB must be given.
+
+        Returns
+        -------
+        IntervalIndex
+            The index of the process.
+
+        Raises
+        ------
+        ValueError
+            If the process cannot be found.
+        tenjint.plugins.operatingsystem.ProfileUnavailableError
+            If no profile of the guest OS is available.
+        """
+        if not self._os.has_profile:
+            raise ProfileUnavailableError("The memory mappings of processes "
+                                          "require a profile")
+        proc = self._os.process(pid=pid, dtb=dtb)
+        if proc is None:
+            raise ValueError("process not found")
+
+        key = self._process_key(proc)
+        sig, index, checked = self._process_indexes.get(key,
+                                                        (None, None, False))
+        if not checked:
+            new_sig = self._process_signature(proc)
+            if index is None or new_sig != sig:
+                self._logger.debug("Refreshing mappings of process "
+                                   "{}".format(int(proc.pid)))
+                index = self._build_process_index(proc)
+            self._process_indexes[key] = (new_sig, index, True)
+        return index
+
+    def lookup_many(self, addresses, pid=None, dtb=None):
+        """Attribute multiple addresses to modules or mapped files.
+
+        Addresses are first looked up in the kernel index. If a PID or a DTB
+        is given, the remaining addresses are looked up in the memory mappings
+        of the process.
+
+        Parameters
+        ----------
+        addresses : list of int or numpy.ndarray
+            The addresses to look up.
+        pid : int, optional
+            The PID of the process whose mappings should be considered.
+        dtb : int, optional
+            The DTB of the process whose mappings should be considered.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The names of the regions and the offsets of the addresses within
+            them. If an address does not belong to any region, its name is an
+            empty string and its offset is the address itself.
+
+        Raises
+        ------
+        tenjint.plugins.operatingsystem.ProfileUnavailableError
+            If a PID or a DTB is given, but no profile of the guest OS is
+            available.
+        """
+        addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+        names = numpy.zeros(len(addresses), dtype=object)
+        names[:] = ""
+        offsets = addresses.copy()
+
+        indexes = [self.kernel_index]
+        if pid is not None or dtb is not None:
+            indexes.append(self.process_index(pid=pid, dtb=dtb))
+
+        todo = numpy.arange(len(addresses))
+        for index in indexes:
+            if not len(todo) or not len(index):
+                continue
+            idx = index.find(addresses[todo])
+            found = idx >= 0
+            hits = todo[found]
+            names[hits] = index.names[idx[found]]
+            offsets[hits] = addresses[hits] - index.starts[idx[found]]
+            todo = todo[~found]
+
+        return names, offsets
+
+    def lookup(self, address, pid=None, dtb=None):
+        """Attribute an address to a module or a mapped file.
+
+        Parameters
+        ----------
+        address : int
+            The address to look up.
+        pid : int, optional
+            The PID of the process whose mappings should be considered.
+        dtb : int, optional
+            The DTB of the process whose mappings should be considered.
+
+        Returns
+        -------
+        tuple or None
+            The name of the region and the offset of the address within the
+            region or None if the address does not belong to any region.
+        """
+        names, offsets = self.lookup_many([address], pid=pid, dtb=dtb)
+        if not names[0]:
+            return None
+        return (names[0], int(offsets[0]))
+
+class ModuleIndexLinux(ModuleIndexBase):
+    """Module index for Linux.
+
+    The signature of the kernel modules is the list of the addresses of all
+    entries in the module list. Only new modules are read when it changes.
+    The signature of the mappings of a process consists of the number of
+    mappings, the size of the address space, and the first mapping. A mapping
+    that is replaced by one of the same size, e.g., with mremap or with mmap
+    and MAP_FIXED, does not change the signature and is not detected.
+
+    Without a profile, modules and processes cannot be read. The kernel index
+    then only contains the kernel image and the process indexes are not
+    available.
+    """
+    _abstract = False
+    os = api.OsType.OS_LINUX
+
+    _max_modules = 4096
+
+    def __init__(self):
+        super().__init__()
+        self._modules = dict()
+
+        self._module_list_offset = None
+        # (offset, size) of the fields of the mm_struct in the signature
+        self._mm_sig_fields = list()
+        if self._os.has_profile:
+            profile = self._os.compact_profile or self._os.session.profile
+            self._module_list_offset = profile.get_obj_offset("module", "list")
+            ptr_size = self._os.pointer_width
+            for field, size in (("map_count", 4), ("total_vm", ptr_size),
+                                ("mmap", ptr_size)):
+                offset = profile.get_obj_offset("mm_struct", field)
+                if offset is not None:
+                    self._mm_sig_fields.append((offset, size))
+
+        try:
+            self._kernel_ranges = [tuple(self._os.get_symbol_addresses(
+                                        ["linux!_text", "linux!_end"]))]
+        except SymbolResolutionError:
+            self._kernel_ranges = list()
+
+    def _kernel_signature(self):
+        if self._module_list_offset is None:
+            return tuple()
+        head = self._os.get_symbol_address("linux!modules")
+        nodes = list()
+        node = self._os.read_kernel_pointer(head)
+        while node != head and len(nodes) < self._max_modules:
+            nodes.append(node)
+            node = self._os.read_kernel_pointer(node)
+        return tuple(nodes)
+
+    def _read_module(self, node):
+        module = self._os.session.profile.module(
+                                            node - self._module_list_offset)
+        if module.m("core_layout"):
+            base = int(module.core_layout.base)
+            size = int(module.core_layout.size)
+        else:
+            base = int(module.module_core)
+            size = int(module.core_size)
+        return (str(module.name), base, base + size)
+
+    def _build_kernel_index(self, sig):
+        modules = dict()
+        for node in sig:
+            if node in self._modules:
+                modules[node] = self._modules[node]
+            else:
+                modules[node] = self._read_module(node)
+        self._modules = modules
+
+        names = ["kernel"] * len(self._kernel_ranges)
+        starts = [start for start, _ in self._kernel_ranges]
+        ends = [end for _, end in self._kernel_ranges]
+        for name, start, end in modules.values():
+            names.append(name)
+            starts.append(start)
+            ends.append(end)
+        return IntervalIndex(names, starts, ends)
+
+    def _process_key(self, proc):
+        return proc.mm.v()
+
+    def _process_signature(self, proc):
+        mm = proc.mm.v()
+        if not mm:
+            return None
+        sig = [mm]
+        kernel_as = self._os.session.kernel_address_space
+        for offset, size in self._mm_sig_fields:
+            sig.append(int.from_bytes(kernel_as.read(mm + offset, size),
+                                      "little"))
+        return tuple(sig)
+
+    def _build_process_index(self, proc):
+        names = list()
+        starts = list()
+        ends = list()
+        if proc.mm:
+            for vma in proc.mm.mmap.walk_list("vm_next"):
+                if vma.vm_file:
+                    names.append(str(proc.get_path(vma.vm_file)))
+                else:
+                    names.append("[anon]")
+                starts.append(int(vma.vm_start))
+                ends.append(int(vma.vm_end))
+        return IntervalIndex(names, starts, ends)
@@ -23,20 +23,239 @@ This module provides all classes and functions that give access to the guest
 operating system (OS).
 """
 
+import collections
+import functools
+import hashlib
+import json
+import os
 import struct
+import time
+
+import numpy
 
 from . import plugins
 from .. import api
 from .. import config
-
+from .. import discovery
+from .. import kallsyms
+from .. import profile
+from .. import service
+from .. import symbols
+from ..event import EventCallback
+
+from rekall import addrspace
 from rekall.session import InteractiveSession
 from rekall.plugins.addrspaces import tenjint
 from rekall.plugin import PluginError
 
+INVALID_GPA = 0xffffffffffffffff
+"""The physical address returned by :py:func:`OperatingSystemBase.vtop_many`
+for addresses that cannot be translated."""
+
 class SymbolResolutionError(Exception):
     """Raised when a symbol cannot be resolved."""
     pass
 
+class ProfileUnavailableError(Exception):
+    """Raised when a function requires a profile, but none is available."""
+    pass
+
+TaskInfo = collections.namedtuple("TaskInfo", ["address", "pid", "tid", "comm",
+                                               "mm", "dtb"])
+"""Lightweight description of a task.
+
+Contains the address of the task object, the process and thread ID, the name
+of the task, the address of its memory descriptor, and its DTB. The memory
+descriptor and the DTB are None for kernel threads. On Windows, the address is
+the address of the ETHREAD and the memory descriptor is the address of the
+EPROCESS.
+"""
+
+class TrackingAddressSpace(tenjint.TenjintAddressSpace):
+    """A physical address space that reports the pages that are accessed.
+
+    Reads are reported to the tracking cache, such that cache entries can be
+    tagged with the pages they were derived from. Writes invalidate the
+    entries that depend on the written pages.
+    """
+    __abstract = True
+
+    tracking_cache = None
+    """The :py:class:`TrackingCache` to report to or None."""
+
+    def read(self, addr, length):
+        if self.tracking_cache is not None:
+            self.tracking_cache.pages_read(addr, length)
+        return super().read(addr, length)
+
+    def write(self, addr, data):
+        if self.tracking_cache is not None:
+            self.tracking_cache.invalidate_range(addr, len(data))
+        return super().write(addr, data)
+
+class DirectAddressSpace(object):
+    """A minimal virtual address space that translates with the API.
+
+    This address space is used for the kernel if no profile is available and
+    Rekall's address spaces cannot be used. Like Rekall's address spaces, it
+    reads zeros from addresses that cannot be translated.
+    """
+    def __init__(self, dtb):
+        super().__init__()
+        self.dtb = dtb
+
+    def vtop(self, addr):
+        try:
+            return api.tenjint_api_vtop(addr, self.dtb)
+        except api.TranslationError:
+            return None
+
+    def read(self, addr, length):
+        rv = list()
+        while length > 0:
+            size = min(length, api.PAGE_SIZE - (addr & (api.PAGE_SIZE - 1)))
+            paddr = self.vtop(addr)
+            if paddr is None:
+                rv.append(b"\x00" * size)
+            else:
+                rv.append(api.tenjint_api_read_phys_mem(paddr, size))
+            addr += size
+            length -= size
+        return b"".join(rv)
+
+class TrackingCache(object):
+    """A Rekall cache that invalidates entries selectively.
+
+    Volatile entries are tagged with the guest pages that were read since the
+    VM was stopped, including the pages of all entries that were used in the
+    meantime. Thus the tag of an entry is a superset of the pages the entry
+    was derived from. Instead of dropping all volatile entries whenever the
+    VM is resumed, only the entries whose pages were written are dropped.
+    Writes have to be reported with :py:func:`invalidate`.
+
+    Entries that would require more than max_pages tracked pages in total
+    are dropped on the next resume. Non-volatile entries are stored in the
+    original cache.
+    """
+    def __init__(self, cache, max_pages):
+        """Wrap a Rekall cache.
+
+        Parameters
+        ----------
+        cache : object
+            The Rekall cache of the session.
+        max_pages : int
+            The maximum number of pages that are tracked.
+        """
+        super().__init__()
+        self._cache = cache
+        self._max_pages = max_pages
+        self._entries = dict()
+        self._by_gfn = dict()
+        self._touched = set()
+        self._untracked = set()
+        self.pending = set()
+        """Pages that entries depend on, but that are not tracked yet."""
+        self.tracked = set()
+        """Pages that are tracked."""
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+    def pages_read(self, addr, length):
+        """Report a read of the guest physical memory."""
+        first = addr >> api.PAGE_SHIFT
+        last = (addr + max(length, 1) - 1) >> api.PAGE_SHIFT
+        self._touched.update(range(first, last + 1))
+
+    def Get(self, item, *args, **kwargs):
+        try:
+            value, gfns = self._entries[item]
+        except KeyError:
+            return self._cache.Get(item, *args, **kwargs)
+        self._touched.update(gfns)
+        return value
+
+    def Set(self, item, value, volatile=True):
+        self._drop(item)
+        if value is None or not volatile:
+            return self._cache.Set(item, value, volatile=volatile)
+
+        gfns = frozenset(self._touched)
+        new = gfns - self.tracked - self.pending
+        if len(self.tracked) + len(self.pending) + len(new) > self._max_pages:
+            # Keep the entry until the VM is resumed
+            self._untracked.add(item)
+            gfns = frozenset()
+        else:
+            self.pending.update(new)
+
+        self._entries[item] = (value, gfns)
+        for gfn in gfns:
+            self._by_gfn.setdefault(gfn, set()).add(item)
+
+    def _drop(self, item):
+        self._untracked.discard(item)
+        entry = self._entries.pop(item, None)
+        if entry is None:
+            return
+        for gfn in entry[1]:
+            items = self._by_gfn[gfn]
+            items.discard(item)
+            if not items:
+                del self._by_gfn[gfn]
+
+    def invalidate(self, gfn):
+        """Drop all entries that depend on the given page.
+
+        Returns
+        -------
+        int
+            The number of dropped entries.
+        """
+        items = list(self._by_gfn.get(gfn, ()))
+        for item in items:
+            self._drop(item)
+        self.tracked.discard(gfn)
+        self.pending.discard(gfn)
+        return len(items)
+
+    def invalidate_range(self, addr, length):
+        """Drop all entries that depend on the given physical memory."""
+        first = addr >> api.PAGE_SHIFT
+        last = (addr + max(length, 1) - 1) >> api.PAGE_SHIFT
+        for gfn in range(first, last + 1):
+            if gfn in self._by_gfn:
+                self.invalidate(gfn)
+
+    def resume(self):
+        """Prepare the cache for resuming the VM.
+
+        Drops the entries that are not tracked and returns the pages that
+        need to be tracked from now on.
+        """
+        for item in list(self._untracked):
+            self._drop(item)
+        self._touched.clear()
+        pending = self.pending
+        self.tracked.update(pending)
+        self.pending = set()
+        return pending
+
+    def Clear(self):
+        self._clear_entries()
+        return self._cache.Clear()
+
+    def ClearVolatile(self):
+        self._clear_entries()
+        return self._cache.ClearVolatile()
+
+    def _clear_entries(self):
+        self._entries.clear()
+        self._by_gfn.clear()
+        self._untracked.clear()
+        self._touched.clear()
+
 class OperatingSystemConfig(config.ConfigMixin):
     """Helper class for the configuration of the operating system."""
     _config_options = [
@@ -44,6 +263,52 @@ class OperatingSystemConfig(config.ConfigMixin):
             "name": "rekall_profile", "default": None,
             "help": "The profile string to pass to the Rekall session."
         },
+        {
+            "name": "kallsyms", "default": True,
+            "help": "If neither a Rekall profile nor a compact profile is "
+                    "configured, try to find the kernel symbols of a Linux "
+                    "guest in its memory."
+        },
+        {
+            "name": "compact_profile", "default": None,
+            "help": "Path of a compact profile (see tenjint.profile) that is "
+                    "used for fast lookups. It is built from the Rekall "
+                    "profile if it does not exist."
+        },
+        {
+            "name": "selective_invalidation", "default": False,
+            "help": "Keep Rekall cache entries across resumes until the "
+                    "guest pages they were derived from are written. Writes "
+                    "that do not cause SLP violations, e.g., DMA, are not "
+                    "detected."
+        },
+        {
+            "name": "selective_invalidation_pages", "default": 4096,
+            "help": "The maximum number of guest pages that are tracked for "
+                    "selective invalidation."
+        },
+        {
+            "name": "process_index_ttl", "default": 1.0,
+            "help": "The number of seconds for which process lookups that "
+                    "fail after a walk of the process list are answered from "
+                    "the index without walking it again. A task switch to an "
+                    "unknown DTB ends this period early."
+        },
+        {
+            "name": "cache_dir", "default": None,
+            "help": "Directory in which derived OS data, e.g., the symbol "
+                    "index, is cached across runs."
+        },
+        {
+            "name": "ram_file", "default": None,
+            "help": "File backing the guest RAM. If given, kernel discovery "
+                    "maps this file in worker processes."
+        },
+        {
+            "name": "discovery_workers", "default": None,
+            "help": "Number of workers for kernel discovery. Defaults to the "
+                    "number of CPUs."
+        },
     ]
     """Configuration options."""
 
@@ -53,9 +318,29 @@ class OperatingSystemBase(plugins.Plugin):
     session = None
     """The rekall session object."""
 
+    compact_profile = None
+    """The compact profile or None if no compact profile is configured."""
+
     _config_values = None
     """The config values."""
 
+    _warm_start = None
+    """The warm start data if the OS was loaded from the cache."""
+
+    _kallsyms_index = None
+    """The symbol index decoded from kallsyms if no profile is available."""
+
+    _banner_size = 256
+    """The number of bytes of the Linux banner that fingerprint the guest."""
+
+    _address_space_names = {
+        "AMD64": "AMD64PagedMemory",
+        "I386": "IA32PagedMemory",
+        "I386_PAE": "IA32PagedMemoryPae",
+        "ARM": "ArmPagedMemory",
+    }
+    """The Rekall address spaces of the kernel by the arch of the profile."""
+
     @classmethod
     def load(cls, **kwargs):
         """Detects the guest operating system (OS).
@@ -80,17 +365,35 @@ class OperatingSystemBase(plugins.Plugin):
             session.session_list.append(session)
 
             session.SetParameter("cache", "tenjint")
-            addr_space = tenjint.TenjintAddressSpace(session=session)
+            if cls._config_values["selective_invalidation"]:
+                addr_space = TrackingAddressSpace(session=session)
+            else:
+                addr_space = tenjint.TenjintAddressSpace(session=session)
             session.physical_address_space = addr_space
 
-            if session.GetParameter("mode_windows"):
+            cls.compact_profile = cls._load_compact_profile()
+            compact = cls.compact_profile
+
+            if (profile is None and compact is None and
+                    cls._config_values["kallsyms"] and
+                    cls._load_kallsyms(session)):
+                cls.session = session
+                return super().load(**kwargs)
+
+            if (compact is not None and
+                    compact.metadata("ProfileClass") == "Linux"):
+                api.os = api.OsType.OS_LINUX
+            elif session.GetParameter("mode_windows"):
                 api.os = api.OsType.OS_WIN
             elif session.GetParameter("mode_linux"):
                 api.os = api.OsType.OS_LINUX
             else:
                 raise RuntimeError("Unable to determine guest OS type.")
 
-            rekall_arch_str = session.profile.metadata("arch")
+            if compact is not None and compact.metadata("arch") is not None:
+                rekall_arch_str = compact.metadata("arch")
+            else:
+                rekall_arch_str = session.profile.metadata("arch")
             if rekall_arch_str == "AMD64":
                 api.arch = api.Arch.X86_64
             elif rekall_arch_str == "I386":
@@ -102,42 +405,428 @@ class OperatingSystemBase(plugins.Plugin):
             else:
                 raise RuntimeError("Unexpected guest kernel architecture")
 
-            try:
-                session.plugins.load_as().GetVirtualAddressSpace()
-            except PluginError as e:
+            warm_start = cls._load_warm_start(session)
+            if warm_start is not None:
+                cls._set_kernel_address_space(session, warm_start["dtb"],
+                                              warm_start["kernel_slide"])
+                cls._warm_start = warm_start
+            else:
+                cls._find_kernel(session)
+
+            cls.session = session
+
+        # Now load
+        return super().load(**kwargs)
+
+    @classmethod
+    def _get_ram_ranges(cls):
+        """Get the RAM ranges of the VM for the discovery."""
+        return service.manager().get("VirtualMachine").ram_ranges
+
+    @classmethod
+    def _find_kernel(cls, session):
+        """Find the kernel and set up the kernel address space.
+
+        Rekall's discovery requires the full Rekall profile. Thus, if a
+        compact profile is configured, the fast discovery is tried first.
+        """
+        discover = functools.partial(discovery.find_kernel,
+                                ram_ranges=cls._get_ram_ranges(),
+                                ram_file=cls._config_values["ram_file"],
+                                workers=cls._config_values["discovery_workers"])
+        if cls.compact_profile is not None:
+            kernel = discover(cls.compact_profile)
+            if kernel is not None:
+                cls._set_kernel_address_space(session, *kernel)
+                return
+
+        try:
+            session.plugins.load_as().GetVirtualAddressSpace()
+        except PluginError as e:
+            kernel = None
+            if cls.compact_profile is None:
+                kernel = discover(session.profile)
+            if kernel is not None:
+                cls._set_kernel_address_space(session, *kernel)
+            else:
                 for item in session.plugins.find_kaslr(
                         scan_whole_physical_space=True):
                     if item["Valid"]:
-                        find_dtb = session.plugins.find_dtb()
-                        session.kernel_address_space = find_dtb.GetAddressSpaceImplementation()(
-                                base=session.physical_address_space, dtb=item["DTB"], session=session,
-                                profile=session.profile, kernel_slide=item["kernel_slide"])
-                        session.SetCache("kernel_slide", item["kernel_slide"], volatile=False)
+                        cls._set_kernel_address_space(session, item["DTB"],
+                                                      item["kernel_slide"])
                         break
-                if not session.kernel_address_space:
-                    raise e
-                session.SetCache("default_address_space",
-                                 session.kernel_address_space,
-                                 volatile=False)
+            if not session.kernel_address_space:
+                raise e
 
-            cls.session = session
+    @classmethod
+    def _set_kernel_address_space(cls, session, dtb, kernel_slide):
+        impl = None
+        if cls.compact_profile is not None:
+            arch = cls.compact_profile.metadata("arch")
+            if arch == "I386" and cls.compact_profile.metadata("pae"):
+                arch = "I386_PAE"
+            name = cls._address_space_names.get(arch, None)
+            if name is not None:
+                impl = addrspace.BaseAddressSpace.classes[name]
+        if impl is not None:
+            # Do not touch session.profile, it would parse the Rekall profile
+            session.kernel_address_space = impl(
+                    base=session.physical_address_space, dtb=dtb,
+                    session=session, kernel_slide=kernel_slide)
+        else:
+            find_dtb = session.plugins.find_dtb()
+            session.kernel_address_space = \
+                find_dtb.GetAddressSpaceImplementation()(
+                    base=session.physical_address_space, dtb=dtb,
+                    session=session, profile=session.profile,
+                    kernel_slide=kernel_slide)
+        session.SetCache("kernel_slide", kernel_slide, volatile=False)
+        session.SetCache("default_address_space",
+                         session.kernel_address_space,
+                         volatile=False)
 
-        # Now load
-        return super().load(**kwargs)
+    @classmethod
+    def _load_kallsyms(cls, session):
+        """Set up a Linux guest without a profile.
+
+        Only the symbols, the kernel address space, and functions that do not
+        depend on a profile are available in this case.
+        """
+        rv = kallsyms.find_kallsyms(ram_ranges=cls._get_ram_ranges(),
+                                ram_file=cls._config_values["ram_file"],
+                                workers=cls._config_values["discovery_workers"])
+        if rv is None:
+            return False
+
+        cls._kallsyms_index, dtb = rv
+        api.os = api.OsType.OS_LINUX
+        session.kernel_address_space = DirectAddressSpace(dtb)
+        session.SetCache("kernel_slide", 0, volatile=False)
+        session.SetCache("default_address_space",
+                         session.kernel_address_space, volatile=False)
+        return True
+
+    @classmethod
+    def _load_compact_profile(cls):
+        """Load the configured compact profile.
+
+        If the compact profile does not exist yet, it is built from the Rekall
+        profile as long as the Rekall profile is a local file.
+        """
+        path = cls._config_values["compact_profile"]
+        if not path:
+            return None
+        path = os.path.expanduser(path)
+        rekall_profile = cls._config_values["rekall_profile"]
+        if (not os.path.exists(path) and rekall_profile and
+                os.path.isfile(rekall_profile)):
+            profile.build(rekall_profile, path)
+        return profile.CompactProfile(path)
+
+    @classmethod
+    def _get_profile_hash(cls, session):
+        if cls.compact_profile is not None:
+            return cls.compact_profile.hash
+        h = hashlib.sha1()
+        h.update(str(cls._config_values["rekall_profile"]).encode())
+        h.update(str(session.profile.name).encode())
+        return h.hexdigest()
+
+    @classmethod
+    def _get_cache_path(cls, session, name):
+        """Get the path of a file in the cache directory or None."""
+        cache_dir = cls._config_values["cache_dir"]
+        if not cache_dir or cls._kallsyms_index is not None:
+            return None
+        cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        return os.path.join(cache_dir, "{}-{}".format(
+                                        cls._get_profile_hash(session), name))
+
+    @classmethod
+    def _fingerprint_ranges(cls, session, kernel_slide):
+        """Get the read-only kernel data that fingerprints the guest.
+
+        The data consists of the Linux banner and, if available, the notes
+        section, which contains the build ID of the kernel.  Both are part of
+        the read-only data of the kernel image, which is also physically
+        contiguous.
+
+        Returns
+        -------
+        list or None
+            A list of tuples (address, size) or None if the guest OS is not
+            supported.
+        """
+        if api.os != api.OsType.OS_LINUX:
+            return None
+        profile = cls.compact_profile or session.profile
+        mask = 0xffffffffffffffff
+        rv = [((profile.get_constant("linux_banner") + kernel_slide) & mask,
+               cls._banner_size)]
+        start = profile.get_constant("__start_notes")
+        stop = profile.get_constant("__stop_notes")
+        if start and stop and start < stop:
+            rv.append(((start + kernel_slide) & mask, stop - start))
+        return rv
+
+    @staticmethod
+    def _fingerprint(ranges):
+        h = hashlib.sha1()
+        for gpa, size in ranges:
+            h.update(api.tenjint_api_read_phys_mem(gpa, size))
+        return h.hexdigest()
+
+    @classmethod
+    def _load_warm_start(cls, session):
+        """Load and validate the warm start data of a previous run.
+
+        The data is only used if the fingerprinted kernel data still
+        translates to the same physical addresses with the cached DTB and
+        slide and its content did not change.
+        """
+        path = cls._get_cache_path(session, "warmstart.json")
+        if path is None or not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            ranges = cls._fingerprint_ranges(session, data["kernel_slide"])
+            if ranges is None:
+                return None
+            gpas = [api.tenjint_api_vtop(addr, data["dtb"])
+                    for addr, _ in ranges]
+            if (gpas != data["gpas"] or
+                    cls._fingerprint(zip(gpas, (size for _, size in ranges)))
+                    != data["fingerprint"]):
+                return None
+        except (OSError, ValueError, KeyError, RuntimeError,
+                api.TranslationError):
+            return None
+        return data
+
+    def _save_warm_start(self):
+        path = self._cache_path("warmstart.json")
+        if path is None:
+            return
+        kernel_slide = self.kernel_slide
+        ranges = self._fingerprint_ranges(self.session, kernel_slide)
+        if ranges is None:
+            return
+
+        try:
+            dtb = self.session.kernel_address_space.dtb
+            gpas = [api.tenjint_api_vtop(addr, dtb) for addr, _ in ranges]
+            data = {
+                "dtb": dtb,
+                "kernel_slide": kernel_slide,
+                "gpas": gpas,
+                "fingerprint": self._fingerprint(
+                                zip(gpas, (size for _, size in ranges))),
+            }
+            data.update(self._warm_start_state())
+            with open(path, "w") as f:
+                json.dump(data, f)
+        except (OSError, RuntimeError, api.TranslationError) as e:
+            self._logger.warning("Unable to store warm start data: "
+                                 "{}".format(e))
+
+    def _warm_start_state(self):
+        """Get OS specific state that should be cached across runs."""
+        return dict()
+
+    def _restore_warm_start_state(self, data):
+        """Restore OS specific state from the warm start data."""
+        pass
 
     def __init__(self):
         super().__init__()
 
         self._pointer_width = None
         self._struct_ptr_fmt = None
+        self._profile_hash = None
+        self._symbol_index = None
+        self._symbol_index_loaded = False
         self._event_manager.add_continue_hook(self._cont_hook)
 
+        # Process index: offset -> (proc, pid, dtb, tids) and key -> offset
+        self._procs = dict()
+        self._procs_by_pid = dict()
+        self._procs_by_tid = dict()
+        self._procs_by_dtb = dict()
+        self._unknown_dtbs = set()
+        # The time of the last complete walk if the index is still complete
+        self._procs_complete = None
+
+        # Process address spaces: dtb -> address space
+        self._address_spaces = dict()
+
+        # Current task per vCPU, only valid until the VM is resumed
+        self._current_procs = dict()
+        self._current_task_infos = dict()
+
+        # Selective invalidation of the Rekall cache: the gfns whose writes
+        # are tracked and a single callback for all of them
+        self._slp_service = None
+        self._cache = None
+        self._cache_gfns = set()
+        self._cache_write_cb = None
+        if self._config_values["selective_invalidation"]:
+            self._enable_selective_invalidation()
+
+        if self._warm_start is not None:
+            self._restore_warm_start_state(self._warm_start)
+        else:
+            self._save_warm_start()
+
+        # Only listen to task switches that were requested by others
+        self._ts_cb = None
+        if self.has_profile:
+            self._ts_cb = EventCallback(self._ts_cb_func,
+                                        "SystemEventTaskSwitch")
+            self._event_manager.request_event(self._ts_cb, send_request=False)
+
     def uninit(self):
         super().uninit()
         self._event_manager.remove_continue_hook(self._cont_hook)
+        if self._ts_cb is not None:
+            self._event_manager.cancel_event(self._ts_cb)
+            self._ts_cb = None
+        if self._cache is not None:
+            self._disable_selective_invalidation()
 
     def _cont_hook(self):
+        if self._cache is not None:
+            self._track_pages(self._cache.resume())
+        else:
+            self.session.cache.ClearVolatile()
+        self._current_procs.clear()
+        self._current_task_infos.clear()
+
+    def _enable_selective_invalidation(self):
         self.session.cache.ClearVolatile()
+        self._cache = TrackingCache(self.session.cache,
+                        self._config_values["selective_invalidation_pages"])
+        self.session.cache = self._cache
+        self.session.physical_address_space.tracking_cache = self._cache
+        self._vm.add_write_hook(self._cache.invalidate_range)
+
+    def _disable_selective_invalidation(self):
+        self._vm.remove_write_hook(self._cache.invalidate_range)
+        self.session.physical_address_space.tracking_cache = None
+        self.session.cache = self._cache._cache
+        self.session.cache.ClearVolatile()
+        if self._cache_write_cb is not None:
+            self._event_manager.cancel_event(self._cache_write_cb)
+            self._cache_write_cb = None
+        for gfn in self._cache_gfns:
+            self._slp_service.untrack_writes(gfn << api.PAGE_SHIFT)
+        self._cache_gfns.clear()
+        self._cache = None
+
+    def _track_pages(self, gfns):
+        """Trap writes to pages that cache entries depend on."""
+        if not gfns:
+            return
+        if self._cache_write_cb is None:
+            # The OS is loaded before the SLP service
+            self._slp_service = self._service_manager.get("SLPPlugin")
+            self._cache_write_cb = EventCallback(self._cache_write_cb_func,
+                                                 "SystemEventSLP",
+                                                 {"global_req": True,
+                                                  "trap_r": False,
+                                                  "trap_w": True,
+                                                  "trap_x": False})
+            self._event_manager.request_event(self._cache_write_cb)
+        for gfn in gfns:
+            if gfn in self._cache_gfns:
+                continue
+            self._cache_gfns.add(gfn)
+            self._slp_service.track_writes(gfn << api.PAGE_SHIFT)
+
+    def _cache_write_cb_func(self, event):
+        gfn = event.gpa >> api.PAGE_SHIFT
+        if gfn not in self._cache_gfns:
+            return
+        self._cache_gfns.discard(gfn)
+        self._slp_service.untrack_writes(gfn << api.PAGE_SHIFT)
+        dropped = self._cache.invalidate(gfn)
+        self._logger.debug("Write to page 0x{:x} invalidated {} cache "
+                           "entries".format(gfn, dropped))
+
+    def current_process(self, cpu_num):
+        """Retrieve the current process.
+
+        Retrieve the process that is currently running on the given vCPU. The
+        result is cached until the VM is resumed.
+
+        Parameters
+        ----------
+        cpu_num : int
+            Try to retrieve the process that is currently running on the vCPU
+            with the number cpu_num.
+
+        Returns
+        -------
+        object
+            A representation of the process.
+
+        Raises
+        ------
+        ProfileUnavailableError
+            If no profile of the guest OS is available.
+        """
+        try:
+            return self._current_procs[cpu_num]
+        except KeyError:
+            rv = self._current_process(cpu_num)
+            self._current_procs[cpu_num] = rv
+            return rv
+
+    def current_task_info(self, cpu_num):
+        """Retrieve information about the current task.
+
+        In contrast to :py:func:`current_process` this function does not
+        create a Rekall object, but reads the required fields directly. The
+        result is cached until the VM is resumed.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU.
+
+        Returns
+        -------
+        TaskInfo
+            Information about the task running on the vCPU.
+
+        Raises
+        ------
+        ProfileUnavailableError
+            If no profile of the guest OS is available.
+        """
+        try:
+            return self._current_task_infos[cpu_num]
+        except KeyError:
+            rv = self._current_task_info(cpu_num)
+            self._current_task_infos[cpu_num] = rv
+            return rv
+
+    def _current_process(self, cpu_num):
+        raise NotImplementedError()
+
+    @staticmethod
+    def _layout(fields):
+        """Get the range that covers the given (offset, size) fields."""
+        start = min(offset for offset, _ in fields.values())
+        end = max(offset + size for offset, size in fields.values())
+        offsets = {name: offset - start
+                   for name, (offset, _) in fields.items()}
+        return (start, end - start, offsets)
+
+    def _current_task_info(self, cpu_num):
+        raise NotImplementedError()
 
     @property
     def pointer_width(self):
@@ -155,6 +844,81 @@ class OperatingSystemBase(plugins.Plugin):
                 self._pointer_width = 4
         return self._pointer_width
 
+    @property
+    def has_profile(self):
+        """Whether a profile of the guest OS is available.
+
+        If the symbols were decoded from kallsyms, only the symbols, the
+        kernel address space, and the functions that are based on them are
+        available. Processes, tasks, and their memory mappings cannot be
+        inspected and raise :py:class:`ProfileUnavailableError`.
+        """
+        return self._kallsyms_index is None
+
+    def _check_profile(self):
+        if not self.has_profile:
+            raise ProfileUnavailableError("No profile of the guest OS")
+
+    def _get_profile(self):
+        """Get the compact profile if configured or the Rekall profile.
+
+        Raises
+        ------
+        ProfileUnavailableError
+            If no profile is available.
+        """
+        self._check_profile()
+        return self.compact_profile or self.session.profile
+
+    @property
+    def kernel_slide(self):
+        """The KASLR slide of the kernel."""
+        return self.session.GetParameter("kernel_slide") or 0
+
+    @property
+    def profile_hash(self):
+        """A hash that identifies the profile of the guest OS."""
+        if self._profile_hash is None:
+            self._profile_hash = self._get_profile_hash(self.session)
+        return self._profile_hash
+
+    def _cache_path(self, name):
+        """Get the path of a file in the cache directory or None."""
+        return self._get_cache_path(self.session, name)
+
+    def _build_symbol_index(self):
+        """Build the symbol index of the OS.
+
+        Returns
+        -------
+        tenjint.symbols.SymbolIndex or None
+            The index or None if the OS does not support a symbol index.
+        """
+        return None
+
+    @property
+    def symbol_index(self):
+        """The symbol index of the OS.
+
+        The index is built on first use and cached on disk if a cache directory
+        is configured. If the OS does not support a symbol index, this is None.
+        """
+        if not self._symbol_index_loaded:
+            self._symbol_index_loaded = True
+            path = self._cache_path("symbols.npz")
+            if path is not None and os.path.exists(path):
+                try:
+                    self._symbol_index = symbols.SymbolIndex.load(path,
+                                                    slide=self.kernel_slide)
+                except (OSError, ValueError, KeyError) as e:
+                    self._logger.warning("Unable to load symbol index from "
+                                         "{}: {}".format(path, e))
+            if self._symbol_index is None:
+                self._symbol_index = self._build_symbol_index()
+                if self._symbol_index is not None and path is not None:
+                    self._symbol_index.save(path, slide=self.kernel_slide)
+        return self._symbol_index
+
     def read_kernel_pointer(self, addr):
         """Read a kernel pointer from the given address.
 
@@ -178,23 +942,111 @@ class OperatingSystemBase(plugins.Plugin):
                                                          self.pointer_width))[0]
 
     def pslist(self):
+        self._check_profile()
         for proc in self.session.plugins.pslist().filter_processes():
             yield proc
 
-    def process(self, pid=None, dtb=None):
+    def _process_tids(self, proc):
+        """Get the thread IDs of a process."""
+        return (int(proc.pid),)
+
+    def _process_valid(self, proc, pid, dtb):
+        """Check whether an indexed process is still running."""
+        return proc.pid == pid and proc.dtb == dtb
+
+    def _index_process(self, proc):
+        entry = (proc, int(proc.pid), proc.dtb, tuple(self._process_tids(proc)))
+        old = self._procs.get(proc.obj_offset, None)
+        address_space = None
+        if old is not None and old[2] == entry[2]:
+            address_space = self._address_spaces.get(old[2], None)
+        self._unindex_process(proc.obj_offset)
+        self._procs[proc.obj_offset] = entry
+        if address_space is not None:
+            self._address_spaces[entry[2]] = address_space
+        self._procs_by_pid[entry[1]] = proc.obj_offset
+        if entry[2]:
+            self._procs_by_dtb[entry[2]] = proc.obj_offset
+            self._unknown_dtbs.discard(entry[2])
+        for tid in entry[3]:
+            self._procs_by_tid[tid] = proc.obj_offset
+        return entry
+
+    def _unindex_process(self, offset):
+        entry = self._procs.pop(offset, None)
+        if entry is None:
+            return
+        if self._procs_by_pid.get(entry[1], None) == offset:
+            self._procs_by_pid.pop(entry[1])
+        if self._procs_by_dtb.get(entry[2], None) == offset:
+            self._procs_by_dtb.pop(entry[2])
+            self._address_spaces.pop(entry[2], None)
+        for tid in entry[3]:
+            if self._procs_by_tid.get(tid, None) == offset:
+                self._procs_by_tid.pop(tid)
+
+    def _scan_processes(self, pid=None, tid=None, dtb=None):
+        """Walk the process list and index all processes on the way.
+
+        The walk stops at the first process that matches the given pid, tid,
+        or dtb. If the whole list is walked, processes that are no longer
+        in the list are removed from the index and the index is complete.
+        """
+        seen = set()
+        for proc in self.pslist():
+            entry = self._index_process(proc)
+            seen.add(proc.obj_offset)
+            if ((pid is not None and pid == entry[1]) or
+                    (dtb is not None and dtb == entry[2]) or
+                    (tid is not None and tid in entry[3])):
+                return proc
+
+        for offset in list(self._procs.keys()):
+            if offset not in seen:
+                self._unindex_process(offset)
+        # DTBs of processes that were not in the list yet may be known now
+        self._unknown_dtbs.clear()
+        self._procs_complete = time.monotonic()
+        return None
+
+    def _ts_cb_func(self, event):
+        if api.arch == api.Arch.AARCH64:
+            dtb = event.new_val & 0xffffffffffff
+        else:
+            dtb = event.incoming_dtb
+
+        if dtb in self._procs_by_dtb or dtb in self._unknown_dtbs:
+            return
+        # A new process may have been started
+        self._procs_complete = None
+        if self._scan_processes(dtb=dtb) is None:
+            # Do not walk the process list again for this dtb
+            self._unknown_dtbs.add(dtb)
+
+    def process(self, pid=None, dtb=None, tid=None):
         """Get a process running in the guest.
 
         This function tries to retrieve a process running in the guest based
-        on its PID or DTB.
+        on its PID, DTB, or the ID of one of its threads. Processes are
+        looked up in an index that is filled while walking the process list
+        and whenever a task switch to an unknown DTB is observed. Indexed
+        processes are validated on every lookup, such that exited processes
+        are dropped from the index. If a lookup fails after a complete walk
+        of the process list, further lookups that are not in the index fail
+        without walking the list again until a task switch to an unknown DTB
+        is observed or the configured "process_index_ttl" expires.
 
         Parameters
         ----------
         pid : int, optional
-            The PID of the process to find. Either the PID or the DTB must be
-            specified.
+            The PID of the process to find. Either the PID, DTB, or TID must
+            be specified.
         dtb : int, optional
             The directory table base (DTB) of the process to fund. Either the
-            PID or the DTB must be specified.
+            PID, DTB, or TID must be specified.
+        tid : int, optional
+            The ID of a thread of the process to find. Either the PID, DTB, or
+            TID must be specified.
 
         Returns
         -------
@@ -205,18 +1057,30 @@ class OperatingSystemBase(plugins.Plugin):
         Raises
         ------
         ValueError
-            If neither PID nor DTB was specified.
+            If neither PID, DTB, nor TID was specified.
         """
-        if pid is None and dtb is None:
-            raise ValueError("you must specify a pid or dtb")
-
-        for proc in self.session.plugins.pslist().filter_processes():
-            if pid is not None and pid == proc.pid:
-                return proc
-            elif dtb is not None and dtb == proc.dtb:
+        if pid is not None:
+            offset = self._procs_by_pid.get(pid, None)
+        elif dtb is not None:
+            offset = self._procs_by_dtb.get(dtb, None)
+        elif tid is not None:
+            offset = self._procs_by_tid.get(tid, None)
+        else:
+            raise ValueError("you must specify a pid, dtb, or tid")
+
+        if offset is not None:
+            proc, proc_pid, proc_dtb, _ = self._procs[offset]
+            if self._process_valid(proc, proc_pid, proc_dtb):
                 return proc
+            # The process exited, its ID or DTB may have been reused
+            self._unindex_process(offset)
+            self._procs_complete = None
 
-        return None
+        if (self._procs_complete is not None and
+                time.monotonic() - self._procs_complete <
+                self._config_values["process_index_ttl"]):
+            return None
+        return self._scan_processes(pid=pid, tid=tid, dtb=dtb)
 
     def vtop(self, vaddr, pid=None, dtb=None, kernel_address_space=False):
         """Translate a guest virtual address to a guest physical address.
@@ -263,18 +1127,89 @@ class OperatingSystemBase(plugins.Plugin):
         ValueError
             If the provided PID or DTB does not belong to a running process.
         """
+        return self.address_space(pid=pid, dtb=dtb,
+                    kernel_address_space=kernel_address_space).vtop(vaddr)
 
-        if kernel_address_space:
-            return self.session.kernel_address_space.vtop(vaddr)
-        if pid is not None or dtb is not None:
-            proc = self.process(pid=pid, dtb=dtb)
+    def vtop_many(self, vaddrs, pid=None, dtb=None,
+                  kernel_address_space=False):
+        """Translate multiple guest virtual addresses at once.
+
+        The address space is only looked up once and every page is only
+        translated once. See :py:func:`vtop` for a description of the
+        parameters that select the address space.
+
+        Parameters
+        ----------
+        vaddrs : list of int or numpy.ndarray
+            The virtual addresses to translate.
+        pid : int, optional
+            The PID of the process to use as a basis for the translation.
+        dtb : int, optional
+            The dtb to use as a basis for the translation.
+        kernel_address_space : bool, optional
+            Whether to use the kernel address space as a basis for translation.
 
-            if proc is None:
-                raise ValueError("process not found")
+        Returns
+        -------
+        numpy.ndarray
+            The physical addresses as uint64 array. Addresses that cannot be
+            translated are set to :py:data:`INVALID_GPA`.
+
+        Raises
+        ------
+        ValueError
+            If the provided PID or DTB does not belong to a running process.
+        """
+        address_space = self.address_space(pid=pid, dtb=dtb,
+                                    kernel_address_space=kernel_address_space)
+        vaddrs = numpy.asarray(vaddrs, dtype=numpy.uint64)
+        shift = numpy.uint64(api.PAGE_SHIFT)
+        pages, inverse = numpy.unique(vaddrs >> shift, return_inverse=True)
+
+        ppages = numpy.empty(len(pages), dtype=numpy.uint64)
+        for i, page in enumerate(pages.tolist()):
+            paddr = address_space.vtop(page << api.PAGE_SHIFT)
+            ppages[i] = INVALID_GPA if paddr is None else paddr
+
+        rv = ppages[inverse]
+        valid = rv != numpy.uint64(INVALID_GPA)
+        rv[valid] |= vaddrs[valid] & numpy.uint64(api.PAGE_SIZE - 1)
+        return rv
 
-            return proc.get_process_address_space().vtop(vaddr)
+    def address_space(self, pid=None, dtb=None, kernel_address_space=False):
+        """Get the address space of a process.
 
-        return self.session.default_address_space.vtop(vaddr)
+        Address spaces of processes are cached per DTB until the process
+        exits. See :py:func:`vtop` for a description of the parameters.
+
+        Returns
+        -------
+        object
+            The Rekall address space.
+
+        Raises
+        ------
+        ValueError
+            If the provided PID or DTB does not belong to a running process.
+        """
+        if kernel_address_space:
+            return self.session.kernel_address_space
+        if pid is None and dtb is None:
+            return self.session.default_address_space
+
+        proc = self.process(pid=pid, dtb=dtb)
+        if proc is None:
+            raise ValueError("process not found")
+
+        # The process is indexed and validated by the lookup above
+        proc_dtb = self._procs[proc.obj_offset][2]
+        try:
+            return self._address_spaces[proc_dtb]
+        except KeyError:
+            rv = proc.get_process_address_space()
+            if proc_dtb:
+                self._address_spaces[proc_dtb] = rv
+            return rv
 
     def get_symbol_address(self, symbol):
         """Get the address of a symbol.
@@ -298,11 +1233,38 @@ class OperatingSystemBase(plugins.Plugin):
         SymbolResolutionError
             If the symbol cannot be found.
         """
+        if self.symbol_index is not None:
+            rv = self.symbol_index.address(symbol)
+            if rv is not None:
+                return rv
+        if self._kallsyms_index is not None:
+            raise SymbolResolutionError("Unknown symbol {}".format(symbol))
+
         rv = self.session.address_resolver.get_address_by_name(symbol)
         if rv == None:
             raise SymbolResolutionError(rv.reason)
         return rv
 
+    def get_symbol_addresses(self, symbols):
+        """Get the addresses of multiple symbols.
+
+        Parameters
+        ----------
+        symbols : iterable of str
+            The symbols to search for.
+
+        Returns
+        -------
+        list
+            The addresses of the symbols in the order of the given symbols.
+
+        Raises
+        ------
+        SymbolResolutionError
+            If any of the symbols cannot be found.
+        """
+        return [self.get_symbol_address(symbol) for symbol in symbols]
+
     def get_nearest_symbol_by_address(self, address):
         """Get symbols by address.
 
@@ -321,64 +1283,278 @@ class OperatingSystemBase(plugins.Plugin):
             The nearest symbols for the given address. If no symbol can be
             found an empty list will be returned.
         """
+        index = self.symbol_index
+        if index is not None and index.range[0] <= address <= index.range[1]:
+            rv = index.nearest(address)
+            if rv:
+                return rv
+        if self._kallsyms_index is not None:
+            return []
         return self.session.address_resolver.get_nearest_constant_by_address(
                                                                      address)[1]
 
+    def get_nearest_symbols_by_addresses(self, addresses):
+        """Get the nearest symbol for multiple addresses.
+
+        In contrast to :py:func:`get_nearest_symbol_by_address` this function
+        only returns a single symbol per address. Addresses within the range of
+        the symbol index are symbolized at once.
+
+        Parameters
+        ----------
+        addresses : list of int or numpy.ndarray
+            The addresses to use for the search.
+
+        Returns
+        -------
+        list
+            The name of the nearest symbol for each address. If no symbol can
+            be found for an address, its name is an empty string.
+        """
+        index = self.symbol_index
+        if index is None:
+            rv = list()
+            for address in addresses:
+                syms = self.get_nearest_symbol_by_address(int(address))
+                rv.append(syms[0] if syms else "")
+            return rv
+
+        names, _ = index.symbolize(addresses)
+        rv = names.tolist()
+        low, high = index.range
+        if self._kallsyms_index is not None:
+            return rv
+        for i, address in enumerate(addresses):
+            if not rv[i] or address > high:
+                syms = self.session.address_resolver.\
+                            get_nearest_constant_by_address(int(address))[1]
+                rv[i] = syms[0] if syms else ""
+        return rv
+
 class OperatingSystemWinX86_64(OperatingSystemBase):
-    """Base class for 64-bit Windows systems."""
+    """Base class for 64-bit Windows systems.
+
+    The current thread of a vCPU is found through its processor control region
+    (KPCR). In kernel mode, the GS base of the vCPU points to the KPCR, in
+    user mode the kernel GS base does. Since the KPCR of a vCPU does not move,
+    its address is only determined once.
+    """
     _abstract = False
     name = "OperatingSystem"
     arch = api.Arch.X86_64
     os = api.OsType.OS_WIN
 
-class OperatingSystemLinuxX86(OperatingSystemBase):
+    def __init__(self):
+        self._kpcrs = dict()
+        self._thread_layout = None
+        self._process_layout = None
+        self._current_thread_offset = None
+        super().__init__()
+
+    def _kpcr(self, cpu_num):
+        """Get the address of the KPCR of the vCPU."""
+        try:
+            return self._kpcrs[cpu_num]
+        except KeyError:
+            pass
+
+        cpu = self._vm.cpu(cpu_num)
+        kpcr = cpu.gs.base if cpu.is_supervisor else cpu.kernel_gs_base
+        # KPCR.Self points to the KPCR itself
+        profile = self.compact_profile or self.session.profile
+        self_offset = profile.get_obj_offset("_KPCR", "Self")
+        if self.read_kernel_pointer(kpcr + self_offset) != kpcr:
+            raise RuntimeError("Unable to find the KPCR of vCPU "
+                               "{}".format(cpu_num))
+        self._kpcrs[cpu_num] = kpcr
+        return kpcr
+
+    def _get_layouts(self):
+        if self._thread_layout is None:
+            profile = self.compact_profile or self.session.profile
+            ptr = self.pointer_width
+            try:
+                process = profile.get_obj_offset("_KTHREAD", "Process")
+            except KeyError:
+                process = None
+            if process is None:
+                process = (profile.get_obj_offset("_KTHREAD", "ApcState") +
+                           profile.get_obj_offset("_KAPC_STATE", "Process"))
+            self._thread_layout = self._layout({
+                "tid": (profile.get_obj_offset("_ETHREAD", "Cid") +
+                        profile.get_obj_offset("_CLIENT_ID", "UniqueThread"),
+                        ptr),
+                "process": (process, ptr),
+            })
+            self._process_layout = self._layout({
+                "pid": (profile.get_obj_offset("_EPROCESS", "UniqueProcessId"),
+                        ptr),
+                "comm": (profile.get_obj_offset("_EPROCESS", "ImageFileName"),
+                         15),
+                "dtb": (profile.get_obj_offset("_KPROCESS",
+                                               "DirectoryTableBase"), ptr),
+            })
+            self._current_thread_offset = (
+                    profile.get_obj_offset("_KPCR", "Prcb") +
+                    profile.get_obj_offset("_KPRCB", "CurrentThread"))
+        return self._thread_layout, self._process_layout
+
+    def _current_thread_address(self, cpu_num):
+        """Get the address of the ETHREAD running on the vCPU."""
+        self._get_layouts()
+        return self.read_kernel_pointer(self._kpcr(cpu_num) +
+                                        self._current_thread_offset)
+
+    def _current_process(self, cpu_num):
+        return self.session.profile._EPROCESS(
+                            self.current_task_info(cpu_num).mm)
+
+    def _current_task_info(self, cpu_num):
+        """Get information about the current thread.
+
+        The returned address is the address of the ETHREAD, the memory
+        descriptor is the address of the EPROCESS of the thread.
+        """
+        thread_layout, process_layout = self._get_layouts()
+        ptr_fmt = "<Q" if self.pointer_width == 8 else "<L"
+        kernel_as = self.session.kernel_address_space
+
+        address = self._current_thread_address(cpu_num)
+        start, size, offsets = thread_layout
+        data = kernel_as.read(address + start, size)
+        tid = struct.unpack_from(ptr_fmt, data, offsets["tid"])[0]
+        process = struct.unpack_from(ptr_fmt, data, offsets["process"])[0]
+
+        start, size, offsets = process_layout
+        data = kernel_as.read(process + start, size)
+        pid = struct.unpack_from(ptr_fmt, data, offsets["pid"])[0]
+        comm = data[offsets["comm"]:offsets["comm"] + 15]
+        comm = comm.split(b"\x00", 1)[0].decode("utf-8", "replace")
+        dtb = struct.unpack_from(ptr_fmt, data, offsets["dtb"])[0]
+        dtb &= ~(api.PAGE_SIZE - 1) & 0xffffffffffffffff
+
+        return TaskInfo(address, pid, tid, comm, process, dtb)
+
+class OperatingSystemLinuxBase(OperatingSystemBase):
     """Base class for Linux systems."""
-    _abstract = False
-    name = "OperatingSystem"
-    os = api.OsType.OS_LINUX
-    arch = api.Arch.X86_64
+    _abstract = True
 
     def __init__(self):
         self._per_cpu = None
-        self._per_cpu_current_task_offset = None
+        self._task_layout = None
         super().__init__()
 
     @property
     def per_cpu(self):
         """Get the location of the per_cpu offset."""
         if self._per_cpu is None:
-            base = self.session.address_resolver.get_address_by_name(
-                                                       "linux!__per_cpu_offset")
+            base = self.get_symbol_address("linux!__per_cpu_offset")
             self._per_cpu = list()
             for offset in range(0, (self._vm.cpu_count * self.pointer_width),
                                                             self.pointer_width):
                 self._per_cpu.append(self.read_kernel_pointer(base+offset))
         return self._per_cpu
 
-    def current_process(self, cpu_num):
-        """Retrieve the current process.
-
-        Retrieve the process that is currently running on the given vCPU.
+    def _process_tids(self, proc):
+        tids = [int(proc.pid)]
+        for thread in proc.thread_group.list_of_type("task_struct",
+                                                     "thread_group"):
+            tids.append(int(thread.pid))
+        return tids
+
+    def _process_valid(self, proc, pid, dtb):
+        return (proc.exit_state == 0 and
+                super()._process_valid(proc, pid, dtb))
+
+    def _warm_start_state(self):
+        # The per_cpu offsets differ between boots of the same kernel and are
+        # not cached.
+        return {"task_layout": self._get_task_layout()}
+
+    def _restore_warm_start_state(self, data):
+        start, size, offsets, pgd_offset = data["task_layout"]
+        self._task_layout = (start, size, offsets, pgd_offset)
+
+    def _build_symbol_index(self):
+        if self._kallsyms_index is not None:
+            return self._kallsyms_index
+        if self.compact_profile is not None:
+            return self.compact_profile.symbol_index(prefix="linux!",
+                                                     slide=self.kernel_slide)
+        names = list()
+        addresses = list()
+        slide = self.kernel_slide
+        for name, address in self.session.profile.constants.items():
+            names.append("linux!" + name)
+            addresses.append((address + slide) & 0xffffffffffffffff)
+        return symbols.SymbolIndex(names, addresses)
+
+    def _current_task_address(self, cpu_num):
+        """Get the address of the task_struct running on the vCPU."""
+        raise NotImplementedError()
+
+    def _current_process(self, cpu_num):
+        self._check_profile()
+        return self.session.profile.task_struct(
+                                        self._current_task_address(cpu_num))
+
+    def _get_task_layout(self):
+        if self._task_layout is None:
+            profile = self._get_profile()
+            fields = {
+                "pid": (profile.get_obj_offset("task_struct", "pid"), 4),
+                "tgid": (profile.get_obj_offset("task_struct", "tgid"), 4),
+                "comm": (profile.get_obj_offset("task_struct", "comm"), 16),
+                "mm": (profile.get_obj_offset("task_struct", "mm"),
+                       self.pointer_width),
+            }
+            start, size, offsets = self._layout(fields)
+            self._task_layout = (start, size, offsets,
+                                 profile.get_obj_offset("mm_struct", "pgd"))
+        return self._task_layout
+
+    def _current_task_info(self, cpu_num):
+        address = self._current_task_address(cpu_num)
+        start, size, offsets, pgd_offset = self._get_task_layout()
+
+        # Read all fields at once
+        data = self.session.kernel_address_space.read(address + start, size)
+        tid = struct.unpack_from("<i", data, offsets["pid"])[0]
+        pid = struct.unpack_from("<i", data, offsets["tgid"])[0]
+        comm = data[offsets["comm"]:offsets["comm"] + 16]
+        comm = comm.split(b"\x00", 1)[0].decode("utf-8", "replace")
+        ptr_fmt = "<Q" if self.pointer_width == 8 else "<L"
+        mm = struct.unpack_from(ptr_fmt, data, offsets["mm"])[0]
+
+        if mm:
+            pgd = self.read_kernel_pointer(mm + pgd_offset)
+            dtb = self.session.kernel_address_space.vtop(pgd)
+        else:
+            mm = None
+            dtb = None
+
+        return TaskInfo(address, pid, tid, comm, mm, dtb)
+
+class OperatingSystemLinuxX86(OperatingSystemLinuxBase):
+    """Base class for Linux systems."""
+    _abstract = False
+    name = "OperatingSystem"
+    os = api.OsType.OS_LINUX
+    arch = api.Arch.X86_64
 
-        Parameters
-        ----------
-        cpu_num : int
-            Try to retrieve the process that is currently running on the vCPU
-            with the number cpu_num.
+    def __init__(self):
+        self._per_cpu_current_task_offset = None
+        super().__init__()
 
-        Returns
-        -------
-        object
-            A representation of the process.
-        """
+    def _current_task_address(self, cpu_num):
         if self._per_cpu_current_task_offset is None:
+            profile = self._get_profile()
             self._per_cpu_current_task_offset = \
-                               self.session.profile.get_constant("current_task")
-        task_struct_address = self.read_kernel_pointer(
+                                            profile.get_constant("current_task")
+        return self.read_kernel_pointer(
                     (self.per_cpu[cpu_num] + self._per_cpu_current_task_offset))
-        return self.session.profile.task_struct(task_struct_address)
 
-class OperatingSystemLinuxAarch64(OperatingSystemBase):
+class OperatingSystemLinuxAarch64(OperatingSystemLinuxBase):
     """Base class for Linux systems."""
     _abstract = False
     name = "OperatingSystem"
@@ -386,41 +1562,12 @@ class OperatingSystemLinuxAarch64(OperatingSystemBase):
     arch = api.Arch.AARCH64
 
     def __init__(self):
-        self._per_cpu = None
         self._per_cpu_entry_task_offset = None
         super().__init__()
 
-    @property
-    def per_cpu(self):
-        """Get the location of the per_cpu offset."""
-        if self._per_cpu is None:
-            base = self.session.address_resolver.get_address_by_name(
-                                                       "linux!__per_cpu_offset")
-            self._per_cpu = list()
-            for offset in range(0, (self._vm.cpu_count * self.pointer_width),
-                                                            self.pointer_width):
-                self._per_cpu.append(self.read_kernel_pointer(base+offset))
-        return self._per_cpu
-
-    def current_process(self, cpu_num):
-        """Retrieve the current process.
-
-        Retrieve the process that is currently running on the given vCPU.
-
-        Parameters
-        ----------
-        cpu_num : int
-            Try to retrieve the process that is currently running on the vCPU
-            with the number cpu_num.
-
-        Returns
-        -------
-        object
-            A representation of the process.
-        """
+    def _current_task_address(self, cpu_num):
         if self._per_cpu_entry_task_offset is None:
             self._per_cpu_entry_task_offset = self.get_symbol_address(
                                                            "linux!__entry_task")
-        task_struct_address = self.read_kernel_pointer(
+        return self.read_kernel_pointer(
                     (self.per_cpu[cpu_num] + self._per_cpu_entry_task_offset))
-        return self.session.profile.task_struct(task_struct_address)
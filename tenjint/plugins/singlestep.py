@@ -27,65 +27,304 @@ from . import plugins
 from .. import api
 from .. import event
 
+class SingleStepCompleteEvent(event.CpuEvent):
+    """Emitted once a multi-instruction single step request is complete.
+
+    A request must specify the CPU to step and at least one stop condition.
+    Stepping stops as soon as any of the given conditions is met:
+
+    - "count": the number of instructions to step.
+    - "gva": stop before the instruction at this guest virtual address.
+    - "gpa": stop before the instruction at this guest physical address.
+    - "until_return": stop once the current function returns.  This must be
+      requested at the entry of the function, i.e., before the function
+      modified the stack pointer or the return address.
+
+    The event contains the number of executed steps and the instruction
+    pointer the CPU stopped at.  Callbacks are matched on the requested
+    parameters.
+    """
+    params = {
+        "cpu_num": None,
+        "count": None,
+        "gva": None,
+        "gpa": None,
+        "until_return": False,
+    }
+
+    def __init__(self, cpu_num, count, gva, gpa, until_return, steps, ip):
+        super().__init__(cpu_num)
+        self.count = count
+        self.gva = gva
+        self.gpa = gpa
+        self.until_return = until_return
+        self.steps = steps
+        self.ip = ip
+
+    def __str__(self):
+        return ("SingleStepCompleteEvent: cpu={} steps={} ip=0x{:x}".format(
+                                            self.cpu_num, self.steps, self.ip))
+
+    @classmethod
+    def filter(cls, cb_params, event):
+        if type(event) != cls:
+            return False
+
+        for name, def_value in cls.params.items():
+            if cb_params.get(name, def_value) != getattr(event, name):
+                return False
+        return True
+
+class _Stepper(object):
+    """The state of a single multi-instruction single step request."""
+    def __init__(self, cpu_num, count, gva, gpa, ret_addr, ret_sp):
+        self.cpu_num = cpu_num
+        self.count = count
+        self.gva = gva
+        self.gpa = gpa
+        self.ret_addr = ret_addr
+        self.ret_sp = ret_sp
+        self.steps = 0
+        self.done = False
+        self.translations = dict()
+
 class SingleStepPluginBase(plugins.EventPlugin):
-    """Base class for all singlestep plugins."""
+    """Base class for all singlestep plugins.
+
+    This plugin arbitrates between all clients that want to single step a CPU.
+    Concurrent requests for the same CPU are merged into a single hardware
+    single step and the resulting event is delivered to every requester.  The
+    single step method of a CPU is chosen by its first request and kept from
+    then on, the method of any subsequent request is only a hint.  The single
+    step feature stays enabled as long as there are requests for a CPU.
+    Disabling the feature is deferred until the VM is resumed, such that a
+    client that cancels and another client that requests a step while handling
+    the same event do not cause additional feature updates.
+
+    In addition, the plugin supports stepping multiple instructions with a
+    single request (see :py:class:`SingleStepCompleteEvent`).  Counting and
+    checking the stop conditions is done within the plugin and only a single
+    event is delivered once the request is complete.
+    """
 
     _abstract = True
-    produces = [api.SystemEventSingleStep]
+    produces = [api.SystemEventSingleStep, SingleStepCompleteEvent]
     name = "SingleStepPlugin"
 
     def __init__(self):
         super().__init__()
         self._request_id_cntr = 0
+        self._requests = dict()
+        self._steppers = dict()
+        self._step_hooks = [dict() for _ in range(self._vm.cpu_count)]
 
         self._ss = [None] * self._vm.cpu_count
+        self._ss_requests = [set() for _ in range(self._vm.cpu_count)]
+        self._ss_enabled = [False] * self._vm.cpu_count
         self._ss_inst_ptr = [None] * self._vm.cpu_count
+        self._ss_next_inst_ptr = [None] * self._vm.cpu_count
 
         self._cb_ss = event.EventCallback(self._cb_func_ss, "SystemEventSingleStep")
         self._event_manager.request_event(self._cb_ss, send_request=False)
+        self._event_manager.add_continue_hook(self._cont_hook)
 
     def uninit(self):
         super().uninit()
         self._event_manager.cancel_event(self._cb_ss)
         self._cb_ss = None
+        self._event_manager.remove_continue_hook(self._cont_hook)
+
+        for cpu_num in range(self._vm.cpu_count):
+            self._ss_requests[cpu_num].clear()
+            if self._ss_enabled[cpu_num]:
+                self._feature_update(False, self._ss[cpu_num], cpu_num)
+                self._ss_enabled[cpu_num] = False
+                self._ss[cpu_num] = None
+        self._requests = dict()
+        self._steppers = dict()
 
     def request_event(self, event_cls, **kwargs):
         """Request a singlestep event.
 
         This function is called by the EventManager when a singlestep event
-        is requested.
+        is requested.  If the CPU is already single stepping with a different
+        method, the existing method is used.
         """
+        if event_cls is SingleStepCompleteEvent:
+            return self._request_stepper(**kwargs)
+
         [cpu_num, method] = event_cls.parse_request(**kwargs)
+        return self._request_ss(cpu_num, method)
+
+    def _request_stepper(self, **kwargs):
+        [cpu_num, count, gva, gpa,
+         until_return] = SingleStepCompleteEvent.parse_request(**kwargs)
+
+        if cpu_num is None:
+            raise ValueError("multi-instruction stepping requires a cpu")
+        if count is None and gva is None and gpa is None and not until_return:
+            raise ValueError("no stop condition given")
+
+        ret_addr = None
+        ret_sp = None
+        if until_return:
+            fargs = self._service_manager.get("FunctionArguments")
+            ret_addr = fargs.get_return_address(cpu_num)
+            ret_sp = fargs.get_stack_pointer(cpu_num)
 
-        if method is None:
-            method = self._default_method
+        request_id = self._request_ss(cpu_num, None)
+        self._steppers[request_id] = _Stepper(cpu_num, count, gva, gpa,
+                                              ret_addr, ret_sp)
+        return request_id
 
-        if self._ss[cpu_num] is not None and self._ss[cpu_num] != method:
-            raise ValueError("attempting to SS same cpu with multiple methods")
+    def _request_ss(self, cpu_num, method):
+        if self._ss[cpu_num] is None:
+            self._ss[cpu_num] = (self._default_method if method is None
+                                 else method)
+        elif method is not None and method != self._ss[cpu_num]:
+            self._logger.debug("SS CPU{}: using {} instead of requested "
+                               "{}".format(cpu_num, self._ss[cpu_num], method))
 
         request_id = self._request_id_cntr
         self._request_id_cntr += 1
 
-        self._feature_update(True, method, cpu_num)
-
-        self._ss[cpu_num] = method
-        self._ss_inst_ptr[cpu_num] = self._vm.cpu(cpu_num).instruction_pointer
+        self._requests[request_id] = cpu_num
+        self._ss_requests[cpu_num].add(request_id)
+        if not self._ss_enabled[cpu_num]:
+            self._feature_update(True, self._ss[cpu_num], cpu_num)
+            self._ss_enabled[cpu_num] = True
+            self._ss_inst_ptr[cpu_num] = \
+                            self._vm.cpu(cpu_num).instruction_pointer
         return request_id
 
     def cancel_event(self, request_id):
         """Cancel a singlestep event request.
 
         This function is called by the EventManager when a singlestep event
-        request is canceled.
+        request is canceled.  The single step feature is disabled once the
+        last request of a CPU is canceled and the VM is resumed.
+        """
+        cpu_num = self._requests.pop(request_id)
+        self._ss_requests[cpu_num].discard(request_id)
+        self._steppers.pop(request_id, None)
+        self._step_hooks[cpu_num].pop(request_id, None)
+
+    def add_step_hook(self, cpu_num, hook):
+        """Single step a CPU and invoke a hook after every step.
+
+        Step hooks are meant for clients that need to be notified of every
+        single step, e.g., tracers.  They are invoked directly by this plugin
+        and do not require a callback to be dispatched by the event manager.
+        The CPU is single stepped until the hook is removed.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU to step.
+        hook : function
+            The function to invoke after every step. It is called with the
+            CPU number as its only argument.
+
+        Returns
+        -------
+        int
+            A handle that can be passed to :py:func:`remove_step_hook`.
+        """
+        request_id = self._request_ss(cpu_num, None)
+        self._step_hooks[cpu_num][request_id] = hook
+        return request_id
+
+    def remove_step_hook(self, handle):
+        """Remove a step hook.
+
+        Parameters
+        ----------
+        handle : int
+            The handle returned by :py:func:`add_step_hook`.
         """
-        return
+        self.cancel_event(handle)
+
+    def _cont_hook(self):
+        for cpu_num in range(self._vm.cpu_count):
+            if not self._ss_enabled[cpu_num]:
+                continue
+            if self._ss_requests[cpu_num]:
+                # The instruction pointer was recorded when the last step was
+                # handled, this avoids fetching the CPU state again.
+                if self._ss_next_inst_ptr[cpu_num] is not None:
+                    self._ss_inst_ptr[cpu_num] = \
+                                            self._ss_next_inst_ptr[cpu_num]
+                    self._ss_next_inst_ptr[cpu_num] = None
+            else:
+                self._feature_update(False, self._ss[cpu_num], cpu_num)
+                self._ss_enabled[cpu_num] = False
+                self._ss_next_inst_ptr[cpu_num] = None
+                # The next request may choose a different method
+                self._ss[cpu_num] = None
+
+    def _stepper_done(self, stepper, cpu):
+        ip = cpu.instruction_pointer
+
+        if stepper.count is not None and stepper.steps >= stepper.count:
+            return True
+        if stepper.gva is not None and ip == stepper.gva:
+            return True
+        if stepper.gpa is not None:
+            # Translations are cached per page to avoid a page table walk
+            # for every step.
+            dtb = cpu.page_table_base(ip)
+            vpage = ip & ~(api.PAGE_SIZE - 1)
+            ppage = stepper.translations.get((dtb, vpage), None)
+            if ppage is None:
+                ppage = self._vm.vtop(vpage, dtb=dtb)
+                if ppage is not None:
+                    stepper.translations[(dtb, vpage)] = ppage
+            if (ppage is not None and
+                    ppage | (ip & (api.PAGE_SIZE - 1)) == stepper.gpa):
+                return True
+        if stepper.ret_addr is not None and ip == stepper.ret_addr:
+            fargs = self._service_manager.get("FunctionArguments")
+            if fargs.get_stack_pointer(stepper.cpu_num) >= stepper.ret_sp:
+                return True
+        return False
+
+    def _step_steppers(self, cpu_num):
+        cpu = self._vm.cpu(cpu_num)
+        completed = set()
+        for request_id in list(self._ss_requests[cpu_num]):
+            stepper = self._steppers.get(request_id, None)
+            if stepper is None:
+                continue
+            stepper.steps += 1
+            if not self._stepper_done(stepper, cpu):
+                continue
+
+            # The request stays registered until it is canceled, but it no
+            # longer keeps the CPU stepping.
+            self._ss_requests[cpu_num].discard(request_id)
+            self._steppers.pop(request_id)
+            key = (stepper.count, stepper.gva, stepper.gpa,
+                   stepper.ret_addr is not None, stepper.steps)
+            if key in completed:
+                continue
+            completed.add(key)
+            self._event_manager.put_event(SingleStepCompleteEvent(cpu_num,
+                                                stepper.count, stepper.gva,
+                                                stepper.gpa, key[3],
+                                                stepper.steps,
+                                                cpu.instruction_pointer))
 
     def _cb_func_ss(self, event):
-        if self._ss[event.cpu_num] is None:
+        if not self._ss_enabled[event.cpu_num]:
             self._logger.warning("non-service SS recieved")
-        self._feature_update(False, self._ss[event.cpu_num], event.cpu_num)
-        self._logger.debug("SS CPU{} PC:{:x}".format(event.cpu_num,
-                               self._vm.cpu(event.cpu_num).instruction_pointer))
+        self._ss_next_inst_ptr[event.cpu_num] = \
+                                self._vm.cpu(event.cpu_num).instruction_pointer
+        hooks = self._step_hooks[event.cpu_num]
+        if hooks:
+            for hook in list(hooks.values()):
+                hook(event.cpu_num)
+        if self._steppers:
+            self._step_steppers(event.cpu_num)
 
     def last_ss_gva(self, cpu_num):
         return self._ss_inst_ptr[cpu_num]
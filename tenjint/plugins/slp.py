@@ -19,6 +19,8 @@
 
 """Provides second level paging permission trapping and updating."""
 
+import numpy
+
 from . import plugins
 from .. import api
 from .. import event
@@ -34,6 +36,10 @@ class SLPPlugin(plugins.EventPlugin):
     requests to update page permissions as well as requests for SLP permission
     violations.
 
+    Writes to a page can be tracked with :py:func:`track_writes`.  While a
+    page is tracked, write access is removed from the permissions that are
+    requested for it, without changing the permissions themselves.
+
     NOTE: This service does not concern itself with merging requests for
     callbacks as this is done in the kernel.
     """
@@ -52,6 +58,11 @@ class SLPPlugin(plugins.EventPlugin):
         self._perm_requests = dict()
         self._slp_events = list()
         self._rwx_perm_request = [None] * self._vm.cpu_count
+        # The permissions that were last requested for a page
+        self._page_perms = dict()
+        # The number of write tracking requests per gfn
+        self._write_tracked = numpy.zeros(0, dtype=numpy.uint16)
+        self._untracked = set()
         self._ss_cb = list()
         for i in range(self._vm.cpu_count):
             self._ss_cb.append(event.EventCallback(self._ss_cb_func,
@@ -140,10 +151,99 @@ class SLPPlugin(plugins.EventPlugin):
                                         req_perms[2] or prev_perms[2],
                                         False)
         else:
-            api.tenjint_api_slp_update(gpa, r=req_perms[0], w=req_perms[1], x=req_perms[2])
+            self._set_permissions(gfn, req_perms[0], req_perms[1], req_perms[2])
             self._logger.debug("SLP: update_permissions: update 0x{:x} r={} w={} x={}".format(gpa, req_perms[0], req_perms[1], req_perms[2]))
             self._perm_requests[gfn] = req_perms
 
+    def _set_permissions(self, gfn, r, w, x):
+        self._page_perms[gfn] = (r, w, x)
+        if w and self._is_write_tracked(gfn):
+            w = False
+        api.tenjint_api_slp_update(gfn << api.PAGE_SHIFT, r=r, w=w, x=x)
+
+    def _is_write_tracked(self, gfn):
+        return (gfn < len(self._write_tracked) and
+                self._write_tracked[gfn] > 0)
+
+    def _update_write_tracking(self, gfn, num_pages, track):
+        end = gfn + num_pages
+        if end > len(self._write_tracked):
+            counts = numpy.zeros(end, dtype=self._write_tracked.dtype)
+            counts[:len(self._write_tracked)] = self._write_tracked
+            self._write_tracked = counts
+
+        counts = self._write_tracked[gfn:end]
+        if track:
+            changed = (counts == 0)
+            counts += 1
+        else:
+            if not counts.all():
+                raise ValueError("Writes to 0x{:x} ({} pages) are not "
+                                 "tracked".format(gfn << api.PAGE_SHIFT,
+                                                  num_pages))
+            changed = (counts == 1)
+            counts -= 1
+
+        # Pages that have been restricted by others keep their permissions,
+        # all other pages are updated in contiguous runs.
+        restricted = [i for i in self._page_perms if gfn <= i < end and
+                      changed[i - gfn]]
+        runs = changed.copy()
+        runs[numpy.array(restricted, dtype=numpy.int64) - gfn] = False
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(
+                                        ([0], runs.view(numpy.int8), [0]))))
+        for start, stop in zip(edges[::2].tolist(), edges[1::2].tolist()):
+            api.tenjint_api_slp_update((gfn + start) << api.PAGE_SHIFT,
+                                       r=True, w=not track, x=True,
+                                       num_pages=stop - start)
+        for i in restricted:
+            self._set_permissions(i, *self._page_perms[i])
+            if not track:
+                self._untracked.add(i)
+        if not track:
+            self._untracked.update((numpy.flatnonzero(runs) + gfn).tolist())
+
+    def track_writes(self, gpa, num_pages=1):
+        """Track writes to pages.
+
+        Write access is removed from the pages until the tracking is stopped
+        with :py:func:`untrack_writes`.  All other permissions of the pages
+        remain unchanged.  Writes can be observed with a
+        :py:class:`api.SystemEventSLP` callback that traps writes.  Requests
+        are counted, a page is writable again once all requests are stopped.
+        Hence, every user must stop tracking a page when it is written to allow
+        the write to complete.
+
+        Parameters
+        ----------
+        gpa : int
+            The GPA of the first page.
+        num_pages : int, optional
+            The number of consecutive pages to track.
+        """
+        self._update_write_tracking(gpa >> api.PAGE_SHIFT, num_pages, True)
+        self._logger.debug("SLP: track_writes: 0x{:x} ({} pages)".format(
+                                                            gpa, num_pages))
+
+    def untrack_writes(self, gpa, num_pages=1):
+        """Stop tracking writes to pages.
+
+        Parameters
+        ----------
+        gpa : int
+            The GPA of the first page.
+        num_pages : int, optional
+            The number of consecutive pages.
+
+        Raises
+        ------
+        ValueError
+            If writes to one of the pages are not tracked.
+        """
+        self._update_write_tracking(gpa >> api.PAGE_SHIFT, num_pages, False)
+        self._logger.debug("SLP: untrack_writes: 0x{:x} ({} pages)".format(
+                                                            gpa, num_pages))
+
     def _slp_cb_func(self, event):
         self._slp_events.append(event)
 
@@ -171,7 +271,7 @@ class SLPPlugin(plugins.EventPlugin):
                     self._rwx_perm_request[event.cpu_num] = (gfn, (True, True, False))
                 self._perm_requests[gfn] = (True, True, True, False)
                 self._enable_single_step(event.cpu_num)
-            else:
+            elif gfn not in self._untracked:
                 if gfn not in self._perm_requests:
                     if event.r or event.w:
                         self._perm_requests[gfn] = (True, True, False, False)
@@ -183,7 +283,8 @@ class SLPPlugin(plugins.EventPlugin):
         for gfn, perms in self._perm_requests.items():
             if not perms[3]:
                 gpa = gfn << api.PAGE_SHIFT
-                api.tenjint_api_slp_update(gpa, r=perms[0], w=perms[1], x=perms[2])
+                self._set_permissions(gfn, perms[0], perms[1], perms[2])
                 self._logger.debug("SLP: cont_hook: update 0x{:x} r={} w={} x={}".format(gpa, perms[0], perms[1], perms[2]))
         self._slp_events.clear()
         self._perm_requests.clear()
+        self._untracked.clear()
@@ -0,0 +1,208 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Provides fast snapshots of the guest.
+
+This module provides a plugin that allows to reset the guest to a previously
+recorded state without reloading a QEMU snapshot. Only the state of the vCPUs
+and the pages that have been written since the snapshot was taken are
+restored, which makes resets cheap enough to be used in tight loops, e.g.,
+when fuzzing or repeating an experiment.
+"""
+
+import bisect
+
+from . import plugins
+from .. import api
+from .. import config
+from .. import event
+
+class SnapshotPlugin(plugins.Plugin, config.ConfigMixin):
+    """Snapshot Service
+
+    This plugin implements the snapshot service. When a snapshot is taken,
+    the state of all vCPUs is recorded and writes to all guest pages are
+    tracked (see :py:func:`tenjint.plugins.slp.SLPPlugin.track_writes`). The
+    first write to a page after the snapshot was taken is trapped with an SLP
+    violation and the original content of the page is saved. On reset, only
+    these pages and the vCPU states are restored.
+
+    The vCPU state is recorded with ``save_state`` (see
+    :py:mod:`tenjint.api.tenjintapi_x86_64` and
+    :py:mod:`tenjint.api.tenjintapi_aarch64`). This includes the general
+    purpose, control, segment, FP/SIMD, and debug registers as well as the
+    system call and exception related MSRs and system registers. The TSC,
+    the timers, the interrupt controllers, and pending interrupts are not
+    reset.
+
+    By default, the RAM is taken from the "ram_ranges" property of the VM,
+    which assumes the layout of the QEMU "pc" machine on x86-64 and of the
+    "virt" machine on aarch64. Other machine types, e.g., "q35", need the
+    "ram_ranges" option. If the first or last page of a range cannot be
+    read, the plugin fails to load.
+
+    NOTE: Writes that do not cause SLP violations (e.g. DMA of emulated
+    devices) are not tracked and will not be reverted.
+    """
+    _abstract = False
+    _config_options = [
+        {
+            "name": "ram_ranges", "default": None,
+            "help": "The guest physical RAM as a list of [start, size] "
+                    "pairs. Defaults to the layout of the QEMU 'pc' machine "
+                    "on x86-64 and of the 'virt' machine on aarch64."
+        },
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self._slp_service = self._service_manager.get("SLPPlugin")
+
+        ram_ranges = self._config_values["ram_ranges"]
+        if ram_ranges is None:
+            ram_ranges = self._vm.ram_ranges
+        # The RAM as (first gfn, end gfn)
+        self._ram = [(start >> api.PAGE_SHIFT, (start + size) >> api.PAGE_SHIFT)
+                     for start, size in ram_ranges]
+        self._check_ram()
+
+        self._cpu_states = None
+        self._pages = dict()
+        self._dirty = set()
+
+        self._slp_w_cb = event.EventCallback(self._slp_w_cb_func,
+                                             "SystemEventSLP",
+                                             {"global_req": True,
+                                              "trap_r": False, "trap_w": True,
+                                              "trap_x": False})
+
+    def uninit(self):
+        super().uninit()
+        self.discard()
+
+    def _check_ram(self):
+        """Make sure that the RAM ranges match the machine."""
+        for start, end in self._ram:
+            for gfn in (start, end - 1):
+                try:
+                    self._vm.phys_mem_read(gfn << api.PAGE_SHIFT, 1)
+                except RuntimeError:
+                    raise RuntimeError("Page 0x{:x} of the RAM cannot be "
+                                       "read, the machine type may need the "
+                                       "'ram_ranges' option".format(
+                                                gfn << api.PAGE_SHIFT))
+
+    @property
+    def active(self):
+        """Whether a snapshot has been taken."""
+        return self._cpu_states is not None
+
+    @property
+    def dirty_pages(self):
+        """The number of pages written since the last take or restore."""
+        return len(self._dirty)
+
+    def _is_ram(self, gfn):
+        for start, end in self._ram:
+            if start <= gfn < end:
+                return True
+        return False
+
+    def _clean_ranges(self):
+        """Get the RAM without the dirty pages as (gfn, number of pages)."""
+        dirty = sorted(self._dirty)
+        for start, end in self._ram:
+            i = bisect.bisect_left(dirty, start)
+            while i < len(dirty) and dirty[i] < end:
+                if dirty[i] > start:
+                    yield (start, dirty[i] - start)
+                start = dirty[i] + 1
+                i += 1
+            if end > start:
+                yield (start, end - start)
+
+    def take(self):
+        """Take a snapshot of the guest.
+
+        This function records the state of all vCPUs and starts to track
+        writes to guest memory. A previously taken snapshot is discarded.
+        """
+        if self.active:
+            self.discard()
+
+        self._cpu_states = [self._vm.cpu(i).save_state()
+                            for i in range(self._vm.cpu_count)]
+
+        self._event_manager.request_event(self._slp_w_cb)
+        for gfn, num_pages in self._clean_ranges():
+            self._slp_service.track_writes(gfn << api.PAGE_SHIFT,
+                                           num_pages=num_pages)
+        self._logger.debug("Snapshot taken")
+
+    def restore(self):
+        """Reset the guest to the last snapshot.
+
+        This function restores all pages that have been written since the
+        snapshot was taken (or last restored) as well as the state of all
+        vCPUs. The snapshot remains active and can be restored again.
+
+        Raises
+        ------
+        RuntimeError
+            If no snapshot has been taken.
+        """
+        if not self.active:
+            raise RuntimeError("No snapshot has been taken")
+
+        for gfn in self._dirty:
+            gpa = gfn << api.PAGE_SHIFT
+            self._vm.phys_mem_write(gpa, self._pages[gfn])
+            self._slp_service.track_writes(gpa)
+        self._logger.debug("Snapshot restored {} pages".format(
+                                                             len(self._dirty)))
+        self._dirty.clear()
+
+        for cpu_num, state in enumerate(self._cpu_states):
+            self._vm.cpu(cpu_num).restore_state(state)
+
+    def discard(self):
+        """Discard the current snapshot and stop tracking writes."""
+        if not self.active:
+            return
+
+        self._event_manager.cancel_event(self._slp_w_cb)
+        for gfn, num_pages in self._clean_ranges():
+            self._slp_service.untrack_writes(gfn << api.PAGE_SHIFT,
+                                             num_pages=num_pages)
+        self._cpu_states = None
+        self._pages.clear()
+        self._dirty.clear()
+
+    def _slp_w_cb_func(self, event):
+        gfn = event.gpa >> api.PAGE_SHIFT
+        if gfn in self._dirty or not self._is_ram(gfn):
+            return
+
+        # The write has not been performed yet, hence the page still contains
+        # the data at the time of the snapshot.
+        if gfn not in self._pages:
+            self._pages[gfn] = self._vm.phys_mem_read(gfn << api.PAGE_SHIFT,
+                                                      api.PAGE_SIZE)
+        self._dirty.add(gfn)
+        self._slp_service.untrack_writes(gfn << api.PAGE_SHIFT)
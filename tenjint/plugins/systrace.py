@@ -0,0 +1,307 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Provides tracing of system calls.
+
+This module provides a plugin that sets a single breakpoint on the system call
+entry of the kernel. The location of the system call number and the arguments
+at this breakpoint is described by a table per architecture and kernel entry
+convention. The names of the system calls are derived from the system call
+table of the guest.
+"""
+
+import operator
+import struct
+import time
+
+import numpy
+
+from . import plugins
+from .operatingsystem import SymbolResolutionError
+from .. import api
+from .. import config
+from .. import event
+from .. import ringbuffer
+
+NUM_ARGS = 6
+"""The number of arguments that are recorded per system call."""
+
+class SyscallTracerBase(plugins.Plugin, config.ConfigMixin):
+    """System call tracer.
+
+    On every hit of the entry breakpoint, the system call number is read
+    first and the number filter is applied. Only then the current task is
+    determined for the PID filter and the arguments are read. Records are
+    appended to a ring buffer, which is written to the output file in batches
+    whenever it is full and when the plugin is unloaded. Otherwise, the oldest
+    records are overwritten.
+    """
+    _abstract = True
+    name = "SyscallTracer"
+    _config_section = "SyscallTracer"
+    _config_options = [
+        {
+            "name": "syscalls", "default": [],
+            "help": "The names or numbers of the system calls to trace by "
+                    "default, e.g., ['openat', 59]. If empty, all system "
+                    "calls are traced."
+        },
+        {
+            "name": "pids", "default": [],
+            "help": "The PIDs to trace by default. If empty, all processes "
+                    "are traced."
+        },
+        {
+            "name": "buffer_size", "default": 1 << 20,
+            "help": "The number of system calls the trace buffer can hold."
+        },
+        {
+            "name": "output", "default": None,
+            "help": "Path of the file the trace is written to. If not set, "
+                    "the trace is only kept in memory."
+        },
+    ]
+
+    _entry_symbol = None
+    """The symbol of the system call entry."""
+
+    _handler_prefixes = ("__se_sys_", "sys_")
+    """The prefixes of the system call handlers in the system call table."""
+
+    _max_syscalls = 1024
+    """The maximum size of the system call table."""
+
+    def __init__(self):
+        super().__init__()
+        flush_func = None
+        if self._config_values["output"]:
+            flush_func = self._write
+        self._buffer = ringbuffer.RingBuffer([("cpu_num", "u2"),
+                                              ("pid", "i4"), ("tid", "i4"),
+                                              ("nr", "u4"), ("time", "u8"),
+                                              ("args", "u8", (NUM_ARGS,))],
+                                             self._config_values["buffer_size"],
+                                             flush_func=flush_func)
+        self._names = None
+        self._nrs = None
+        self._pids = None
+        self._cb = None
+        self._table = self._get_table()
+
+    def uninit(self):
+        super().uninit()
+        self.stop()
+        self.flush()
+
+    def _get_table(self):
+        """Get the table that describes the entry convention.
+
+        Returns
+        -------
+        tuple
+            Either ("regs", number register, getter of the argument registers)
+            if the values are in registers or ("pt_regs", register, size,
+            unpack function) if they are in a struct pt_regs that a register
+            points to. The unpack function returns the arguments first and the
+            number last.
+        """
+        raise NotImplementedError()
+
+    @property
+    def syscall_names(self):
+        """The names of the system calls, indexed by their number."""
+        if self._names is None:
+            self._names = self._load_names()
+        return self._names
+
+    def _load_names(self):
+        try:
+            table = self._os.get_symbol_address("linux!sys_call_table")
+        except SymbolResolutionError:
+            self._logger.warning("System call table not found")
+            return list()
+
+        aspace = self._os.address_space(kernel_address_space=True)
+        handlers = numpy.frombuffer(aspace.read(table, self._max_syscalls * 8),
+                                    dtype="<u8")
+        rv = list()
+        for name in self._os.get_nearest_symbols_by_addresses(handlers):
+            name = name.split("!")[-1]
+            for prefix in self._handler_prefixes:
+                if name.startswith(prefix):
+                    rv.append(name[len(prefix):])
+                    break
+            else:
+                # The end of the table
+                break
+        return rv
+
+    def _resolve_syscalls(self, syscalls):
+        nrs = set()
+        for syscall in syscalls:
+            if isinstance(syscall, int):
+                nrs.add(syscall)
+            elif syscall in self.syscall_names:
+                nrs.add(self.syscall_names.index(syscall))
+            else:
+                raise ValueError("Unknown system call {}".format(syscall))
+        return frozenset(nrs)
+
+    @property
+    def tracing(self):
+        """Whether the tracer is currently active."""
+        return self._cb is not None
+
+    def start(self, syscalls=None, pids=None):
+        """Start tracing system calls.
+
+        Parameters
+        ----------
+        syscalls : list, optional
+            The names or numbers of the system calls to trace. Defaults to the
+            configured system calls.
+        pids : list of int, optional
+            The PIDs to trace. Defaults to the configured PIDs.
+
+        Raises
+        ------
+        ValueError
+            If the name of a system call is unknown.
+        """
+        if syscalls is None:
+            syscalls = self._config_values["syscalls"]
+        if pids is None:
+            pids = self._config_values["pids"]
+        self._nrs = self._resolve_syscalls(syscalls) if syscalls else None
+        self._pids = frozenset(pids) if pids else None
+
+        if self._cb is None:
+            vaddr = self._os.get_symbol_address(self._entry_symbol)
+            paddr = self._os.vtop(vaddr, kernel_address_space=True)
+            if self._table[0] == "regs":
+                cb_func = self._syscall_regs_bp
+            else:
+                cb_func = self._syscall_pt_regs_bp
+            self._cb = event.EventCallback(cb_func,
+                                           event_name="SystemEventBreakpoint",
+                                           event_params={"gpa": paddr})
+            self._event_manager.request_event(self._cb)
+
+    def stop(self):
+        """Stop tracing system calls."""
+        if self._cb is not None:
+            self._event_manager.cancel_event(self._cb)
+            self._cb = None
+
+    def _record(self, cpu_num, nr, args):
+        task = self._os.current_task_info(cpu_num)
+        if self._pids is not None and task.pid not in self._pids:
+            return
+        self._buffer.append((cpu_num, task.pid, task.tid, nr & 0xffffffff,
+                             time.monotonic_ns(), args))
+
+    def _syscall_regs_bp(self, e):
+        _, nr_reg, arg_regs = self._table
+        cpu = self._vm.cpu(e.cpu_num)
+        nr = getattr(cpu, nr_reg)
+        if self._nrs is not None and nr not in self._nrs:
+            return
+        self._record(e.cpu_num, nr, arg_regs(cpu))
+
+    def _syscall_pt_regs_bp(self, e):
+        _, base_reg, size, unpack = self._table
+        cpu = self._vm.cpu(e.cpu_num)
+        values = unpack(self._vm.mem_read(getattr(cpu, base_reg), size,
+                                          cpu_num=e.cpu_num))
+        nr = values[-1]
+        if self._nrs is not None and nr not in self._nrs:
+            return
+        self._record(e.cpu_num, nr, values[:NUM_ARGS])
+
+    def records(self):
+        """Get the system calls that are currently in the trace buffer.
+
+        Returns
+        -------
+        numpy.ndarray
+            The records with the fields "cpu_num", "pid", "tid", "nr", "time",
+            and "args". The time is in nanoseconds on the host and "nr" is an
+            index into :py:attr:`syscall_names`.
+        """
+        return self._buffer.get()
+
+    def flush(self):
+        """Write the trace buffer to the output file, if one is configured."""
+        if self._config_values["output"] and len(self._buffer):
+            self._write(self._buffer)
+
+    def _write(self, buf):
+        with open(self._config_values["output"], "ab") as f:
+            buf.write(f)
+        if buf.dropped:
+            self._logger.warning("SyscallTracer: {} records "
+                                 "dropped".format(buf.dropped))
+
+class SyscallTracerLinuxX86(SyscallTracerBase):
+    """System call tracer for Linux on x86-64.
+
+    The breakpoint is set on entry_SYSCALL_64, where the registers still
+    contain the values of the user space. System calls of 32-bit processes
+    are not traced.
+    """
+    _abstract = False
+    arch = api.Arch.X86_64
+    os = api.OsType.OS_LINUX
+
+    _entry_symbol = "linux!entry_SYSCALL_64"
+    _handler_prefixes = ("__x64_sys_",) + SyscallTracerBase._handler_prefixes
+
+    def _get_table(self):
+        return ("regs", "rax",
+                operator.attrgetter("rdi", "rsi", "rdx", "r10", "r8", "r9"))
+
+class SyscallTracerLinuxAarch64(SyscallTracerBase):
+    """System call tracer for Linux on aarch64.
+
+    The breakpoint is set on el0_svc. Before Linux 5.8, el0_svc is part of the
+    assembly entry code and the registers still contain the values of the
+    user space. Since then, el0_svc is a C function whose first argument
+    points to the saved registers.
+    """
+    _abstract = False
+    arch = api.Arch.AARCH64
+    os = api.OsType.OS_LINUX
+
+    _entry_symbol = "linux!el0_svc"
+    _handler_prefixes = ("__arm64_sys_",) + SyscallTracerBase._handler_prefixes
+
+    def _get_table(self):
+        try:
+            self._os.get_symbol_address("linux!el0_sync_handler")
+        except SymbolResolutionError:
+            try:
+                self._os.get_symbol_address("linux!el0t_64_sync_handler")
+            except SymbolResolutionError:
+                return ("regs", "r8",
+                        operator.attrgetter("r0", "r1", "r2", "r3", "r4",
+                                            "r5"))
+
+        # struct pt_regs starts with x0 to x30, the number is in x8
+        unpack = struct.Struct("<9Q").unpack
+        return ("pt_regs", "r0", 9 * 8, unpack)
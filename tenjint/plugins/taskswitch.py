@@ -45,7 +45,7 @@ class TaskSwitchPluginBase(plugins.EventPlugin):
         super().uninit()
 
         while self._requests:
-            _, request = self.request.popitem()
+            _, request = self._requests.popitem()
             self._update_feature(request, enable=False)
 
     def _update_feature(self, request, enable=True):
@@ -106,49 +106,37 @@ class TaskSwitchPluginX86_64(TaskSwitchPluginBase):
     _abstract = False
     arch = api.Arch.X86_64
 
-    def _update_feature(self, request, enable=True):
-        # Check if this request is covered
-        found = None
-        incoming = False
-        outgoing = False
-
-        f = filter(lambda v: v["dtb"] == request["dtb"],
-                   self._requests.values())
-        for x in f:
-            if not found:
-                # At least
-                found = True
-
-            if (x["incoming"]):
-                incoming = True
-
-            if (x["outgoing"]):
-                outgoing = True
-
-            if (incoming and outgoing):
-                # Request covered
-                break
-
-        if not found and not enable:
-            api.tenjint_api_update_feature_taskswitch(False,
-                                                     request["dtb"],
-                                                     incoming,
-                                                     outgoing)
-        else:
-            if (not found or
-                (request["incoming"] and not incoming) or
-                (request["outgoing"] and not outgoing)):
-                if enable:
-                    if not incoming and enable:
-                        incoming = request["incoming"]
-                    if not outgoing and enable:
-                        outgoing = request["outgoing"]
+    def __init__(self):
+        super().__init__()
 
-                api.tenjint_api_update_feature_taskswitch(True,
-                                                         request["dtb"],
-                                                         incoming,
-                                                         outgoing)
+        # dtb -> [incoming count, outgoing count]
+        self._dtbs = dict()
 
+    def _update_feature(self, request, enable=True):
+        dtb = request["dtb"]
+        counts = self._dtbs.get(dtb, None)
+        if counts is None:
+            counts = [0, 0]
+            self._dtbs[dtb] = counts
+        old = (counts[0] > 0, counts[1] > 0)
+
+        delta = 1 if enable else -1
+        if request["incoming"]:
+            counts[0] += delta
+        if request["outgoing"]:
+            counts[1] += delta
+        new = (counts[0] > 0, counts[1] > 0)
+
+        if new == (False, False):
+            self._dtbs.pop(dtb)
+
+        # Only update the feature if the coverage of the dtb changed
+        if new == old:
+            return
+        if new == (False, False):
+            api.tenjint_api_update_feature_taskswitch(False, dtb, False, False)
+        else:
+            api.tenjint_api_update_feature_taskswitch(True, dtb, new[0], new[1])
 
 class TaskSwitchPluginAarch64(TaskSwitchPluginBase):
     """Task switching plugin for aarch64.
@@ -163,19 +151,23 @@ class TaskSwitchPluginAarch64(TaskSwitchPluginBase):
     _abstract = False
     arch = api.Arch.AARCH64
 
+    def __init__(self):
+        super().__init__()
+
+        # reg -> number of requests
+        self._regs = dict()
+
     def _update_feature(self, request, enable=True):
-        # Check if this request is covered
-        found = None
-
-        f = filter(lambda v: v["reg"] == request["reg"],
-                   self._requests.values())
-        for x in f:
-            if not found:
-                # At least
-                found = True
-                break
-
-        if not found and not enable:
-            api.tenjint_api_update_feature_taskswitch(False, request["reg"])
-        elif not found:
-            api.tenjint_api_update_feature_taskswitch(True, request["reg"])
+        reg = request["reg"]
+        count = self._regs.get(reg, 0)
+
+        if enable:
+            self._regs[reg] = count + 1
+            if count == 0:
+                api.tenjint_api_update_feature_taskswitch(True, reg)
+        else:
+            if count == 1:
+                self._regs.pop(reg)
+                api.tenjint_api_update_feature_taskswitch(False, reg)
+            else:
+                self._regs[reg] = count - 1
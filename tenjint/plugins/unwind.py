@@ -0,0 +1,446 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Provides stack unwinding.
+
+This module provides a service that captures the call stack of a vCPU, e.g.,
+at a breakpoint or an SLP event. The stack pages above the stack pointer are
+translated and read at once and frames are then walked within this buffer.
+The unwind information of every instruction pointer is cached, such that
+capturing the stack on every event stays cheap.
+
+On x86-64 frames are walked with the ORC tables of Linux kernels that provide
+them and with frame pointers otherwise. On aarch64 the frame records that are
+linked by x29 are walked. The result is an array of return addresses, which
+can be symbolized at once with :py:func:`UnwinderBase.symbolize`.
+"""
+
+import bisect
+import struct
+
+import numpy
+
+from . import plugins
+from .operatingsystem import SymbolResolutionError
+from .. import api
+from .. import config
+
+_U64 = struct.Struct("<Q")
+
+ORC_REG_UNDEFINED = 0
+ORC_REG_PREV_SP = 1
+ORC_REG_DX = 2
+ORC_REG_DI = 3
+ORC_REG_BP = 4
+ORC_REG_SP = 5
+ORC_REG_R10 = 6
+ORC_REG_R13 = 7
+ORC_REG_BP_INDIRECT = 8
+ORC_REG_SP_INDIRECT = 9
+
+ORC_TYPE_CALL = 0
+ORC_TYPE_REGS = 1
+ORC_TYPE_REGS_PARTIAL = 2
+
+_ORC_ENTRY = numpy.dtype([("sp_offset", "<i2"), ("bp_offset", "<i2"),
+                          ("flags", "<u2")])
+
+# Offsets within the x86-64 struct pt_regs
+_PT_REGS = {"r13": 16, "bp": 32, "r10": 56, "dx": 96, "di": 112, "ip": 128,
+            "sp": 152}
+
+class _Stack(object):
+    """Stack memory of a vCPU that is read in windows.
+
+    A window covers the pages above a stack pointer and is read with as few
+    physical reads as possible. Untranslatable pages end a window.
+    """
+    def __init__(self, vm, cpu_num, size):
+        super().__init__()
+        self._vm = vm
+        self._cpu_num = cpu_num
+        self._size = size
+        self._windows = list()
+
+    def map(self, sp):
+        """Read the window above sp unless it was read already."""
+        for start, end, _ in self._windows:
+            if start <= sp < end:
+                return
+
+        start = sp & ~(api.PAGE_SIZE - 1)
+        end = min(start + self._size, 1 << 64)
+        runs = list()
+        for addr in range(start, end, api.PAGE_SIZE):
+            try:
+                gpa = self._vm.vtop(addr, cpu_num=self._cpu_num)
+            except api.TranslationError:
+                break
+            if runs and runs[-1][0] + runs[-1][1] == gpa:
+                runs[-1][1] += api.PAGE_SIZE
+            else:
+                runs.append([gpa, api.PAGE_SIZE])
+
+        chunks = list()
+        for gpa, length in runs:
+            try:
+                chunks.append(api.tenjint_api_read_phys_mem(gpa, length))
+            except RuntimeError:
+                break
+        buf = b"".join(chunks)
+        self._windows.append((start, start + len(buf), buf))
+
+    def read(self, addr):
+        """Read a 64-bit value or return None if it was not read."""
+        for start, end, buf in self._windows:
+            if start <= addr and addr + 8 <= end:
+                return _U64.unpack_from(buf, addr - start)[0]
+        return None
+
+class UnwinderBase(plugins.Plugin, config.ConfigMixin):
+    """Stack unwinder service.
+
+    The unwinder captures the call stack of a vCPU as an array of addresses.
+    The first address is the instruction pointer, the following addresses are
+    the return addresses of the callers, innermost first. Unwinding stops at
+    the first frame that cannot be read or that does not make progress.
+    """
+    _abstract = True
+    name = "Unwinder"
+    _config_section = "Unwinder"
+    _config_options = [
+        {
+            "name": "max_frames", "default": 64,
+            "help": "The maximum number of frames to capture."
+        },
+        {
+            "name": "stack_size", "default": 16 << 10,
+            "help": "The number of bytes above the stack pointer that are "
+                    "read at once."
+        },
+        {
+            "name": "orc", "default": True,
+            "help": "Use the ORC tables of Linux kernels on x86-64 if they "
+                    "are available."
+        },
+        {
+            "name": "cache_size", "default": 1 << 16,
+            "help": "The maximum number of instruction pointers whose unwind "
+                    "information is cached."
+        },
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self._frame_infos = dict()
+
+    def uninit(self):
+        super().uninit()
+        self._frame_infos.clear()
+
+    def _lookup_frame_info(self, addr):
+        raise NotImplementedError()
+
+    def _frame_info(self, addr):
+        """Get the cached unwind information of an instruction pointer.
+
+        Return addresses are looked up with addr - 1, such that calls at the
+        very end of a function are attributed to this function.
+        """
+        try:
+            return self._frame_infos[addr]
+        except KeyError:
+            if len(self._frame_infos) >= self._config_values["cache_size"]:
+                self._frame_infos.clear()
+            rv = self._lookup_frame_info(addr)
+            self._frame_infos[addr] = rv
+            return rv
+
+    def _function_offset(self, addr):
+        """Get the offset of addr within its function or None."""
+        index = self._os.symbol_index
+        if index is None:
+            return None
+        names, offsets = index.symbolize([addr])
+        if not names[0]:
+            return None
+        return int(offsets[0])
+
+    def _unwind(self, cpu_num, max_frames):
+        raise NotImplementedError()
+
+    def unwind(self, cpu_num, max_frames=None):
+        """Capture the call stack of a vCPU.
+
+        Parameters
+        ----------
+        cpu_num : int
+            The number of the vCPU.
+        max_frames : int, optional
+            The maximum number of frames. Defaults to the configured value.
+
+        Returns
+        -------
+        numpy.ndarray
+            The instruction pointer followed by the return addresses as
+            uint64 array.
+        """
+        if max_frames is None:
+            max_frames = self._config_values["max_frames"]
+        return numpy.array(self._unwind(cpu_num, max_frames),
+                           dtype=numpy.uint64)
+
+    def symbolize(self, frames):
+        """Symbolize the frames of a call stack at once.
+
+        Parameters
+        ----------
+        frames : numpy.ndarray
+            A call stack as returned by :py:func:`unwind`.
+
+        Returns
+        -------
+        list
+            The name of the function of each frame or an empty string if it
+            is unknown.
+        """
+        frames = numpy.array(frames, dtype=numpy.uint64)
+        # Return addresses may point to the function after the call
+        frames[1:] -= numpy.uint64(1)
+        return self._os.get_nearest_symbols_by_addresses(frames)
+
+class UnwinderX86_64(UnwinderBase):
+    """Stack unwinder for x86-64.
+
+    Kernel addresses that are covered by the ORC tables of a Linux kernel are
+    unwound with ORC. ORC entries are expected in the format of kernels before
+    6.3. Other addresses are unwound with frame pointers, which requires the
+    guest code to be compiled with frame pointers. In this case, the unwind
+    information is derived from the offset of the instruction pointer within
+    its function to handle the prologue.
+    """
+    _abstract = False
+    arch = api.Arch.X86_64
+
+    # Frame pointer unwinding expressed as ORC entries:
+    # (sp_reg, sp_offset, bp_reg, bp_offset, type, end)
+    _fp_entry = (ORC_REG_SP, 8, ORC_REG_UNDEFINED, 0, ORC_TYPE_CALL, 0)
+    _fp_pushed = (ORC_REG_SP, 16, ORC_REG_UNDEFINED, 0, ORC_TYPE_CALL, 0)
+    _fp_frame = (ORC_REG_BP, 16, ORC_REG_PREV_SP, -16, ORC_TYPE_CALL, 0)
+
+    def __init__(self):
+        super().__init__()
+        self._orc_ips = None
+        self._orc_entries = None
+        self._orc_end = None
+        if api.os == api.OsType.OS_LINUX and self._config_values["orc"]:
+            self._load_orc()
+
+    def _load_orc(self):
+        try:
+            start, stop, entries = self._os.get_symbol_addresses(
+                                            ["linux!__start_orc_unwind_ip",
+                                             "linux!__stop_orc_unwind_ip",
+                                             "linux!__start_orc_unwind"])
+        except SymbolResolutionError:
+            self._logger.debug("No ORC tables found, using frame pointers")
+            return
+
+        count = (stop - start) // 4
+        if count <= 0:
+            return
+        aspace = self._os.address_space(kernel_address_space=True)
+        rel = numpy.frombuffer(aspace.read(start, count * 4), dtype="<i4")
+        # Every IP is stored relative to its own entry
+        ips = (numpy.uint64(start) +
+               numpy.arange(count, dtype=numpy.uint64) * numpy.uint64(4) +
+               rel.astype(numpy.int64).astype(numpy.uint64))
+        if not numpy.all(ips[1:] >= ips[:-1]):
+            self._logger.warning("ORC tables are invalid, using frame "
+                                 "pointers")
+            return
+        raw = numpy.frombuffer(aspace.read(entries,
+                                           count * _ORC_ENTRY.itemsize),
+                               dtype=_ORC_ENTRY)
+
+        self._orc_ips = ips.tolist()
+        self._orc_entries = raw.tolist()
+        try:
+            self._orc_end = self._os.get_symbol_address("linux!_etext")
+        except SymbolResolutionError:
+            self._orc_end = self._orc_ips[-1] + 1
+        self._logger.debug("Loaded {} ORC entries".format(count))
+
+    def _lookup_frame_info(self, addr):
+        if (self._orc_ips is not None and
+                self._orc_ips[0] <= addr < self._orc_end):
+            idx = bisect.bisect_right(self._orc_ips, addr) - 1
+            sp_offset, bp_offset, flags = self._orc_entries[idx]
+            return (flags & 0xf, sp_offset, (flags >> 4) & 0xf, bp_offset,
+                    (flags >> 8) & 0x3, (flags >> 10) & 0x1)
+
+        offset = self._function_offset(addr)
+        if offset == 0:
+            return self._fp_entry
+        if offset is not None and offset < 4:
+            # After "push %rbp", before "mov %rsp, %rbp"
+            return self._fp_pushed
+        return self._fp_frame
+
+    @staticmethod
+    def _pt_regs(stack, addr):
+        regs = dict()
+        for name, offset in _PT_REGS.items():
+            regs[name] = stack.read(addr + offset)
+            if regs[name] is None:
+                return None
+        return regs
+
+    def _unwind(self, cpu_num, max_frames):
+        cpu = self._vm.cpu(cpu_num)
+        ip = cpu.rip
+        sp = cpu.rsp
+        bp = cpu.rbp
+        regs = {ORC_REG_DX: cpu.rdx, ORC_REG_DI: cpu.rdi,
+                ORC_REG_R10: cpu.r10, ORC_REG_R13: cpu.r13}
+
+        stack = _Stack(self._vm, cpu_num, self._config_values["stack_size"])
+        stack.map(sp)
+
+        frames = [ip]
+        lookup = ip
+        while len(frames) < max_frames:
+            sp_reg, sp_offset, bp_reg, bp_offset, frame_type, end = \
+                                                    self._frame_info(lookup)
+            if end or sp_reg == ORC_REG_UNDEFINED:
+                break
+
+            # Compute the stack pointer of the caller (CFA)
+            if sp_reg == ORC_REG_SP:
+                cfa = sp + sp_offset
+            elif sp_reg == ORC_REG_BP:
+                cfa = bp + sp_offset
+            elif sp_reg == ORC_REG_SP_INDIRECT:
+                cfa = stack.read(sp)
+                cfa = None if cfa is None else cfa + sp_offset
+            elif sp_reg == ORC_REG_BP_INDIRECT:
+                cfa = stack.read(bp + sp_offset)
+            elif sp_reg in regs:
+                cfa = regs[sp_reg] + sp_offset
+            else:
+                break
+            if cfa is None:
+                break
+            cfa &= 0xffffffffffffffff
+
+            if frame_type == ORC_TYPE_CALL:
+                if cfa <= sp:
+                    break
+                ret = stack.read(cfa - 8)
+                new_sp = cfa
+                new_bp = bp
+                regs = dict()
+                new_lookup = None if ret is None else ret - 1
+            elif frame_type == ORC_TYPE_REGS:
+                pt_regs = self._pt_regs(stack, cfa)
+                if pt_regs is None:
+                    break
+                ret = pt_regs["ip"]
+                new_sp = pt_regs["sp"]
+                new_bp = pt_regs["bp"]
+                regs = {ORC_REG_DX: pt_regs["dx"], ORC_REG_DI: pt_regs["di"],
+                        ORC_REG_R10: pt_regs["r10"],
+                        ORC_REG_R13: pt_regs["r13"]}
+                new_lookup = ret
+            else:
+                # Only the IRET frame is saved
+                ret = stack.read(cfa)
+                new_sp = stack.read(cfa + 24)
+                new_bp = bp
+                regs = dict()
+                new_lookup = ret
+            if not ret or new_sp is None:
+                break
+
+            if bp_reg == ORC_REG_PREV_SP:
+                new_bp = stack.read(cfa + bp_offset)
+            elif bp_reg == ORC_REG_BP:
+                new_bp = stack.read(bp + bp_offset)
+            if new_bp is None:
+                break
+
+            frames.append(ret)
+            if frame_type != ORC_TYPE_CALL:
+                if not ret >> 63:
+                    # The exception was raised in user space
+                    break
+                # Exceptions may switch stacks
+                stack.map(new_sp)
+            sp, bp, lookup = new_sp, new_bp, new_lookup
+
+        return frames
+
+class UnwinderAarch64(UnwinderBase):
+    """Stack unwinder for aarch64.
+
+    The unwinder walks the frame records that are linked by x29, which
+    requires the guest code to be compiled with frame pointers. If the vCPU
+    stopped at the first instruction of a function, the frame record has not
+    been pushed yet and the return address is taken from x30. Pointer
+    authentication codes are stripped assuming 48-bit virtual addresses.
+    """
+    _abstract = False
+    arch = api.Arch.AARCH64
+
+    def _lookup_frame_info(self, addr):
+        # Whether the function did not push its frame record yet
+        return self._function_offset(addr) == 0
+
+    @staticmethod
+    def _strip_pac(addr):
+        if addr & (1 << 55):
+            return addr | 0xffff000000000000
+        return addr & 0x0000ffffffffffff
+
+    def _unwind(self, cpu_num, max_frames):
+        cpu = self._vm.cpu(cpu_num)
+        if cpu.el == 0:
+            sp = cpu.sp_el0
+        else:
+            sp = cpu.sp_el1
+        fp = cpu.r29
+
+        stack = _Stack(self._vm, cpu_num, self._config_values["stack_size"])
+        stack.map(sp)
+
+        frames = [cpu.pc]
+        if len(frames) < max_frames and self._frame_info(cpu.pc):
+            frames.append(self._strip_pac(cpu.r30))
+
+        while len(frames) < max_frames and fp:
+            prev = stack.read(fp)
+            ret = stack.read(fp + 8)
+            if prev is None or not ret:
+                break
+            frames.append(self._strip_pac(ret))
+            if prev <= fp:
+                break
+            fp = prev
+
+        return frames
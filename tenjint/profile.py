@@ -0,0 +1,265 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Jonas Pfoh <jonas@bedrocksystems.com>
+#          Sebastian Vogl <sebastian@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compact binary profiles.
+
+Parsing a Rekall JSON profile takes a considerable amount of time. This module
+converts the parts of a profile that are needed on the fast path, i.e., the
+metadata, the constants, the sizes of all structs, and the offsets of all
+fields, into a compact binary file. The file is mapped into memory when it is
+loaded, such that no parsing is required.
+
+The file format consists of a header followed by the arrays::
+
+    magic (4 bytes) | header length (uint32) | header (JSON) | arrays...
+
+The header contains the metadata of the profile and the dtype, shape, and
+offset of every array. Each array is sorted by name, such that lookups are
+binary searches. A compact profile is built with :py:func:`build` or from the
+command line::
+
+    $ python3 -m tenjint.profile profile.json profile.tjp
+"""
+
+import gzip
+import hashlib
+import json
+import struct
+
+import numpy
+
+from . import symbols
+
+MAGIC = b"TJPF"
+"""The magic value at the beginning of every compact profile."""
+
+VERSION = 1
+"""The version of the file format."""
+
+ALIGNMENT = 64
+"""The alignment of the arrays within the file."""
+
+def _sorted_array(keys, values, dtype):
+    keys = numpy.array([k.encode() for k in keys], dtype=bytes)
+    values = numpy.asarray(values, dtype=dtype)
+    order = numpy.argsort(keys, kind="stable")
+    return keys[order], values[order]
+
+def build(json_path, out_path):
+    """Convert a Rekall JSON profile into a compact profile.
+
+    Parameters
+    ----------
+    json_path : str
+        The path of the Rekall profile. The profile may be gzip compressed.
+    out_path : str
+        The path of the compact profile that is created.
+    """
+    with open(json_path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    data = json.loads(raw.decode())
+
+    constants = dict()
+    for name, value in data.get("$CONSTANTS", dict()).items():
+        if isinstance(value, int):
+            constants[name] = value & 0xffffffffffffffff
+
+    struct_sizes = dict()
+    field_offsets = dict()
+    for name, (size, fields) in data.get("$STRUCTS", dict()).items():
+        struct_sizes[name] = size if isinstance(size, int) else -1
+        for field, definition in fields.items():
+            if definition and isinstance(definition[0], int):
+                field_offsets["{}.{}".format(name, field)] = definition[0]
+
+    arrays = dict()
+    arrays["constant_names"], arrays["constant_addresses"] = _sorted_array(
+                constants.keys(), list(constants.values()), numpy.uint64)
+    arrays["struct_names"], arrays["struct_sizes"] = _sorted_array(
+                struct_sizes.keys(), list(struct_sizes.values()), numpy.int64)
+    arrays["field_names"], arrays["field_offsets"] = _sorted_array(
+                field_offsets.keys(), list(field_offsets.values()), numpy.int64)
+
+    header = {
+        "version": VERSION,
+        "hash": digest,
+        "metadata": data.get("$METADATA", dict()),
+        "arrays": dict(),
+    }
+
+    # The header length depends on the offsets, so reserve enough space for
+    # the offsets first and pad the header afterwards.
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype": array.dtype.str,
+                                  "shape": list(array.shape),
+                                  "offset": 0xffffffffffff}
+    header_len = len(json.dumps(header).encode())
+    offset = len(MAGIC) + 4 + header_len
+    for name, array in arrays.items():
+        offset = (offset + ALIGNMENT - 1) & ~(ALIGNMENT - 1)
+        header["arrays"][name]["offset"] = offset
+        offset += array.nbytes
+    encoded = json.dumps(header).encode().ljust(header_len)
+
+    with open(out_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(encoded)))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(array.tobytes())
+
+class CompactProfile(object):
+    """A profile that was built with :py:func:`build`.
+
+    The arrays of the profile are memory mapped, so loading a profile is
+    cheap and only the pages that are used by lookups are read.
+    """
+    def __init__(self, path):
+        """Load a compact profile.
+
+        Parameters
+        ----------
+        path : str
+            The path of the compact profile.
+
+        Raises
+        ------
+        ValueError
+            If the file is not a compact profile or has an unsupported
+            version.
+        """
+        super().__init__()
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a compact profile".format(path))
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length).decode())
+        if header.get("version", None) != VERSION:
+            raise ValueError("{} has unsupported version {}".format(
+                                            path, header.get("version", None)))
+
+        self.path = path
+        self.hash = header["hash"]
+        self._metadata = header["metadata"]
+        self._arrays = dict()
+        for name, desc in header["arrays"].items():
+            shape = tuple(desc["shape"])
+            dtype = numpy.dtype(desc["dtype"])
+            if not shape[0] or not dtype.itemsize:
+                self._arrays[name] = numpy.empty(shape, dtype=dtype)
+            else:
+                self._arrays[name] = numpy.memmap(path, dtype=dtype, mode="r",
+                                                  offset=desc["offset"],
+                                                  shape=shape)
+
+    def _lookup(self, prefix, key):
+        names = self._arrays[prefix + "_names"]
+        key = key.encode()
+        idx = int(numpy.searchsorted(names, key))
+        if idx < len(names) and names[idx] == key:
+            return idx
+        return None
+
+    def metadata(self, name, default=None):
+        """Get a metadata value of the profile, e.g., "arch"."""
+        return self._metadata.get(name, default)
+
+    def get_constant(self, name):
+        """Get the address of a constant.
+
+        Parameters
+        ----------
+        name : str
+            The name of the constant without a module prefix.
+
+        Returns
+        -------
+        int or None
+            The address of the constant or None if it is unknown.
+        """
+        idx = self._lookup("constant", name)
+        if idx is None:
+            return None
+        return int(self._arrays["constant_addresses"][idx])
+
+    def struct_size(self, name):
+        """Get the size of a struct or None if the struct is unknown."""
+        idx = self._lookup("struct", name)
+        if idx is None:
+            return None
+        size = int(self._arrays["struct_sizes"][idx])
+        return size if size >= 0 else None
+
+    def get_obj_offset(self, name, field):
+        """Get the offset of a field within a struct.
+
+        Parameters
+        ----------
+        name : str
+            The name of the struct.
+        field : str
+            The name of the field.
+
+        Returns
+        -------
+        int or None
+            The offset of the field or None if it is unknown.
+        """
+        idx = self._lookup("field", "{}.{}".format(name, field))
+        if idx is None:
+            return None
+        return int(self._arrays["field_offsets"][idx])
+
+    def symbol_index(self, prefix="", slide=0):
+        """Create a symbol index from the constants of the profile.
+
+        Parameters
+        ----------
+        prefix : str, optional
+            A prefix that is prepended to every name, e.g., "linux!".
+        slide : int, optional
+            A value that is added to every address, e.g., a KASLR slide.
+
+        Returns
+        -------
+        tenjint.symbols.SymbolIndex
+            The symbol index.
+        """
+        names = numpy.char.decode(self._arrays["constant_names"])
+        if prefix:
+            names = numpy.char.add(prefix, names)
+        addresses = self._arrays["constant_addresses"]
+        if slide:
+            addresses = addresses + numpy.uint64(slide)
+        return symbols.SymbolIndex(names, addresses)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                    description="Convert a Rekall profile into a compact "
+                                "profile.")
+    parser.add_argument("profile", help="the Rekall JSON profile")
+    parser.add_argument("output", help="the compact profile to create")
+    args = parser.parse_args()
+    build(args.profile, args.output)
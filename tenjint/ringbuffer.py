@@ -0,0 +1,188 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Sebastian Vogl <sebastian@bedrocksystems.com>
+#          Jonas Pfoh <jonas@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Preallocated ring buffers for high-frequency records.
+
+This module provides a ring buffer that stores fixed-size records in a
+preallocated numpy array. It is meant for plugins that record data on every
+single step or breakpoint, where creating a Python object per record would be
+too expensive. The content of a ring buffer can be flushed to a file in a
+compact binary format, which can be read back with :py:func:`load`.
+
+The file format consists of a header followed by the raw records::
+
+    magic (4 bytes) | header length (uint32) | header (JSON) | records...
+
+The header contains the numpy dtype of the records.
+"""
+
+import json
+import struct
+
+import numpy
+
+MAGIC = b"TJRB"
+"""The magic value at the beginning of every ring buffer file."""
+
+class RingBuffer(object):
+    """A preallocated ring buffer of fixed-size records.
+
+    Records are appended to the buffer until it is full. If a flush function
+    is given, it is invoked once the buffer is full and the buffer is cleared
+    afterwards. Otherwise, the oldest records are overwritten and counted as
+    dropped.
+    """
+    def __init__(self, dtype, size, flush_func=None):
+        """Create a new ring buffer.
+
+        Parameters
+        ----------
+        dtype : numpy.dtype or list
+            The dtype of a single record.
+        size : int
+            The number of records the buffer can hold.
+        flush_func : function, optional
+            A function that is called with the buffer as argument when the
+            buffer is full.
+        """
+        super().__init__()
+        self._data = numpy.zeros(size, dtype=dtype)
+        self._size = size
+        self._head = 0
+        self._count = 0
+        self._flush_func = flush_func
+        self.dropped = 0
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    def __len__(self):
+        return self._count
+
+    def append(self, record):
+        """Append a record to the buffer.
+
+        Parameters
+        ----------
+        record : tuple
+            The record with one value per field of the dtype.
+        """
+        if self._count == self._size:
+            if self._flush_func is not None:
+                self._flush_func(self)
+                self.clear()
+            else:
+                self.dropped += 1
+                self._count -= 1
+
+        self._data[self._head] = record
+        self._head = (self._head + 1) % self._size
+        self._count += 1
+
+    def extend(self, records):
+        """Append multiple records to the buffer.
+
+        Parameters
+        ----------
+        records : numpy.ndarray
+            The records to append, must have the dtype of the buffer.
+        """
+        for i in range(0, len(records), self._size):
+            chunk = records[i:i + self._size]
+            if self._count + len(chunk) > self._size:
+                if self._flush_func is not None:
+                    self._flush_func(self)
+                    self.clear()
+                else:
+                    overflow = self._count + len(chunk) - self._size
+                    self.dropped += overflow
+                    self._count -= overflow
+
+            end = self._head + len(chunk)
+            if end <= self._size:
+                self._data[self._head:end] = chunk
+            else:
+                split = self._size - self._head
+                self._data[self._head:] = chunk[:split]
+                self._data[:end - self._size] = chunk[split:]
+            self._head = end % self._size
+            self._count += len(chunk)
+
+    def get(self):
+        """Get the records in the order they were appended.
+
+        Returns
+        -------
+        numpy.ndarray
+            A copy of all records in the buffer.
+        """
+        start = (self._head - self._count) % self._size
+        if start + self._count <= self._size:
+            return self._data[start:start + self._count].copy()
+        return numpy.concatenate((self._data[start:],
+                                  self._data[:self._head]))
+
+    def clear(self):
+        """Remove all records from the buffer."""
+        self._head = 0
+        self._count = 0
+
+    def write(self, f):
+        """Write all records to a file and clear the buffer.
+
+        If the file is empty, a header is written first. Thus, the same file
+        can be used for multiple writes.
+
+        Parameters
+        ----------
+        f : file
+            A file object opened in binary append mode.
+        """
+        if f.tell() == 0:
+            header = json.dumps({"dtype": self._data.dtype.descr}).encode()
+            f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(self.get().tobytes())
+        self.clear()
+
+def load(path):
+    """Load records that were written by :py:func:`RingBuffer.write`.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+
+    Returns
+    -------
+    numpy.ndarray
+        The records stored in the file.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a ring buffer file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a ring buffer file".format(path))
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length).decode())
+        dtype = numpy.dtype([tuple(x) for x in header["dtype"]])
+        return numpy.fromfile(f, dtype=dtype)
@@ -0,0 +1,201 @@
+# tenjint - VMI Python Library
+#
+# Copyright (C) 2020 Bedrock Systems, Inc
+# Authors: Sebastian Vogl <sebastian@bedrocksystems.com>
+#          Jonas Pfoh <jonas@bedrocksystems.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Fast symbol lookups.
+
+This module provides a symbol index that allows to look up the addresses of
+symbols by name, to find the nearest symbol for an address, and to symbolize
+large arrays of addresses at once. The index is built once and can be stored
+to and loaded from disk.
+"""
+
+import bisect
+
+import numpy
+
+class SymbolIndex(object):
+    """An index of symbols sorted by address and by name.
+
+    Addresses are kept in a sorted numpy array, such that the nearest symbol
+    of an address can be found with a binary search. Exact name lookups use a
+    dictionary, prefix lookups use a sorted list of names.
+    """
+    def __init__(self, names, addresses):
+        """Create a new symbol index.
+
+        Parameters
+        ----------
+        names : list of str
+            The names of the symbols.
+        addresses : list of int or numpy.ndarray
+            The addresses of the symbols in the same order as the names.
+        """
+        super().__init__()
+        names = numpy.asarray(names, dtype=str)
+        addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+
+        order = numpy.argsort(addresses, kind="stable")
+        self._addresses = addresses[order]
+        self._names = names[order]
+        self._by_name = dict(zip(names.tolist(), addresses.tolist()))
+        self._sorted_names = sorted(self._by_name.keys())
+
+    def __len__(self):
+        return len(self._addresses)
+
+    @property
+    def range(self):
+        """The lowest and the highest address in the index."""
+        if not len(self._addresses):
+            return (None, None)
+        return (int(self._addresses[0]), int(self._addresses[-1]))
+
+    def address(self, name):
+        """Get the address of a symbol.
+
+        Parameters
+        ----------
+        name : str
+            The name of the symbol.
+
+        Returns
+        -------
+        int or None
+            The address of the symbol or None if the symbol is unknown.
+        """
+        return self._by_name.get(name, None)
+
+    def names_with_prefix(self, prefix):
+        """Get all symbols whose name starts with the given prefix.
+
+        Parameters
+        ----------
+        prefix : str
+            The prefix to search for.
+
+        Returns
+        -------
+        list
+            The names of all matching symbols in sorted order.
+        """
+        rv = list()
+        i = bisect.bisect_left(self._sorted_names, prefix)
+        while (i < len(self._sorted_names) and
+                self._sorted_names[i].startswith(prefix)):
+            rv.append(self._sorted_names[i])
+            i += 1
+        return rv
+
+    def nearest(self, address):
+        """Get the symbols that are closest to an address.
+
+        Only symbols at or below the address are considered.
+
+        Parameters
+        ----------
+        address : int
+            The address to symbolize.
+
+        Returns
+        -------
+        list
+            The names of all symbols located at the nearest address or an empty
+            list if there is no symbol below the address.
+        """
+        end = numpy.searchsorted(self._addresses, numpy.uint64(address),
+                                 side="right")
+        if end == 0:
+            return list()
+        start = numpy.searchsorted(self._addresses, self._addresses[end - 1],
+                                   side="left")
+        return self._names[start:end].tolist()
+
+    def symbolize(self, addresses):
+        """Symbolize multiple addresses at once.
+
+        Parameters
+        ----------
+        addresses : list of int or numpy.ndarray
+            The addresses to symbolize.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            The names of the nearest symbols and the offsets of the addresses
+            from these symbols. If there is no symbol below an address, its
+            name is an empty string and its offset is the address itself.
+        """
+        addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+        idx = numpy.searchsorted(self._addresses, addresses, side="right") - 1
+        found = idx >= 0
+        idx[~found] = 0
+
+        if len(self._addresses):
+            # Use the first symbol for addresses with multiple symbols
+            first = numpy.searchsorted(self._addresses, self._addresses[idx],
+                                       side="left")
+            names = self._names[first]
+            offsets = addresses - self._addresses[idx]
+        else:
+            names = numpy.zeros(len(addresses), dtype=str)
+            offsets = addresses.copy()
+            found[:] = False
+
+        names[~found] = ""
+        offsets[~found] = addresses[~found]
+        return names, offsets
+
+    def save(self, path, slide=0):
+        """Store the index in a file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the file.
+        slide : int, optional
+            A value that is subtracted from all addresses before they are
+            stored, e.g., a KASLR slide.
+        """
+        addresses = self._addresses
+        if slide:
+            addresses = addresses - numpy.uint64(slide)
+        with open(path, "wb") as f:
+            numpy.savez(f, names=self._names, addresses=addresses)
+
+    @classmethod
+    def load(cls, path, slide=0):
+        """Load an index from a file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the file.
+        slide : int, optional
+            A value that is added to all addresses, e.g., a KASLR slide.
+
+        Returns
+        -------
+        SymbolIndex
+            The loaded index.
+        """
+        with numpy.load(path, allow_pickle=False) as data:
+            addresses = data["addresses"]
+            if slide:
+                addresses = addresses + numpy.uint64(slide)
+            return cls(data["names"], addresses)
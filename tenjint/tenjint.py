@@ -35,11 +35,18 @@ from .plugins import plugins
 from .plugins import machine
 from .plugins import taskswitch
 from .plugins import slp
+from .plugins import snapshot
 from .plugins import singlestep
 from .plugins import breakpoint
+from .plugins import itrace
+from .plugins import lbr
 from .plugins import interactive
 from .plugins import operatingsystem
+from .plugins import modules
 from .plugins import fargs
+from .plugins import unwind
+from .plugins import ftrace
+from .plugins import systrace
 from .plugins import finject
 
 def run(configs=None):
@@ -66,11 +73,18 @@ def init(configs):
     pm = service.manager().get("PluginManager")
     pm.load_module(machine)
     pm.load_module(operatingsystem)
+    pm.load_module(modules)
     pm.load_module(taskswitch)
     pm.load_module(slp)
+    pm.load_module(snapshot)
     pm.load_module(singlestep)
     pm.load_module(breakpoint)
+    pm.load_module(itrace)
+    pm.load_module(lbr)
     pm.load_module(fargs)
+    pm.load_module(unwind)
+    pm.load_module(ftrace)
+    pm.load_module(systrace)
     logger.debug("loading finject")
     pm.load_module(finject)
     pm.load_module(interactive)